@@ -0,0 +1,75 @@
+"""
+Rows/sec of `bulk_loader.bulk_load` against `bulk_loader.replace_tables`, the default
+`to_sql(if_exists='replace')` path, loading the same tables into a local SQLite file.
+
+`replace_tables` writes bare tables, while `bulk_load` also writes the keys, the secondary
+indexes, the R*Tree of the coordinates and the market statistics. The time of the
+R*Tree, measured by rebuilding it on the loaded file, is reported apart.
+
+    python benchmarks/bench_db_load.py --rows 200000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import mysql.connector  # noqa: F401  (load_db_pandas imports it at module level)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import load_db_pandas
+from bulk_loader import bulk_load, replace_tables, TABLE_NAMES
+from geo import SPATIAL_INDEX_TABLE, rebuild_spatial_index
+from synthetic import synthetic_listings
+
+
+def default_load(tables_list: list, path: str):
+    db_connection = sqlite3.connect(path)
+    replace_tables(tables_list, db_connection, TABLE_NAMES)
+    db_connection.close()
+
+
+def current_load(tables_list: list, path: str):
+    db_connection = sqlite3.connect(path)
+    bulk_load(tables_list, db_connection, TABLE_NAMES)
+    db_connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    args = parser.parse_args()
+
+    df = synthetic_listings(args.rows).drop_duplicates(subset='id')
+    tables_list = load_db_pandas.create_tables(load_db_pandas.impute_values(df))
+    rows = sum(len(table) for table in tables_list)
+
+    results = {"rows": rows}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, load in (("replace_tables", default_load), ("bulk_load", current_load)):
+            elapsed = float("inf")
+            for run in range(args.repeat):
+                path = os.path.join(directory, f"{name}-{run}.db")
+                start = time.perf_counter()
+                load(tables_list, path)
+                elapsed = min(elapsed, time.perf_counter() - start)
+            with sqlite3.connect(path) as connection:
+                assert connection.execute(f"SELECT COUNT(*) FROM {TABLE_NAMES[0]}").fetchone()[0] == len(tables_list[0])
+            results[f"{name}_rows_per_s"] = round(rows / elapsed)
+        connection = sqlite3.connect(path, isolation_level=None)
+        connection.execute("BEGIN")
+        connection.execute(f"DELETE FROM {SPATIAL_INDEX_TABLE}")
+        start = time.perf_counter()
+        rebuild_spatial_index(connection.cursor(), TABLE_NAMES[0], True)
+        spatial_seconds = time.perf_counter() - start
+        connection.execute("ROLLBACK")
+        connection.close()
+    results["speedup"] = round(results["bulk_load_rows_per_s"] / results["replace_tables_rows_per_s"], 2)
+    results["bulk_load_seconds"] = round(elapsed, 3)
+    results["spatial_index_seconds"] = round(spatial_seconds, 3)
+    results["bulk_load_without_spatial_index_rows_per_s"] = round(rows / (elapsed - spatial_seconds))
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,119 @@
+"""
+Deduplication by listing id during the extraction against transforming every hit
+and dropping full-row duplicates in `impute_values`, on synthetic result pages
+where the order shifts between pages (the first hits of a page repeat the end of
+the previous one) and listings come back in several property type queries.
+
+Both paths must give the same cleaned listings. The seen-set of ids and the Bloom
+filter are compared on memory and on the new listings the filter drops by mistake. The
+ids are created while the memory is traced, as they are when parsed from the responses,
+so the memory of the set includes the strings it keeps alive.
+
+    python benchmarks/bench_dedup.py --listings 200000 --overlap 4 --cross 0.05
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import mysql.connector  # noqa: F401  (imported before pandas, see bench_db_load.py)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web_scraping_real_estate as scraper
+from dedup import BloomFilter, SeenSet
+from stub_server import make_hit
+from transform_engine import LISTING_COLUMNS, Deduplicate, apply_rules, cast_to_plan, CLEANING_RULES
+
+
+def synthetic_pages(listings: int, overlap: int, cross: float, seed: int = 0) -> list:
+    """
+    Result pages of `scraper.ROWS` hits over `listings` listings, where every page
+    repeats the last `overlap` hits of the previous one and a `cross` share of the
+    listings is served again at the end, as if found by another property type query.
+    """
+    rng = random.Random(seed)
+    hits = [make_hit(f"L-{position}", "Bogotá", 2, random.Random(position)) for position in range(listings)]
+    fresh = scraper.ROWS - overlap
+    pages = []
+    for start in range(0, listings, fresh):
+        first = max(0, start - overlap)
+        pages.append(hits[first:start + fresh])
+    repeated = rng.sample(hits, int(listings * cross))
+    pages.extend(repeated[start:start + scraper.ROWS] for start in range(0, len(repeated), scraper.ROWS))
+    return pages
+
+
+def cleaned(pages, rules) -> tuple:
+    gc.collect()
+    start = time.perf_counter()
+    df = scraper.to_frame(list(scraper.iter_transform(pages)))
+    df = cast_to_plan(apply_rules(df, "pandas", rules), "pandas")
+    return df, time.perf_counter() - start
+
+
+def fill(dedup, keys):
+    for key in keys:
+        dedup.add(key)
+    return dedup
+
+
+def traced(build) -> tuple:
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listings", type=int, default=200_000)
+    parser.add_argument("--overlap", type=int, default=4, help="Hits of a page repeated from the previous one")
+    parser.add_argument("--cross", type=float, default=0.05, help="Share of the listings served again by another query")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each path")
+    parser.add_argument("--error-rate", type=float, default=0.001, help="False positive rate of the Bloom filter")
+    args = parser.parse_args()
+
+    pages = synthetic_pages(args.listings, args.overlap, args.cross)
+    hits = sum(map(len, pages))
+
+    # before: every hit is transformed and full rows are compared. The runs alternate
+    # and the best time of each path is kept
+    legacy_rules = [Deduplicate(LISTING_COLUMNS)] + CLEANING_RULES[1:]
+    legacy_seconds = dedup_seconds = float("inf")
+    for _ in range(args.repeat):
+        legacy, seconds = cleaned(pages, legacy_rules)
+        legacy_seconds = min(legacy_seconds, seconds)
+        seen = SeenSet()
+        deduplicated, seconds = cleaned(scraper.dedup_pages(pages, seen), CLEANING_RULES)
+        dedup_seconds = min(dedup_seconds, seconds)
+    assert legacy.sort_values('id').reset_index(drop=True).equals(deduplicated.sort_values('id').reset_index(drop=True)), \
+        "deduplicating by id gives other listings than the full-row deduplication"
+
+    seen_set, set_bytes = traced(lambda: fill(SeenSet(), (f"L-{position:08d}" for position in range(args.listings))))
+    bloom = BloomFilter(args.listings, args.error_rate)
+    start = time.perf_counter()
+    bloom_pages = [bloom.filter(page) for page in pages]
+    bloom_seconds = time.perf_counter() - start
+    false_positives = args.listings - len({hit["_source"]["listing"]["id"] for page in bloom_pages for hit in page})
+
+    results = {
+        "hits": hits,
+        "listings": args.listings,
+        "dedup": seen.report(),
+        "full_row_seconds": round(legacy_seconds, 3),
+        "id_dedup_seconds": round(dedup_seconds, 3),
+        "speedup": round(legacy_seconds / dedup_seconds, 2),
+        "seen_set_bytes_per_listing": round(set_bytes / args.listings, 1),
+        "bloom_bytes_per_listing": round(len(bloom.bits) / args.listings, 2),
+        "bloom_hash_count": bloom.hash_count,
+        "bloom_filter_seconds": round(bloom_seconds, 3),
+        "bloom_false_positives": false_positives,
+        "bloom_false_positive_rate": round(false_positives / args.listings, 5),
+    }
+    print(json.dumps(results, indent=2))
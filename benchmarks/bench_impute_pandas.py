@@ -0,0 +1,57 @@
+"""
+Throughput of the vectorized `load_db_pandas.impute_values` against the previous row-wise
+implementation on synthetic listings. `tests/test_impute_pandas.py` checks that both agree.
+
+    python benchmarks/bench_impute_pandas.py --rows 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import mysql.connector  # noqa: F401  (load_db_pandas imports it at module level)
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import load_db_pandas
+from synthetic import synthetic_listings
+
+
+def legacy_impute_values(df: pd.DataFrame) -> pd.DataFrame:
+    df.drop_duplicates(inplace=True)
+    df.dropna(subset='area', inplace=True)
+
+    df['rooms'] = df.apply(lambda x: 1 if (not(x['rooms']>0) and x['property_type']=='Apartaestudio') else x['rooms'], axis=1)
+    df['rooms'] = df['rooms'].fillna(0)
+
+    df['stratum'] = df.apply(lambda x: 1 if x['stratum']<1 else x['stratum'], axis=1)
+    df['stratum'] = df.apply(lambda x: 6 if x['stratum']>6 else x['stratum'], axis=1)
+
+    return df
+
+
+def timed(func, df: pd.DataFrame) -> tuple:
+    start = time.perf_counter()
+    result = func(df.copy())
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--skip-legacy-above", type=int, default=1_000_000, help="Row-wise implementation is only timed up to this size")
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        df = synthetic_listings(rows)
+        _, current_s = timed(load_db_pandas.impute_values, df)
+        result = {"rows": len(df), "vectorized_rows_per_s": round(len(df) / current_s)}
+        if rows <= args.skip_legacy_above:
+            _, legacy_s = timed(legacy_impute_values, df)
+            result["row_wise_rows_per_s"] = round(len(df) / legacy_s)
+            result["speedup"] = round(legacy_s / current_s, 1)
+        results.append(result)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,54 @@
+"""
+Parse and encode time per page: stdlib `json` with the payload dict rebuilt for
+every page (previous hot loop) against the `json_backend` decoder on raw bytes
+with the pre-serialized payload template.
+
+Pages are recorded fixtures generated by `stub_server.make_page`.
+
+    python benchmarks/bench_json.py --pages 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web_scraping_real_estate as scraper
+import json_backend
+from stub_server import make_page
+
+
+def legacy_page(city_information: dict, property_type: int, page: int, fixture: bytes) -> list:
+    request_json = scraper.build_request_json(city_information, property_type, page)
+    json.dumps(request_json)  # what requests does with json=
+    return json.loads(fixture.decode())["hits"]["hits"]
+
+
+def current_page(city_information: dict, property_type: int, page: int, fixture: bytes) -> list:
+    scraper.request_payload(city_information, property_type, page)
+    return json_backend.loads(fixture)["hits"]["hits"]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    args = parser.parse_args()
+
+    city = scraper.city_information[0]
+    fixtures = [
+        json.dumps({"hits": {"total": {"value": args.pages * scraper.ROWS}, "hits": make_page(city["city"], 2, page, scraper.ROWS, args.pages * scraper.ROWS)}}).encode()
+        for page in range(1, args.pages + 1)
+    ]
+    for page in (1, 7, 123):
+        assert json.loads(scraper.request_payload(city, 2, page)) == scraper.build_request_json(city, 2, page)
+
+    results = {"backend": json_backend.BACKEND, "pages": args.pages}
+    for name, func in (("legacy", legacy_page), ("current", current_page)):
+        start = time.perf_counter()
+        for page, fixture in enumerate(fixtures, 1):
+            func(city, 2, page, fixture)
+        results[f"{name}_us_per_page"] = round((time.perf_counter() - start) / args.pages * 1e6, 1)
+    results["speedup"] = round(results["legacy_us_per_page"] / results["current_us_per_page"], 2)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,149 @@
+"""
+Market statistics maintained by `load_to_db` against computing them from the main
+table, on a local SQLite file loaded with a full load followed by daily incremental
+loads of synthetic listings.
+
+- Query: the price per m² dashboard of the last scrape date, read from the
+  statistics table (`market_summary`) against the same statistics computed from the
+  listings, and against a GROUP BY of the main table giving only counts and means.
+- Refresh: recomputing the partitions of one city, as an incremental load touching
+  it does, against recomputing every partition of the date.
+
+Fails if the statistics kept up to date through the incremental loads differ from
+a full recomputation of the last date.
+
+    python benchmarks/bench_market_stats.py --rows 500000 --days 10 --daily 50000
+"""
+import argparse
+import json
+import math
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from itertools import groupby
+
+import mysql.connector  # noqa: F401  (load_db_pandas imports it at module level)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import load_db_pandas
+from bulk_loader import bulk_load, incremental_load, TABLE_NAMES
+from key_registry import KeyRegistry
+from market_stats import MARKET_STATS_TABLE, market_summary, partition_stats, refresh_market_stats
+from synthetic import synthetic_listings
+
+
+def raw_summary(db_connection, scrape_date: str) -> list:
+    # the statistics of `market_summary` computed from the listings, medians need every price
+    living_space, cities, properties = TABLE_NAMES
+    rows = db_connection.execute(
+        f"SELECT c.city_name, p.property_type, COALESCE(l.stratum, 0), l.price, l.area FROM {living_space} l "
+        f"JOIN {cities} c ON c.city_id = l.city_id JOIN {properties} p ON p.property_type_id = l.property_type_id "
+        f"WHERE l.last_seen = ? ORDER BY c.city_name, p.property_type, COALESCE(l.stratum, 0)", (scrape_date,)).fetchall()
+    summary = []
+    for partition, group in groupby(rows, key=lambda row: row[:3]):
+        stats = partition_stats([row[3:] for row in group])
+        summary.append((*partition, *stats[:4], stats[5]))
+    return summary
+
+
+def raw_means(db_connection, scrape_date: str) -> list:
+    living_space, cities, properties = TABLE_NAMES
+    return db_connection.execute(
+        f"SELECT c.city_name, p.property_type, COALESCE(l.stratum, 0), COUNT(*), AVG(l.price), AVG(l.price / l.area) FROM {living_space} l "
+        f"JOIN {cities} c ON c.city_id = l.city_id JOIN {properties} p ON p.property_type_id = l.property_type_id "
+        f"WHERE l.last_seen = ? GROUP BY 1, 2, 3 ORDER BY 1, 2, 3", (scrape_date,)).fetchall()
+
+
+def best_ms(query, repeat: int) -> tuple:
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = query()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    return result, round(elapsed * 1000, 3)
+
+
+def same(rows: list, other: list) -> bool:
+    return len(rows) == len(other) and all(
+        len(row) == len(other_row) and all(
+            value == other_value or (isinstance(value, float) and math.isclose(value, other_value, rel_tol=1e-9))
+            for value, other_value in zip(row, other_row))
+        for row, other_row in zip(rows, other))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000, help="Listings of the full load")
+    parser.add_argument("--days", type=int, default=5, help="Daily incremental loads after the full load")
+    parser.add_argument("--daily", type=int, default=20_000, help="Listings per incremental load, half of them already stored")
+    parser.add_argument("--repeat", type=int, default=5, help="best of N runs")
+    args = parser.parse_args()
+
+    first_day = date(2024, 5, 1)
+    with tempfile.TemporaryDirectory() as directory:
+        registry = KeyRegistry(os.path.join(directory, "keys.db"))
+
+        def tables(rows: int, seed: int, first_id: int) -> list:
+            df = synthetic_listings(rows, seed=seed, first_id=first_id).drop_duplicates(subset='id')
+            return load_db_pandas.create_tables(load_db_pandas.impute_values(df), registry)
+
+        db_connection = sqlite3.connect(os.path.join(directory, "market.db"))
+        bulk_load(tables(args.rows, 0, 0), db_connection, TABLE_NAMES, load_date=str(first_day))
+        first_id = args.rows
+        for day in range(1, args.days + 1):
+            first_id += args.daily // 2
+            incremental_load(tables(args.daily, day, first_id - args.daily), db_connection, TABLE_NAMES,
+                             load_date=str(first_day + timedelta(days=day)))
+        last_day = str(first_day + timedelta(days=args.days))
+        # a second load of the last day moves listings already seen that day to other partitions
+        merge = incremental_load(tables(args.daily // 4, args.days + 1, first_id - args.daily // 4), db_connection, TABLE_NAMES, load_date=last_day)
+
+        listings = db_connection.execute(f"SELECT COUNT(*) FROM {TABLE_NAMES[0]}").fetchone()[0]
+        dates = db_connection.execute(f"SELECT COUNT(DISTINCT scrape_date), COUNT(*) FROM {MARKET_STATS_TABLE}").fetchone()
+        summary, summary_ms = best_ms(lambda: market_summary(db_connection, TABLE_NAMES, last_day), args.repeat)
+        raw, raw_ms = best_ms(lambda: raw_summary(db_connection, last_day), args.repeat)
+        _, means_ms = best_ms(lambda: raw_means(db_connection, last_day), args.repeat)
+        assert same(summary, raw), "the statistics table differs from the statistics of the listings"
+
+        maintained = db_connection.execute(f"SELECT * FROM {MARKET_STATS_TABLE} WHERE scrape_date = ? ORDER BY 2, 3, 4", (last_day,)).fetchall()
+        cursor = db_connection.cursor()
+        city_partitions = {row[1:4] for row in maintained if row[1] == maintained[0][1]}
+
+        def refresh(partitions):
+            cursor.execute("BEGIN")
+            written = refresh_market_stats(cursor, TABLE_NAMES[0], True, last_day, partitions)
+            cursor.execute("ROLLBACK")
+            return written
+
+        _, city_refresh_ms = best_ms(lambda: refresh(city_partitions), args.repeat)
+        _, full_refresh_ms = best_ms(lambda: refresh(None), args.repeat)
+        cursor.execute("BEGIN")
+        refresh_market_stats(cursor, TABLE_NAMES[0], True, last_day)
+        recomputed = db_connection.execute(f"SELECT * FROM {MARKET_STATS_TABLE} WHERE scrape_date = ? ORDER BY 2, 3, 4", (last_day,)).fetchall()
+        cursor.execute("ROLLBACK")
+        assert same(maintained, recomputed), "the incrementally maintained statistics differ from a full recomputation"
+        plan = db_connection.execute(
+            f"EXPLAIN QUERY PLAN SELECT city_id, property_type_id, stratum, price, area FROM {TABLE_NAMES[0]} "
+            f"WHERE last_seen = ? AND city_id IN (1) ORDER BY city_id, property_type_id, stratum", (last_day,)).fetchall()
+        db_connection.close()
+
+    results = {
+        "listings": listings,
+        "scrape_dates": dates[0],
+        "stat_partitions": dates[1],
+        "last_day_partitions": len(maintained),
+        "same_day_reload": merge,
+        "refresh_plan": [row[-1] for row in plan],
+        "summary_table_ms": summary_ms,
+        "raw_stats_ms": raw_ms,
+        "raw_group_by_means_ms": means_ms,
+        "speedup_vs_raw_stats": round(raw_ms / summary_ms, 1),
+        "speedup_vs_raw_group_by": round(means_ms / summary_ms, 1),
+        "city_refresh_ms": city_refresh_ms,
+        "full_refresh_ms": full_refresh_ms,
+    }
+    print(json.dumps(results, indent=2))
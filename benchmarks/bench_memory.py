@@ -0,0 +1,91 @@
+"""
+Memory per listing of the cleaned records and of the loader DataFrames.
+
+- Records: `data_transform` returns a `Listing` (named tuple) instead of a dict.
+  Both are built from the same value objects, so the difference is the container.
+- DataFrames: the scraper CSV read with inferred dtypes against the dtype plan of
+  `transform_engine.DTYPE_PLAN` (categoricals, int8, float32), as read and once
+  cleaned, for pandas and polars.
+
+    python benchmarks/bench_memory.py --rows 1000000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+import mysql.connector  # noqa: F401  (imported before pandas, see bench_db_load.py)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import polars as pl
+
+from transform_engine import cast_to_plan, column_types
+from web_scraping_real_estate import CSV_COLUMNS, Listing
+from synthetic import write_synthetic_csv
+
+
+def traced_bytes(build) -> tuple:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def per_row(size: int, rows: int) -> float:
+    return round(size / rows, 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    results = {"rows": args.rows}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "listings.csv")
+        lines = write_synthetic_csv(path, args.rows)
+
+        columns = pd.read_csv(path, dtype={'id': str, 'geohash': str}).astype(object).where(lambda df: df.notna(), None)
+        values = [columns[column].tolist() for column in CSV_COLUMNS]
+        del columns
+        dicts, dict_bytes = traced_bytes(lambda: [dict(zip(CSV_COLUMNS, row)) for row in zip(*values)])
+        del dicts
+        records, record_bytes = traced_bytes(lambda: [Listing(*row) for row in zip(*values)])
+        del records, values
+        results["records"] = {
+            "dict_bytes_per_row": per_row(dict_bytes, lines),
+            "listing_bytes_per_row": per_row(record_bytes, lines),
+            "reduction": round(dict_bytes / record_bytes, 2),
+        }
+
+        inferred = pd.read_csv(path, dtype={'id': str})
+        planned = pd.read_csv(path, dtype=column_types("pandas", read=True))
+        cleaned = cast_to_plan(planned, "pandas")
+        inferred_bytes = inferred.memory_usage(deep=True).sum()
+        results["pandas"] = {
+            "inferred_bytes_per_row": per_row(inferred_bytes, lines),
+            "plan_read_bytes_per_row": per_row(planned.memory_usage(deep=True).sum(), lines),
+            "plan_bytes_per_row": per_row(cleaned.memory_usage(deep=True).sum(), lines),
+            "reduction": round(inferred_bytes / cleaned.memory_usage(deep=True).sum(), 2),
+            "inferred_dtypes": {column: str(dtype) for column, dtype in inferred.dtypes.items()},
+            "plan_dtypes": {column: str(dtype) for column, dtype in cleaned.dtypes.items()},
+        }
+        del inferred, planned, cleaned
+
+        inferred = pl.read_csv(path, schema_overrides={'id': pl.String})
+        planned = pl.read_csv(path, schema_overrides=column_types("polars", read=True))
+        cleaned = cast_to_plan(planned, "polars")
+        results["polars"] = {
+            "inferred_bytes_per_row": per_row(inferred.estimated_size(), lines),
+            "plan_read_bytes_per_row": per_row(planned.estimated_size(), lines),
+            "plan_bytes_per_row": per_row(cleaned.estimated_size(), lines),
+            "reduction": round(inferred.estimated_size() / cleaned.estimated_size(), 2),
+        }
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,89 @@
+"""
+Compares the end-of-pagination detection of the crawl against the previous one
+(full-page equality, stopping one page after the end).
+
+Pages are served in-process from `stub_server.make_page`, so the numbers only
+contain the client side: request count and CPU spent decoding and comparing pages
+per property type.
+
+    python benchmarks/bench_pagination.py --hits 2000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web_scraping_real_estate as scraper
+from stub_server import make_page
+
+
+def make_get_data(total_hits: int, counter: list):
+    cache = {}
+
+    def get_data(url, request_json, retry_policy=None):
+        counter[0] += 1
+        if isinstance(request_json, bytes):
+            request_json = json.loads(request_json)
+        params = request_json["variables"]["params"]
+        key = (params["locations"][0]["name"], params["property_type_id"][0], params["page"])
+        if key not in cache:
+            hits = make_page(key[0], key[1], key[2], scraper.ROWS, total_hits)
+            cache[key] = json.dumps({"hits": {"total": {"value": total_hits}, "hits": hits}})
+        return 200, cache[key]
+
+    return get_data
+
+
+def legacy_extract(city_information: dict, property_type: int) -> list:
+    raw_data = []
+    last_response_body = {}
+    page = 1
+    while True:
+        request_json = scraper.build_request_json(city_information, property_type, page)
+        status_code, response_text = scraper.get_data(scraper.URL, request_json)
+        response_body = json.loads(response_text)["hits"]["hits"]
+        if response_body == last_response_body:
+            break
+        raw_data.append(response_body)
+        page += 1
+        last_response_body = response_body
+    return raw_data
+
+
+def current_extract(city_information: dict, property_type: int) -> list:
+    return list(scraper.iter_pages(city_information, [property_type]))
+
+
+def measure(extract, city_information: dict, property_type: int, total_hits: int) -> dict:
+    counter = [0]
+    scraper.get_data = make_get_data(total_hits, counter)
+    extract(city_information, property_type)  # warm the page cache
+    counter[0] = 0
+    start = time.process_time()
+    pages = extract(city_information, property_type)
+    cpu = time.process_time() - start
+    return {"requests": counter[0], "cpu_s": round(cpu, 4), "hits": sum(len(page) for page in pages)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=int, default=2000, help="Listings per property type")
+    args = parser.parse_args()
+
+    sys.stdout = open(os.devnull, "w")
+    results = {}
+    city = scraper.city_information[0]
+    for property_type in scraper.property_type_id:
+        legacy = measure(legacy_extract, city, property_type, args.hits)
+        current = measure(current_extract, city, property_type, args.hits)
+        results[property_type] = {
+            "legacy": legacy,
+            "current": current,
+            "requests_saved": legacy["requests"] - current["requests"],
+            "cpu_saved_s": round(legacy["cpu_s"] - current["cpu_s"], 4),
+        }
+    sys.stdout = sys.__stdout__
+    print(json.dumps(results, indent=2))
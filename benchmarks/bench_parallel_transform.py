@@ -0,0 +1,49 @@
+"""
+Scaling of `data_transform_parallel` from 1 to N worker processes against the
+single-process transform (`data_transform` per hit, then `to_frame`), on synthetic hits.
+Every result is checked against the single-process frame.
+
+    python benchmarks/bench_parallel_transform.py --hits 500000 --workers 1 2 4 8 --chunk-size 5000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web_scraping_real_estate as scraper
+from stub_server import make_page
+
+
+def synthetic_hits(hits: int) -> list:
+    pages = -(-hits // scraper.ROWS)
+    raw = []
+    for page in range(1, pages + 1):
+        raw.extend(make_page("Bogotá", 1 + page % 3, page, scraper.ROWS, hits))
+    return raw[:hits]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, cores}))
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    raw = synthetic_hits(args.hits)
+    expected, serial_s = timed(lambda: scraper.to_frame([scraper.data_transform(hit) for hit in raw]))
+    results = {"hits": len(raw), "cores": cores, "chunk_size": args.chunk_size, "single_process_s": round(serial_s, 3), "parallel": []}
+    for workers in args.workers:
+        df, seconds = timed(lambda: scraper.data_transform_parallel(raw, workers, args.chunk_size))
+        assert df.equals(expected), f"parallel transform with {workers} workers differs"
+        results["parallel"].append({"workers": workers, "seconds": round(seconds, 3), "speedup": round(serial_s / seconds, 2)})
+    print(json.dumps(results, indent=2))
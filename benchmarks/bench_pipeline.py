@@ -0,0 +1,193 @@
+"""
+End-to-end benchmark of the scraper and the loaders, without network or database server.
+
+- Scraper: `data_extract` (sequential and concurrent), `data_transform` and
+  `data_load` run against a local `SearchStubServer` with the given latency and
+  error rate.
+- Loaders: synthetic listings are written at each scale, then every engine of
+  `transform_engine` reads, cleans, builds the tables and loads them into a
+  temporary SQLite file (Spark stops after building the tables, its JDBC writer
+  needs the drivers of `get_spark`).
+
+Results are printed as JSON and can be saved with `--output`. With `--baseline`
+the stage times are compared to a previous result and slower stages are reported.
+
+    python benchmarks/bench_pipeline.py --hits 2000 --latency 0.01 --error-rate 0.02 --rows 10000 100000 1000000 --output results.json
+    python benchmarks/bench_pipeline.py --baseline results.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import mysql.connector  # noqa: F401  (imported before pandas, see bench_db_load.py)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web_scraping_real_estate as scraper
+from key_registry import KeyRegistry
+from retry_policy import configure_retry_policy
+from stub_server import SearchStubServer
+from transform_engine import Executor, available_engines
+from synthetic import write_synthetic_csv
+
+REGRESSION_RATIO = 1.2
+# stages shorter than this are too noisy to be reported as regressions
+REGRESSION_MIN_SECONDS = 0.05
+
+
+def timed(func, *args, **kwargs) -> tuple:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def stage(seconds: float, rows: int) -> dict:
+    return {"seconds": round(seconds, 4), "rows": rows, "rows_per_s": round(rows / seconds) if seconds else None}
+
+
+def bench_scraper(hits: int, latency: float, error_rate: float, concurrency: int) -> dict:
+    cities = scraper.city_information
+    property_types = scraper.property_type_id
+    results = {}
+    with SearchStubServer(total_hits=hits, latency=latency, error_rate=error_rate) as server:
+        raw, seconds = timed(lambda: [hit for city in cities for hit in scraper.data_extract(city, property_types, url=server.url)])
+        results["data_extract"] = {**stage(seconds, len(raw)), "requests": server.request_count}
+
+        requests_before = server.request_count
+        raw_async, seconds = timed(lambda: asyncio.run(scraper.data_extract_async(cities, property_types, concurrency, url=server.url)))
+        results["data_extract_async"] = {**stage(seconds, len(raw_async)), "requests": server.request_count - requests_before, "concurrency": concurrency}
+
+    cleaned, seconds = timed(lambda: [scraper.data_transform(hit) for hit in raw])
+    results["data_transform"] = stage(seconds, len(cleaned))
+
+    with tempfile.TemporaryDirectory() as directory:
+        _, seconds = timed(lambda: scraper.data_load(scraper.to_frame(cleaned), path=os.path.join(directory, "listings.csv")))
+        results["data_load"] = stage(seconds, len(cleaned))
+    return results
+
+
+def bench_loaders(rows: int, engines: list[str], directory: str) -> dict:
+    path = os.path.join(directory, f"listings_{rows}.csv")
+    lines, seconds = timed(write_synthetic_csv, path, rows)
+    results = {"generate": stage(seconds, lines)}
+    for engine in engines:
+        spark = None
+        if engine == "spark":
+            try:
+                from pyspark.sql import SparkSession
+                spark = SparkSession.builder.master("local[*]").getOrCreate()
+            except Exception as error:
+                print(f"Skipping spark: {error}", file=sys.stderr)
+                continue
+        executor = Executor(engine, spark=spark)
+        registry = KeyRegistry(os.path.join(directory, f"keys_{engine}_{rows}.db"))
+        df, read_seconds = timed(executor.read, path)
+        df, clean_seconds = timed(executor.clean, df)
+        tables_list, tables_seconds = timed(executor.create_tables, df, registry)
+        if engine == "spark":
+            # Spark is lazy: materialize the tables so the time of the plan is counted
+            tables_list, collect_seconds = timed(lambda: [table.toPandas() for table in tables_list])
+            tables_seconds += collect_seconds
+            load_seconds = None
+        else:
+            db_connection = sqlite3.connect(os.path.join(directory, f"{engine}_{rows}.db"))
+            _, load_seconds = timed(executor.module.load_to_db, tables_list, db_connection, executor.module.TABLE_NAMES)
+        output_rows = len(tables_list[0])
+        results[engine] = {
+            "read": stage(read_seconds, lines),
+            "impute_values": stage(clean_seconds, lines),
+            "create_tables": stage(tables_seconds, output_rows),
+            "load_to_db": stage(load_seconds, output_rows) if load_seconds is not None else None,
+        }
+        registry.close()
+        os.remove(os.path.join(directory, f"keys_{engine}_{rows}.db"))
+    os.remove(path)
+    return results
+
+
+def stage_times(results: dict, prefix: str = "") -> dict:
+    """
+    Flattens the results into `section/stage` -> seconds.
+    """
+    times = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            if "seconds" in value:
+                times[prefix + key] = value["seconds"]
+            else:
+                times.update(stage_times(value, f"{prefix}{key}/"))
+    return times
+
+
+def compare(results: dict, baseline: dict, ratio: float = REGRESSION_RATIO) -> list[dict]:
+    """
+    Stages at least `ratio` times slower than in the baseline, ignoring the ones
+    shorter than `REGRESSION_MIN_SECONDS`.
+    """
+    current = stage_times({"scraper": results.get("scraper", {}), "loaders": results.get("loaders", {})})
+    previous = stage_times({"scraper": baseline.get("scraper", {}), "loaders": baseline.get("loaders", {})})
+    regressions = []
+    for name, seconds in current.items():
+        if previous.get(name) and seconds >= REGRESSION_MIN_SECONDS and seconds / previous[name] >= ratio:
+            regressions.append({"stage": name, "seconds": seconds, "baseline_seconds": previous[name], "ratio": round(seconds / previous[name], 2)})
+    return regressions
+
+
+def metadata(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "cores": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=int, default=1000, help="Listings served per city and property type")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the stub waits before answering")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 504")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000], help="Scales of the loader benchmark, 10k to 10M")
+    parser.add_argument("--engines", nargs="+", default=[engine for engine in available_engines() if engine != "spark"])
+    parser.add_argument("--skip-scraper", action="store_true")
+    parser.add_argument("--skip-loaders", action="store_true")
+    parser.add_argument("--output", help="File to save the results to")
+    parser.add_argument("--baseline", help="Previous results to compare against")
+    args = parser.parse_args()
+
+    # retries back off quickly so injected errors measure the retry path, not the sleeps
+    configure_retry_policy(base_delay=0.01, max_delay=0.1)
+
+    results = {"meta": metadata(args)}
+    if not args.skip_scraper:
+        # progress messages of the scraper go to stderr, stdout only carries the JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            results["scraper"] = bench_scraper(args.hits, args.latency, args.error_rate, args.concurrency)
+    if not args.skip_loaders:
+        with tempfile.TemporaryDirectory() as directory:
+            results["loaders"] = {str(rows): bench_loaders(rows, args.engines, directory) for rows in args.rows}
+    if args.baseline:
+        with open(args.baseline) as file:
+            results["regressions"] = compare(results, json.load(file))
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
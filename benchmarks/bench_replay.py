@@ -0,0 +1,78 @@
+"""
+Compares a crawl against the stub search service with the replay of the same crawl
+from the response cache: both transform and write the CSV, the replay sends no
+request. Fails if the two CSV files differ, then reports the cache size against
+the raw responses and what eviction removes.
+
+    python benchmarks/bench_replay.py --hits 2000 --latency 0.01
+"""
+import argparse
+import contextlib
+import filecmp
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web_scraping_real_estate as scraper
+from response_cache import CODEC, configure_response_cache
+from stub_server import SearchStubServer
+
+
+def timed(func, *args, **kwargs) -> tuple:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=int, default=1000, help="Listings served per city and property type")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the stub waits before answering")
+    args = parser.parse_args()
+
+    today = str(date.today())
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(sys.stderr):
+        cache = configure_response_cache(os.path.join(directory, "cache"), ttl_days=30)
+        crawl_path = os.path.join(directory, "crawl.csv")
+        replay_path = os.path.join(directory, "replay.csv")
+        with SearchStubServer(total_hits=args.hits, latency=args.latency) as server:
+            pages = scraper.iter_crawl(scraper.city_information, scraper.property_type_id, url=server.url)
+            rows, crawl_seconds = timed(scraper.data_load_stream, scraper.iter_transform(pages), crawl_path)
+            requests = server.request_count
+        raw_bytes = cache.connection.execute("SELECT SUM(raw_size) FROM objects").fetchone()[0]
+        cache_bytes = cache.size()
+
+        configure_response_cache(None)
+        cache = configure_response_cache(os.path.join(directory, "cache"), ttl_days=30)
+        replayed, replay_seconds = timed(scraper.data_load_stream, scraper.iter_transform(scraper.iter_replay(today, cache)), replay_path)
+        identical = filecmp.cmp(crawl_path, replay_path, shallow=False)
+
+        # the same crawl recorded 40 days ago shares every blob, the TTL only drops its index rows
+        old_day = str(date.today() - timedelta(days=40))
+        cache.connection.execute("INSERT INTO responses SELECT ?, city_id, city, property_type, page, digest, sequence, stored_at FROM responses WHERE scrape_date = ?", (old_day, today))
+        cache.connection.commit()
+        ttl_eviction = cache.evict()
+        cache.max_bytes = 0
+        size_eviction = cache.evict()
+
+    results = {
+        "codec": CODEC,
+        "rows": rows,
+        "requests": requests,
+        "crawl_seconds": round(crawl_seconds, 4),
+        "replay_seconds": round(replay_seconds, 4),
+        "replay_rows_per_s": round(replayed / replay_seconds) if replay_seconds else None,
+        "identical_csv": identical,
+        "raw_bytes": raw_bytes,
+        "cache_bytes": cache_bytes,
+        "compression_ratio": round(raw_bytes / cache_bytes, 2) if cache_bytes else None,
+        "ttl_eviction": ttl_eviction,
+        "size_eviction": size_eviction,
+    }
+    print(json.dumps(results, indent=2))
+    assert identical, "replay produced a different CSV"
@@ -0,0 +1,79 @@
+"""
+Crawls the stub search service with the sharded scheduler and compares the merged
+output with the sequential crawl. Fails if the two CSV files differ.
+
+Before the workers start, a shard is claimed by a worker that never reports back:
+its lease expires and another worker crawls it, which the result checks.
+
+    python benchmarks/bench_scheduler.py --hits 2000 --latency 0.02 --workers 4
+"""
+import argparse
+import contextlib
+import filecmp
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web_scraping_real_estate as scraper
+from crawl_scheduler import WorkQueue, merge_outputs, run_workers
+from stub_server import SearchStubServer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=int, default=1000, help="Listings served per city and property type")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds the stub waits before answering")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--pages-per-shard", type=int, default=10)
+    parser.add_argument("--lease-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    scope = scraper.load_scope(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), scraper.SCOPE_FILE))
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(sys.stderr), \
+            SearchStubServer(total_hits=args.hits, latency=args.latency) as server:
+        sequential_path = os.path.join(directory, "sequential.csv")
+        start = time.perf_counter()
+        pages = scraper.iter_crawl(scope["cities"], scope["property_types"], url=server.url)
+        rows = scraper.data_load_stream(scraper.iter_transform(pages), sequential_path)
+        sequential_seconds = time.perf_counter() - start
+        sequential_requests = server.request_count
+
+        queue_path = os.path.join(directory, "queue.db")
+        queue = WorkQueue(queue_path, lease_seconds=args.lease_seconds)
+        planned = queue.plan(scope["cities"], scope["property_types"], args.pages_per_shard)
+        abandoned = queue.claim("dead-worker")
+
+        start = time.perf_counter()
+        exit_codes = run_workers(args.workers, queue_path, url=server.url, output_dir=os.path.join(directory, "shards"),
+                                 pages_per_shard=args.pages_per_shard, lease_seconds=args.lease_seconds, poll_seconds=0.1)
+        scheduled_seconds = time.perf_counter() - start
+        merged_path = os.path.join(directory, "merged.csv")
+        merged = merge_outputs(queue, merged_path)
+        recovered = queue.connection.execute(
+            "SELECT status, attempts, owner FROM shards WHERE shard_id = ?", (abandoned["shard_id"],)).fetchone()
+        owners = queue.connection.execute("SELECT COUNT(DISTINCT owner) FROM shards WHERE status = 'done'").fetchone()[0]
+        counts = queue.counts()
+        identical = filecmp.cmp(sequential_path, merged_path, shallow=False)
+
+    assert exit_codes == [0] * args.workers, f"workers exited with {exit_codes}"
+    assert identical, "the merged shards differ from the sequential crawl"
+    assert recovered[0] == "done" and recovered[1] == 2, f"the abandoned shard was not taken over: {recovered}"
+    results = {
+        "rows": rows,
+        "workers": args.workers,
+        "planned_shards": planned,
+        "shards": counts,
+        "workers_with_shards": owners,
+        "abandoned_shard_attempts": recovered[1],
+        "requests": server.request_count - sequential_requests,
+        "sequential_requests": sequential_requests,
+        "sequential_seconds": round(sequential_seconds, 3),
+        "scheduled_seconds": round(scheduled_seconds, 3),
+        "speedup": round(sequential_seconds / scheduled_seconds, 2),
+        "identical_csv": identical,
+    }
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,95 @@
+"""
+Radius queries ("listings within 2 km of a point") through the R*Tree spatial index
+against full scans of the main table, on synthetic listings loaded into a local
+SQLite file. Fails if the index and the scans return different listings.
+
+Two scans are compared: reading every coordinate and computing the distance in
+Python, and a bounding box filter in SQL with no index.
+
+    python benchmarks/bench_spatial.py --rows 1000000 --queries 200 --radius 2
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import mysql.connector  # noqa: F401  (load_db_pandas imports it at module level)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import load_db_pandas
+from bulk_loader import bulk_load, TABLE_NAMES
+from geo import SPATIAL_INDEX_TABLE, bounding_box, haversine_km, listings_within
+from synthetic import CITY_CENTERS, synthetic_listings
+
+
+def scan_all(db_connection, latitude: float, longitude: float, radius_km: float) -> list:
+    rows = db_connection.execute(f"SELECT id, latitude, longitude FROM {TABLE_NAMES[0]} WHERE latitude IS NOT NULL").fetchall()
+    distances = [(listing_id, haversine_km(latitude, longitude, row_latitude, row_longitude)) for listing_id, row_latitude, row_longitude in rows]
+    return sorted([row for row in distances if row[1] <= radius_km], key=lambda row: row[1])
+
+
+def scan_box(db_connection, latitude: float, longitude: float, radius_km: float) -> list:
+    min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(latitude, longitude, radius_km)
+    rows = db_connection.execute(
+        f"SELECT id, latitude, longitude FROM {TABLE_NAMES[0]} WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?",
+        (min_latitude, max_latitude, min_longitude, max_longitude)).fetchall()
+    distances = [(listing_id, haversine_km(latitude, longitude, row_latitude, row_longitude)) for listing_id, row_latitude, row_longitude in rows]
+    return sorted([row for row in distances if row[1] <= radius_km], key=lambda row: row[1])
+
+
+def run(query, db_connection, centers: list, radius_km: float) -> tuple:
+    start = time.perf_counter()
+    results = [query(db_connection, latitude, longitude, radius_km) for latitude, longitude in centers]
+    return results, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--radius", type=float, default=2.0, help="Radius of the queries in km")
+    parser.add_argument("--scan-queries", type=int, default=10, help="Queries run with the full scan, which is slow")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    centers = [(latitude + rng.gauss(0, 0.05), longitude + rng.gauss(0, 0.05))
+               for latitude, longitude in rng.choices(list(CITY_CENTERS.values()), k=args.queries)]
+
+    df = synthetic_listings(args.rows).drop_duplicates(subset='id')
+    tables_list = load_db_pandas.create_tables(load_db_pandas.impute_values(df))
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_connection = sqlite3.connect(os.path.join(directory, "spatial.db"))
+        start = time.perf_counter()
+        written = bulk_load(tables_list, db_connection, TABLE_NAMES)
+        load_seconds = time.perf_counter() - start
+
+        plan = db_connection.execute(
+            f"EXPLAIN QUERY PLAN SELECT id FROM {SPATIAL_INDEX_TABLE} "
+            f"WHERE min_latitude <= 1 AND max_latitude >= 0 AND min_longitude <= 1 AND max_longitude >= 0").fetchall()
+        indexed, indexed_seconds = run(listings_within, db_connection, centers, args.radius)
+        box, box_seconds = run(scan_box, db_connection, centers, args.radius)
+        scanned, scan_seconds = run(scan_all, db_connection, centers[:args.scan_queries], args.radius)
+        db_connection.close()
+
+    assert indexed == box, "the spatial index and the bounding box scan returned different listings"
+    assert indexed[:args.scan_queries] == scanned, "the spatial index and the full scan returned different listings"
+    results = {
+        "rows": len(tables_list[0]),
+        "indexed_rows": written[SPATIAL_INDEX_TABLE],
+        "load_seconds": round(load_seconds, 3),
+        "radius_km": args.radius,
+        "mean_matches": round(sum(map(len, indexed)) / len(indexed), 1),
+        "query_plan": [row[-1] for row in plan],
+        "rtree_ms_per_query": round(indexed_seconds / len(centers) * 1000, 3),
+        "box_scan_ms_per_query": round(box_seconds / len(centers) * 1000, 3),
+        "full_scan_ms_per_query": round(scan_seconds / len(scanned) * 1000, 3),
+    }
+    results["speedup_vs_box_scan"] = round(results["box_scan_ms_per_query"] / results["rtree_ms_per_query"], 1)
+    results["speedup_vs_full_scan"] = round(results["full_scan_ms_per_query"] / results["rtree_ms_per_query"], 1)
+    print(json.dumps(results, indent=2))
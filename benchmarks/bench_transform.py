@@ -0,0 +1,63 @@
+"""
+Microbenchmark of the compiled field extractor against the previous hand-written
+`data_transform` on synthetic hits.
+
+    python benchmarks/bench_transform.py --hits 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web_scraping_real_estate as scraper
+from geo import coordinate, geohash
+from stub_server import make_page
+
+
+def legacy_transform(raw_data: dict) -> dict:
+    cleaned_element = {}
+    cleaned_element['id'] = raw_data['_source']['listing']['id']
+    cleaned_element['price'] = raw_data['_source']['listing']['price']['amount']
+    cleaned_element['area'] = raw_data['_source']['listing']['m2']
+    cleaned_element['rooms'] = raw_data['_source']['listing']['technicalSheet'][7]['value']
+    cleaned_element['bathrooms'] = raw_data['_source']['listing']['bathrooms']
+    cleaned_element['garage'] = raw_data['_source']['listing']['garage']
+    cleaned_element['property_type'] = raw_data['_source']['listing']['property_type']['name']
+    cleaned_element['stratum'] = raw_data['_source']['listing']['stratum']
+    location_point = raw_data['_source']['listing']['locations']['location_point']
+    cleaned_element['latitude'] = coordinate(location_point['coordinates'][1], 90)
+    cleaned_element['longitude'] = coordinate(location_point['coordinates'][0], 180)
+    cleaned_element['geohash'] = geohash(cleaned_element['latitude'], cleaned_element['longitude'])
+    cleaned_element['city'] = raw_data['_source']['listing']['locations']['city'][0]['name']
+    return cleaned_element
+
+
+def timed(func, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=int, default=100_000)
+    args = parser.parse_args()
+
+    hits = make_page("Bogotá", 2, 1, args.hits, args.hits)
+    assert [legacy_transform(hit) for hit in hits[:1000]] == [scraper.data_transform(hit)._asdict() for hit in hits[:1000]]
+
+    results = {
+        "hits": args.hits,
+        "legacy_s": timed(lambda: [legacy_transform(hit) for hit in hits]),
+        "compiled_s": timed(lambda: [scraper.data_transform(hit) for hit in hits]),
+        "compiled_columns_s": timed(lambda: scraper.data_transform_columns(hits)),
+    }
+    results["speedup_rows"] = round(results["legacy_s"] / results["compiled_s"], 2)
+    results["speedup_columns"] = round(results["legacy_s"] / results["compiled_columns_s"], 2)
+    print(json.dumps(results, indent=2))
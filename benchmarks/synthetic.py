@@ -0,0 +1,66 @@
+"""
+Synthetic listings in the format of the scraper CSV, shared by the benchmarks.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo import geohash
+
+CITIES = ['Bogotá', 'Cali', 'Medellín']
+# (latitude, longitude) of the city centers, listings are spread about 5 km around them
+CITY_CENTERS = {'Bogotá': (4.6564, -74.1097), 'Cali': (3.4144, -76.5216), 'Medellín': (6.2498, -75.5779)}
+PROPERTY_TYPES = ['Casa', 'Apartamento', 'Apartaestudio']
+
+
+def synthetic_listings(rows: int, seed: int = 0, first_id: int = 0) -> pd.DataFrame:
+    """
+    Listings with missing rooms, stratum, area and coordinates, out of range stratum and 2% duplicate rows.
+    """
+    rng = np.random.default_rng(seed)
+    city = rng.choice(CITIES, rows)
+    centers = np.array([CITY_CENTERS[name] for name in CITIES])[pd.Index(CITIES).get_indexer(city)]
+    latitude = (centers[:, 0] + rng.normal(0, 0.05, rows)).round(6)
+    longitude = (centers[:, 1] + rng.normal(0, 0.05, rows)).round(6)
+    df = pd.DataFrame({
+        'id': np.arange(first_id, first_id + rows).astype(str),
+        'price': rng.integers(80, 2000, rows) * 1_000_000,
+        'area': rng.uniform(20, 400, rows).round(2),
+        'rooms': rng.integers(0, 6, rows).astype(float),
+        'bathrooms': rng.integers(1, 5, rows),
+        'garage': rng.integers(0, 4, rows),
+        'property_type': rng.choice(PROPERTY_TYPES, rows),
+        'stratum': rng.integers(-1, 9, rows).astype(float),
+        'latitude': latitude,
+        'longitude': longitude,
+        'geohash': list(map(geohash, latitude.tolist(), longitude.tolist())),
+        'city': city,
+    })
+    missing_location = rng.random(rows) < 0.01
+    df.loc[missing_location, ['latitude', 'longitude', 'geohash']] = None
+    df.loc[rng.random(rows) < 0.1, 'rooms'] = np.nan
+    df.loc[rng.random(rows) < 0.05, 'stratum'] = np.nan
+    df.loc[rng.random(rows) < 0.02, 'area'] = np.nan
+    return pd.concat([df, df.iloc[: rows // 50]], ignore_index=True)
+
+
+def write_synthetic_csv(path: str, rows: int, seed: int = 0, chunk_rows: int = 1_000_000) -> int:
+    """
+    Writes `rows` synthetic listings (plus their duplicates) to a CSV file, one chunk
+    at a time, so scales of 10M rows don't have to fit in memory.
+
+    Returns
+    -------
+    int
+        Number of lines written, without the header.
+    """
+    written = 0
+    for chunk, start in enumerate(range(0, rows, chunk_rows)):
+        df = synthetic_listings(min(chunk_rows, rows - start), seed + chunk, first_id=start)
+        df.to_csv(path, index=False, mode="w" if chunk == 0 else "a", header=chunk == 0)
+        written += len(df)
+    return written
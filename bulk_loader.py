@@ -0,0 +1,608 @@
+import csv
+import json
+import os
+import sqlite3
+import mysql.connector
+import tempfile
+from datetime import date
+from itertools import islice
+from metrics import get_metrics
+from geo import SPATIAL_INDEX_TABLE, rebuild_spatial_index, spatial_index_ddl, update_spatial_index
+from market_stats import MARKET_INDEX, MARKET_STATS_TABLE, MISSING_STRATUM, market_stats_ddl, refresh_market_stats
+
+TABLE_NAMES = ['living_space', 'cities', 'properties']
+PRICE_CHANGES_TABLE = "price_changes"
+DB_NAME = "col_real_estate"
+MYSQL_CREDENTIALS = "mysql_credentials.json" #host, user and password of the MySQL server
+# ids looked up per query by the incremental load, below the SQLite variable limit
+LOOKUP_SIZE = 500
+
+# Column definitions as (name, SQLite type, MySQL type)
+LIVING_SPACE_COLUMNS = [
+    ("id", "TEXT", "VARCHAR(64)"),
+    ("price", "REAL", "DOUBLE"),
+    ("area", "REAL", "DOUBLE"),
+    ("rooms", "INTEGER", "INT"),
+    ("bathrooms", "INTEGER", "INT"),
+    ("garage", "INTEGER", "INT"),
+    ("property_type_id", "INTEGER", "INT"),
+    ("stratum", "INTEGER", "INT"),
+    ("latitude", "REAL", "DOUBLE"),
+    ("longitude", "REAL", "DOUBLE"),
+    ("geohash", "TEXT", "VARCHAR(12)"),
+    ("city_id", "INTEGER", "INT"),
+]
+# Added to the main table: date the listing was first and last loaded
+TRACKING_COLUMNS = [("first_seen", "TEXT", "DATE"), ("last_seen", "TEXT", "DATE")]
+PRICE_CHANGES_COLUMNS = [
+    ("id", "TEXT", "VARCHAR(64)"),
+    ("old_price", "REAL", "DOUBLE"),
+    ("new_price", "REAL", "DOUBLE"),
+    ("changed_on", "TEXT", "DATE"),
+]
+CITIES_COLUMNS = [("city_id", "INTEGER", "INT"), ("city_name", "TEXT", "VARCHAR(128)")]
+PROPERTIES_COLUMNS = [("property_type_id", "INTEGER", "INT"), ("property_type", "TEXT", "VARCHAR(128)")]
+
+
+def is_sqlite(db_connection) -> bool:
+    return isinstance(db_connection, sqlite3.Connection)
+
+
+def table_ddl(table_names: list[str], sqlite: bool, if_not_exists: bool = False, indexes: bool = True) -> list[str]:
+    """
+    CREATE statements for the dimension tables, the main table and the price changes, with primary and
+    foreign keys, the secondary indexes of the main table (see `index_ddl`), the spatial index of the
+    listings (see `geo`) and the market statistics (see `market_stats`).
+
+    Parameters
+    ----------
+    table_names : list of str
+        Names of the main, cities and property types tables.
+    sqlite : bool
+        Use SQLite types, MySQL types otherwise.
+    if_not_exists : bool
+        Keep the tables that already exist.
+    indexes : bool
+        Create the secondary indexes of the main table. Without them, they are created
+        with `index_ddl` once the table is loaded.
+
+    Returns
+    -------
+    list of str
+        Statements in creation order (dimensions first).
+    """
+    living_space, cities, properties = table_names
+    type_index = 1 if sqlite else 2
+
+    def columns(definition: list) -> str:
+        return ", ".join(f"{column[0]} {column[type_index]}" for column in definition)
+
+    create = "CREATE TABLE IF NOT EXISTS" if if_not_exists else "CREATE TABLE"
+    engine = "" if sqlite else " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    # in SQLite the main table is stored clustered on its primary key, like InnoDB does
+    main_options = " WITHOUT ROWID" if sqlite else engine
+    # MySQL has no CREATE INDEX IF NOT EXISTS, its indexes are declared with the table
+    secondary_indexes = f", INDEX (geohash), INDEX ({MARKET_INDEX})" if indexes and not sqlite else ""
+    statements = [
+        f"{create} {cities} ({columns(CITIES_COLUMNS)}, PRIMARY KEY (city_id), UNIQUE (city_name)){engine}",
+        f"{create} {properties} ({columns(PROPERTIES_COLUMNS)}, PRIMARY KEY (property_type_id), UNIQUE (property_type)){engine}",
+        f"{create} {living_space} ({columns(LIVING_SPACE_COLUMNS + TRACKING_COLUMNS)}, PRIMARY KEY (id){secondary_indexes}, "
+        f"FOREIGN KEY (city_id) REFERENCES {cities} (city_id), "
+        f"FOREIGN KEY (property_type_id) REFERENCES {properties} (property_type_id)){main_options}",
+        f"{create} {PRICE_CHANGES_TABLE} ({columns(PRICE_CHANGES_COLUMNS)}, PRIMARY KEY (id, changed_on)){engine}",
+        spatial_index_ddl(sqlite, if_not_exists),
+    ]
+    if indexes and sqlite:
+        statements += index_ddl(living_space, sqlite, if_not_exists)
+    return statements + market_stats_ddl(sqlite)
+
+
+def index_ddl(living_space: str, sqlite: bool, if_not_exists: bool = False) -> list[str]:
+    """
+    Statements creating the secondary indexes of the main table: the geohash cells and
+    the listings of a scrape date read by the market statistics (`MARKET_INDEX`).
+
+    `bulk_load` runs them once the table is loaded, sorting every key once instead of
+    updating both indexes row by row. `if_not_exists` is SQLite only.
+    """
+    if sqlite:
+        exists = " IF NOT EXISTS" if if_not_exists else ""
+        return [f"CREATE INDEX{exists} {living_space}_geohash ON {living_space} (geohash)",
+                f"CREATE INDEX{exists} {living_space}_market ON {living_space} ({MARKET_INDEX})"]
+    return [f"ALTER TABLE {living_space} ADD INDEX (geohash), ADD INDEX ({MARKET_INDEX})"]
+
+
+def iter_rows(df):
+    """
+    Yields the rows of a pandas or polars DataFrame as tuples, with missing values as None.
+
+    float32 values are given as the float of their shortest decimal representation, so
+    an area of 173.73 is stored as 173.73 and not 173.72999572753906.
+    """
+    if hasattr(df, "iter_rows"):
+        import polars as pl
+        yield from df.with_columns(pl.col(pl.Float32).cast(pl.String).cast(pl.Float64)).iter_rows()
+        return
+    columns = []
+    for name in df.columns:
+        series = df[name]
+        if series.dtype == "float32":
+            series = series.astype(str).astype("float64")
+        values = series.tolist()
+        if series.hasnans:
+            values = [None if missing else value for value, missing in zip(values, series.isna().tolist())]
+        columns.append(values)
+    yield from zip(*columns)
+
+
+def _batches(rows, batch_size: int):
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        yield batch
+
+
+def insert_statement(table: str, columns: list[str], sqlite: bool, upsert: bool = False) -> str:
+    """
+    Prepared INSERT statement for `table`. With `upsert` a row with an existing key replaces the stored one.
+    """
+    column_list = ", ".join(columns)
+    if sqlite:
+        placeholders = ", ".join("?" for _ in columns)
+        verb = "INSERT OR REPLACE" if upsert else "INSERT"
+        return f"{verb} INTO {table} ({column_list}) VALUES ({placeholders})"
+    placeholders = ", ".join("%s" for _ in columns)
+    statement = f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})"
+    if upsert:
+        statement += " ON DUPLICATE KEY UPDATE " + ", ".join(f"{column} = VALUES({column})" for column in columns)
+    return statement
+
+
+def _load_data_infile(cursor, rows, table: str, columns: list[str]) -> int:
+    # MySQL only: stream the table through a temporary CSV file
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, newline="") as file:
+        writer = csv.writer(file, quoting=csv.QUOTE_MINIMAL, lineterminator="\n")
+        written = 0
+        for row in rows:
+            writer.writerow(["\\N" if value is None else value for value in row])
+            written += 1
+    try:
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE '{file.name}' INTO TABLE {table} "
+            f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' LINES TERMINATED BY '\\n' "
+            f"({', '.join(columns)})")
+    finally:
+        os.remove(file.name)
+    return written
+
+
+def _begin(cursor, db_connection, sqlite: bool):
+    if sqlite:
+        cursor.execute("BEGIN")
+    else:
+        db_connection.start_transaction()
+
+
+def _commit(cursor, db_connection, sqlite: bool):
+    if sqlite:
+        cursor.execute("COMMIT")
+    else:
+        db_connection.commit()
+
+
+def _rollback(cursor, db_connection, sqlite: bool):
+    if not sqlite:
+        db_connection.rollback()
+    elif db_connection.in_transaction:
+        cursor.execute("ROLLBACK")
+
+
+def _with_dates(rows, first_seen: str, last_seen: str):
+    for row in rows:
+        yield (*row, first_seen, last_seen)
+
+
+def bulk_load(tables_list: list, db_connection, table_names: list[str] = TABLE_NAMES, batch_size: int = 10000, load_data_infile: bool = False, load_date: str | None = None) -> dict:
+    """
+    Replace the tables with the given DataFrames, one transaction and batched prepared inserts per table.
+
+    Tables are recreated with primary and foreign keys, and the price history is emptied.
+    Every listing gets `load_date` as its first and last seen date, and the spatial
+    index is rebuilt from the coordinates of the listings. The market statistics of
+    `load_date` are recomputed, those of other dates are kept. For SQLite the load runs with
+    `synchronous=OFF` on the given connection, restored afterwards; the journal mode of
+    the file is left as it is. When the load fails, the table being written is rolled
+    back and the setting is restored all the same. For
+    MySQL, `executemany` sends multi-row inserts, or `LOAD DATA LOCAL INFILE` is used when
+    `load_data_infile` is set (the connection needs `allow_local_infile=True`).
+
+    Parameters
+    ----------
+    tables_list : list of DataFrame
+        pandas or polars DataFrames: main table, cities and property types, as returned by `create_tables`.
+    db_connection : sqlite3.Connection or mysql.connector connection
+        Database connection object. For MySQL, `DB_NAME` must exist (see `connect_to_db`).
+    table_names : list of str
+        Names of the main, cities and property types tables.
+    batch_size : int
+        Rows sent per `executemany` call.
+    load_data_infile : bool
+        MySQL only, load each table from a temporary CSV file instead of inserts.
+    load_date : str, optional
+        Date of the load (YYYY-MM-DD), today by default.
+
+    Returns
+    -------
+    dict
+        Rows written per table.
+    """
+    load_date = str(load_date or date.today())
+    sqlite = is_sqlite(db_connection)
+    cursor = db_connection.cursor()
+    if sqlite:
+        db_connection.isolation_level = None
+        synchronous = cursor.execute("PRAGMA synchronous").fetchone()[0]
+        cursor.execute("PRAGMA synchronous=OFF")
+    else:
+        db_connection.database = DB_NAME
+        db_connection.autocommit = False
+        cursor.execute("SET FOREIGN_KEY_CHECKS=0")
+
+    written = {}
+    try:
+        for table in [SPATIAL_INDEX_TABLE, PRICE_CHANGES_TABLE, *table_names]:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        for statement in table_ddl(table_names, sqlite, indexes=False):
+            cursor.execute(statement)
+
+        # dimensions first so the foreign keys of the main table resolve
+        for df, table in sorted(zip(tables_list, table_names), key=lambda pair: pair[1] == table_names[0]):
+            columns = list(df.columns)
+            rows = iter_rows(df)
+            if table == table_names[0]:
+                columns += [column[0] for column in TRACKING_COLUMNS]
+                rows = _with_dates(rows, load_date, load_date)
+            _begin(cursor, db_connection, sqlite)
+            if load_data_infile and not sqlite:
+                written[table] = _load_data_infile(cursor, rows, table, columns)
+            else:
+                statement = insert_statement(table, columns, sqlite)
+                written[table] = 0
+                for batch in _batches(rows, batch_size):
+                    cursor.executemany(statement, batch)
+                    written[table] += len(batch)
+            _commit(cursor, db_connection, sqlite)
+        # MySQL commits before ALTER TABLE, the indexes are built outside the transaction
+        for statement in index_ddl(table_names[0], sqlite):
+            cursor.execute(statement)
+        _begin(cursor, db_connection, sqlite)
+        written[SPATIAL_INDEX_TABLE] = rebuild_spatial_index(cursor, table_names[0], sqlite)
+        written[MARKET_STATS_TABLE] = refresh_market_stats(cursor, table_names[0], sqlite, load_date)
+        _commit(cursor, db_connection, sqlite)
+    except Exception:
+        _rollback(cursor, db_connection, sqlite)
+        raise
+    finally:
+        if sqlite:
+            cursor.execute(f"PRAGMA synchronous={synchronous}")
+        else:
+            cursor.execute("SET FOREIGN_KEY_CHECKS=1")
+        cursor.close()
+    return written
+
+
+def replace_tables(tables_list: list, db_connection, table_names: list[str] = TABLE_NAMES) -> dict:
+    """
+    Replace the tables with the given DataFrames through pandas `to_sql`, the default full load.
+
+    The tables are written bare: no keys, first/last seen dates, spatial index, market
+    statistics or price history (see `bulk_load` for those). It is about twice as fast
+    as `bulk_load` without its spatial index, see `benchmarks/bench_db_load.py`.
+    polars DataFrames are converted to pandas, and float32 columns are written as the
+    float of their shortest decimal representation, like `iter_rows` does. For MySQL the
+    rows go through a SQLAlchemy engine on top of the given connection.
+
+    Parameters
+    ----------
+    tables_list : list of DataFrame
+        pandas or polars DataFrames: main table, cities and property types, as returned by `create_tables`.
+    db_connection : sqlite3.Connection or mysql.connector connection
+        Database connection object. For MySQL, `DB_NAME` must exist (see `connect_to_db`).
+    table_names : list of str
+        Names of the main, cities and property types tables.
+
+    Returns
+    -------
+    dict
+        Rows written per table.
+    """
+    if is_sqlite(db_connection):
+        connectable = db_connection
+    else:
+        from sqlalchemy import create_engine
+        db_connection.database = DB_NAME
+        connectable = create_engine("mysql+mysqlconnector://", creator=lambda: db_connection)
+    written = {}
+    for df, table in zip(tables_list, table_names):
+        if hasattr(df, "iter_rows"):
+            df = df.to_pandas()
+        df = df.assign(**{name: df[name].astype(str).astype("float64") for name in df.columns if df[name].dtype == "float32"})
+        df.to_sql(table, connectable, if_exists="replace", index=False)
+        written[table] = len(df)
+    return written
+
+
+def _merge_dimension(cursor, df, table: str, sqlite: bool) -> int:
+    # Adds the keys of the key registry missing from a dimension table as they are, and
+    # fails when the table pairs one of the names or ids with another key
+    id_column, name_column = df.columns
+    placeholder = "?" if sqlite else "%s"
+    cursor.execute(f"SELECT {id_column}, {name_column} FROM {table}")
+    names = dict(cursor.fetchall())
+    ids = {name: key for key, name in names.items()}
+    new_rows = []
+    for key, name in iter_rows(df):
+        if names.get(key, name) != name or ids.get(name, key) != key:
+            raise ValueError(f"The key registry gives {name!r} the id {key}, but {table} stores {name!r} "
+                             f"with the id {ids.get(name)} and the id {key} for {names.get(key)!r}")
+        if key not in names:
+            names[key], ids[name] = name, key
+            new_rows.append((key, name))
+    if new_rows:
+        cursor.executemany(f"INSERT INTO {table} ({id_column}, {name_column}) VALUES ({placeholder}, {placeholder})", new_rows)
+    return len(new_rows)
+
+
+def _table_exists(cursor, table: str, sqlite: bool) -> bool:
+    if sqlite:
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = ?", (table,))
+    else:
+        cursor.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s", (table,))
+    return cursor.fetchone()[0] > 0
+
+
+def _table_columns(cursor, table: str) -> list[str]:
+    cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+    cursor.fetchall()
+    return [column[0] for column in cursor.description]
+
+
+def _market_partition(city_id, property_type_id, stratum) -> tuple:
+    return city_id, property_type_id, MISSING_STRATUM if stratum is None else stratum
+
+
+def incremental_load(tables_list: list, db_connection, table_names: list[str] = TABLE_NAMES, batch_size: int = 10000, load_date: str | None = None) -> dict:
+    """
+    Merge the given DataFrames into the existing tables, in a single transaction.
+
+    Nothing is dropped: readers keep seeing the previous data until the commit. The
+    tables are created when missing, but bare tables written by `replace_tables` fail
+    the load with a ValueError, as they have no keys to merge on.
+    - Cities and property types missing from the database are added with their id
+      from the key registry (see `key_registry`). A stored name or id paired with
+      another id fails the load, so ids are the same in every database.
+    - New listings are inserted with `load_date` as their first and last seen date.
+    - Listings already stored are updated, keeping their first seen date. When their
+      price changed, the old and new price are recorded in `price_changes`.
+    - The spatial index is updated for the new listings and the ones whose coordinates
+      changed. It is rebuilt from every stored listing when it did not exist yet.
+    - The market statistics of `load_date` are recomputed for the partitions (city,
+      property type, stratum) of the given listings, and for the ones they left when
+      they were already seen on `load_date` (see `market_stats`).
+
+    Only the rows of the DataFrames are written, so feeding it the listings of an
+    incremental crawl (`--incremental`) keeps the writes proportional to the day's changes.
+    Such a crawl only returns the new and changed listings, so only those get `load_date`
+    as their last seen date: unchanged listings keep the date they last changed, and a
+    listing that is no longer published can't be told apart from an unchanged one.
+
+    Parameters
+    ----------
+    tables_list : list of DataFrame
+        pandas or polars DataFrames: main table, cities and property types, as returned by `create_tables`.
+    db_connection : sqlite3.Connection or mysql.connector connection
+        Database connection object. For MySQL, `DB_NAME` must exist (see `connect_to_db`).
+    table_names : list of str
+        Names of the main, cities and property types tables.
+    batch_size : int
+        Listings compared and written per batch.
+    load_date : str, optional
+        Date of the load (YYYY-MM-DD), today by default.
+
+    Returns
+    -------
+    dict
+        Number of new and updated listings, price changes, new cities and property types,
+        listings (re)indexed in the spatial index and market statistics partitions refreshed.
+
+    Raises
+    ------
+    ValueError
+        When the main table was written by `replace_tables`.
+    """
+    load_date = str(load_date or date.today())
+    sqlite = is_sqlite(db_connection)
+    living_space, cities, properties = table_names
+    df, cities_df, properties_df = tables_list
+    placeholder = "?" if sqlite else "%s"
+    cursor = db_connection.cursor()
+    if sqlite:
+        db_connection.isolation_level = None
+        cursor.execute("PRAGMA journal_mode=WAL")
+    else:
+        db_connection.database = DB_NAME
+        db_connection.autocommit = False
+    # databases loaded before the spatial index existed get it filled once
+    spatial_index_exists = _table_exists(cursor, SPATIAL_INDEX_TABLE, sqlite)
+    # bare tables written by replace_tables have no keys to upsert on
+    if _table_exists(cursor, living_space, sqlite) and TRACKING_COLUMNS[-1][0] not in _table_columns(cursor, living_space):
+        cursor.close()
+        raise ValueError(f"{living_space} was written by replace_tables, recreate it with bulk_load before merging into it")
+    for statement in table_ddl(table_names, sqlite, if_not_exists=True):
+        cursor.execute(statement)
+
+    stats = {"new": 0, "updated": 0, "price_changes": 0, SPATIAL_INDEX_TABLE: 0}
+    touched = set()
+    _begin(cursor, db_connection, sqlite)
+    try:
+        stats["new_cities"] = _merge_dimension(cursor, cities_df, cities, sqlite)
+        stats["new_property_types"] = _merge_dimension(cursor, properties_df, properties, sqlite)
+
+        columns = list(df.columns)
+        id_index = columns.index("id")
+        price_index = columns.index("price")
+        city_index = columns.index("city_id")
+        property_type_index = columns.index("property_type_id")
+        stratum_index = columns.index("stratum")
+        latitude_index = columns.index("latitude")
+        longitude_index = columns.index("longitude")
+        value_columns = [column for column in columns if column != "id"]
+        insert = insert_statement(living_space, columns + [column[0] for column in TRACKING_COLUMNS], sqlite)
+        update = (f"UPDATE {living_space} SET " + ", ".join(f"{column} = {placeholder}" for column in value_columns)
+                  + f", last_seen = {placeholder} WHERE id = {placeholder}")
+        record_change = insert_statement(PRICE_CHANGES_TABLE, [column[0] for column in PRICE_CHANGES_COLUMNS], sqlite, upsert=True)
+
+        for batch in _batches(iter_rows(df), batch_size):
+            rows = []
+            for row in batch:
+                row = list(row)
+                row[id_index] = str(row[id_index])
+                rows.append(row)
+            stored = {}
+            for start in range(0, len(rows), LOOKUP_SIZE):
+                ids = [row[id_index] for row in rows[start:start + LOOKUP_SIZE]]
+                cursor.execute(f"SELECT id, price, city_id, property_type_id, stratum, last_seen, latitude, longitude FROM {living_space} "
+                               f"WHERE id IN ({', '.join(placeholder for _ in ids)})", ids)
+                stored.update((row[0], row[1:]) for row in cursor.fetchall())
+
+            new_rows, updated_rows, changes = [], [], []
+            unindexed, indexed = [], []
+            for row in rows:
+                listing_id = row[id_index]
+                point = (row[latitude_index], row[longitude_index])
+                touched.add(_market_partition(row[city_index], row[property_type_index], row[stratum_index]))
+                if listing_id not in stored:
+                    new_rows.append((*row, load_date, load_date))
+                    if None not in point:
+                        indexed.append((listing_id, *point))
+                    continue
+                updated_rows.append((*(row[index] for index in range(len(row)) if index != id_index), load_date, listing_id))
+                old_price, old_city, old_property_type, old_stratum, last_seen, old_latitude, old_longitude = stored[listing_id]
+                if str(last_seen) == load_date:
+                    touched.add(_market_partition(old_city, old_property_type, old_stratum))
+                if old_price != row[price_index]:
+                    changes.append((listing_id, old_price, row[price_index], load_date))
+                if point != (old_latitude, old_longitude):
+                    if old_latitude is not None and old_longitude is not None:
+                        unindexed.append((listing_id, old_latitude, old_longitude))
+                    if None not in point:
+                        indexed.append((listing_id, *point))
+            for statement, values in ((insert, new_rows), (update, updated_rows), (record_change, changes)):
+                if values:
+                    cursor.executemany(statement, values)
+            if spatial_index_exists:
+                stats[SPATIAL_INDEX_TABLE] += update_spatial_index(cursor, sqlite, unindexed, indexed)
+            stats["new"] += len(new_rows)
+            stats["updated"] += len(updated_rows)
+            stats["price_changes"] += len(changes)
+        if not spatial_index_exists:
+            stats[SPATIAL_INDEX_TABLE] = rebuild_spatial_index(cursor, living_space, sqlite)
+        stats[MARKET_STATS_TABLE] = refresh_market_stats(cursor, living_space, sqlite, load_date, touched)
+        _commit(cursor, db_connection, sqlite)
+    except Exception:
+        _rollback(cursor, db_connection, sqlite)
+        raise
+    finally:
+        cursor.close()
+    return stats
+
+
+def read_credentials(path: str = MYSQL_CREDENTIALS) -> dict:
+    """
+    Returns the host, user and password of the MySQL server from the JSON file at `path`.
+    """
+    with open(path, 'r') as file:
+        data = json.load(file)
+    return {"host": data["host"], "user": data["user"], "password": data["password"]}
+
+
+def connect_to_db(db_type: str, incremental: bool = False) -> (sqlite3.Connection | mysql.connector.connection_cext.CMySQLConnection | None):
+    """
+    Connect to a specified database type (SQLite or MySQL).
+
+    Parameters
+    ----------
+    db_type : str
+        Type of the database ("sqlite3" or "mysql").
+    incremental : bool
+        Keep the existing MySQL database instead of dropping it.
+
+    Returns
+    -------
+    sqlite3.Connection or mysql.connector.connection_cext.CMySQLConnection or None
+        Database connection object or None if the type is unknown.
+    """
+    if db_type == "sqlite3":
+        # Connect to SQLite database
+        db_connection = sqlite3.connect(f"{DB_NAME}.db")
+
+    elif db_type == "mysql":
+        # Connect to mysql database
+        db_connection = mysql.connector.connect(**read_credentials())
+
+        if not incremental:
+            db_connection.cursor().execute(f"DROP DATABASE IF EXISTS {DB_NAME}")
+        db_connection.cursor().execute(f"CREATE DATABASE IF NOT EXISTS {DB_NAME}")
+
+    else:
+        print("Unknown connection")
+    
+    return db_connection
+
+
+def load_to_db(tables_list: list, db_connection: (sqlite3.Connection | mysql.connector.connection_cext.CMySQLConnection), table_names: list[str], batch_size: int = 10000, incremental: bool = False, bulk: bool = False) -> dict:
+    """
+    Load DataFrames into a database, replacing the tables with bare ones (see `bulk_loader.replace_tables`).
+
+    With `bulk` the tables are recreated with keys, first/last seen dates, the spatial
+    index and the market statistics, one transaction and batched prepared inserts per
+    table (see `bulk_loader.bulk_load`). In incremental mode the DataFrames are merged into the existing tables instead
+    (see `bulk_loader.incremental_load`): listings are upserted by id, new cities and
+    property types are added without changing the existing ids, and first/last seen
+    dates and price changes are tracked.
+
+    Parameters
+    ----------
+    tables_list : list of DataFrame
+        List of DataFrames representing the tables to load.
+    db_connection : sqlite3.Connection or mysql.connector.connection_cext.CMySQLConnection
+        Database connection object.
+    table_names : list of str
+        List of table names to be created in the database.
+    batch_size : int
+        Rows sent per batched insert.
+    incremental : bool
+        Merge into the existing tables instead of replacing them.
+    bulk : bool
+        Recreate the tables with `bulk_load` instead of `replace_tables`.
+
+    Returns
+    -------
+    dict
+        Rows written per table, or the merge counts in incremental mode.
+    """
+    if isinstance(db_connection, (sqlite3.Connection, mysql.connector.connection_cext.CMySQLConnection)):
+
+        metrics = get_metrics()
+        try:
+            with metrics.stage("load_to_db", mode="incremental" if incremental else "bulk" if bulk else "replace"):
+                if incremental:
+                    written = incremental_load(tables_list, db_connection, table_names, batch_size)
+                elif bulk:
+                    written = bulk_load(tables_list, db_connection, table_names, batch_size)
+                else:
+                    written = replace_tables(tables_list, db_connection, table_names)
+        finally:
+            db_connection.close()
+        for name, rows in written.items():
+            metrics.inc("rows_loaded_total", rows, table=name)
+        return written
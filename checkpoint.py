@@ -0,0 +1,143 @@
+import hashlib
+import json
+import sqlite3
+
+STATE_FILE = "crawl_state.db"
+
+
+def listing_hash(hit: dict) -> str:
+    """
+    Returns a short hash of the listing content of a hit.
+    """
+    content = json.dumps(hit["_source"]["listing"], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
+
+class CrawlState:
+    """
+    Persisted incremental crawl state, stored in a SQLite file.
+
+    For every (city, property type) it keeps the last page reached, whether the last
+    crawl finished, and the id and content hash of every listing seen, along with the
+    size of the output written so far.
+
+    Nothing is committed until the caller has written the rows: `filter_changed` and
+    `checkpoint` only stage the state of a page, and `commit` stores it once the rows
+    of the page are durably in the output. A crash then resumes from the last page
+    whose rows were written, and the output is cut back to where it was committed.
+
+    Parameters
+    ----------
+    path : str
+        SQLite file holding the state.
+    """
+
+    def __init__(self, path: str = STATE_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS progress (
+                city_id TEXT, property_type INTEGER, last_page INTEGER, completed INTEGER,
+                PRIMARY KEY (city_id, property_type));
+            CREATE TABLE IF NOT EXISTS seen (
+                city_id TEXT, property_type INTEGER, listing_id TEXT, content_hash TEXT,
+                PRIMARY KEY (city_id, property_type, listing_id));
+            CREATE TABLE IF NOT EXISTS output (path TEXT PRIMARY KEY, position INTEGER);
+        """)
+        self._seen = {}
+        self._updates = []
+        self.checkpoints = 0
+        self.interrupted = self.connection.execute("SELECT COUNT(*) FROM progress WHERE completed = 0").fetchone()[0] > 0
+
+    def start_page(self, city_id: str, property_type: int) -> int:
+        """
+        Page to start crawling from: the page after the checkpoint if the last crawl was
+        interrupted, the first page otherwise.
+        """
+        row = self.connection.execute(
+            "SELECT last_page, completed FROM progress WHERE city_id = ? AND property_type = ?",
+            (city_id, property_type)).fetchone()
+        if row is None or row[1]:
+            self.checkpoint(city_id, property_type, 0)
+            return 1
+        return row[0] + 1
+
+    def seen(self, city_id: str, property_type: int) -> dict:
+        """
+        Returns the listing id -> content hash map of a city and property type.
+        """
+        key = (city_id, property_type)
+        if key not in self._seen:
+            self._seen[key] = dict(self.connection.execute(
+                "SELECT listing_id, content_hash FROM seen WHERE city_id = ? AND property_type = ?", key))
+        return self._seen[key]
+
+    def filter_changed(self, city_id: str, property_type: int, hits: list) -> tuple[list, list]:
+        """
+        Splits the hits of a page into new or changed listings and records them as
+        seen, in memory until the page is checkpointed.
+
+        Returns
+        -------
+        tuple of (list, list)
+            - changed: hits that are new or whose content changed.
+            - unchanged_flags: one boolean per hit, True when the hit was already seen unchanged.
+        """
+        seen = self.seen(city_id, property_type)
+        changed = []
+        unchanged_flags = []
+        for hit in hits:
+            listing_id = str(hit["_source"]["listing"]["id"])
+            content_hash = listing_hash(hit)
+            unchanged = seen.get(listing_id) == content_hash
+            unchanged_flags.append(unchanged)
+            if not unchanged:
+                seen[listing_id] = content_hash
+                changed.append(hit)
+                self._updates.append((city_id, property_type, listing_id, content_hash))
+        return changed, unchanged_flags
+
+    def checkpoint(self, city_id: str, property_type: int, page: int, completed: bool = False):
+        """
+        Records the last page processed and the listings seen up to it, stored by
+        the next `commit`. Call it once the rows of the page were handed to the writer.
+        """
+        self.connection.executemany("INSERT OR REPLACE INTO seen VALUES (?, ?, ?, ?)", self._updates)
+        self._updates = []
+        self.connection.execute(
+            "INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?)",
+            (city_id, property_type, page, int(completed)))
+        self.checkpoints += 1
+
+    def commit(self, path: str | None = None, position: int | None = None):
+        """
+        Stores the pages checkpointed so far, once their rows, and no others, are written.
+
+        Parameters
+        ----------
+        path : str, optional
+            Output the rows were written to.
+        position : int, optional
+            Size of the output once the rows are written: bytes of a CSV file, batches
+            of a Parquet dataset.
+        """
+        if path is not None:
+            self.connection.execute("DELETE FROM output")
+            self.connection.execute("INSERT INTO output VALUES (?, ?)", (path, position))
+        self.connection.commit()
+
+    def output_position(self, path: str) -> int | None:
+        """
+        Size of `path` at the last commit when the last crawl was interrupted while
+        writing to it, None otherwise (the output is written from scratch).
+        """
+        if not self.interrupted:
+            return None
+        row = self.connection.execute("SELECT position FROM output WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        """
+        Closes the state, dropping what was not committed.
+        """
+        self.connection.close()
@@ -0,0 +1,427 @@
+import csv
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+
+import web_scraping_real_estate as scraper
+from dedup import Deduplicator, SeenSet
+from http_session import configure_session
+from response_cache import configure_response_cache
+from retry_policy import RetryableError
+
+QUEUE_FILE = "crawl_queue.db"
+SHARD_DIR = "crawl_shards"
+PAGES_PER_SHARD = 20 #result pages crawled by a worker per claim
+LEASE_SECONDS = 300 #a shard whose lease is not renewed for this long is given to another worker
+MAX_ATTEMPTS = 3 #claims of a shard before it is marked failed
+POLL_SECONDS = 5 #wait of an idle worker while other workers hold leases
+
+
+class LeaseLost(Exception):
+    """
+    Raised when a worker no longer holds the lease of the shard it is crawling.
+    """
+
+
+class WorkQueue:
+    """
+    Durable queue of crawl shards, stored in a SQLite file.
+
+    A shard is a range of result pages of a city and property type. Workers claim
+    a shard with a lease, renew the lease after every page and mark the shard done
+    with the path of its output. A shard whose lease expired, because its worker
+    died or hung, goes back to the next worker that asks for work, until it has
+    been claimed `max_attempts` times.
+
+    Claims are a single UPDATE statement, so several processes can share the file.
+    Workers on different nodes need a shared filesystem with working SQLite locks.
+
+    Parameters
+    ----------
+    path : str
+        SQLite file holding the queue.
+    lease_seconds : float
+        Duration of a lease.
+    max_attempts : int
+        Claims of a shard before it is marked failed.
+    """
+
+    def __init__(self, path: str = QUEUE_FILE, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS shards (
+                shard_id INTEGER PRIMARY KEY, scope_order INTEGER, city_id TEXT, city TEXT,
+                property_type INTEGER, first_page INTEGER, last_page INTEGER,
+                status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, owner TEXT,
+                lease_expires REAL, output TEXT, rows INTEGER, error TEXT,
+                UNIQUE (city_id, property_type, first_page));
+            CREATE INDEX IF NOT EXISTS shards_status ON shards (status, lease_expires);
+        """)
+
+    def add(self, city_information: dict, property_type: int, first_page: int, last_page: int, scope_order: int) -> bool:
+        """
+        Adds a shard, unless the range starting at `first_page` is already queued.
+        """
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO shards (scope_order, city_id, city, property_type, first_page, last_page) VALUES (?, ?, ?, ?, ?, ?)",
+            (scope_order, city_information["id"], json.dumps(city_information, ensure_ascii=False), property_type, first_page, last_page))
+        return cursor.rowcount == 1
+
+    def plan(self, cities: list, property_types: list, pages_per_shard: int = PAGES_PER_SHARD) -> int:
+        """
+        Queues the first shard of every city and property type, and returns the number
+        of shards added. The other shards are queued by the workers once the first
+        page gives the number of results (see `crawl_shard`).
+        """
+        added = 0
+        for city_position, city in enumerate(cities):
+            for type_position, property_type in enumerate(property_types):
+                scope_order = city_position * len(property_types) + type_position
+                added += self.add(city, property_type, 1, pages_per_shard, scope_order)
+        return added
+
+    def claim(self, owner: str) -> dict | None:
+        """
+        Leases the next pending shard, or a shard whose lease expired, to `owner`.
+
+        Returns
+        -------
+        dict or None
+            The shard, None when there is nothing to claim.
+        """
+        now = time.time()
+        self.connection.execute(
+            "UPDATE shards SET status = 'failed', owner = NULL, error = COALESCE(error, 'lease expired') "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, self.max_attempts))
+        row = self.connection.execute(
+            "UPDATE shards SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 "
+            "WHERE shard_id = (SELECT shard_id FROM shards WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+            "ORDER BY scope_order, first_page LIMIT 1) "
+            "RETURNING shard_id, scope_order, city, property_type, first_page, last_page, attempts",
+            (owner, now + self.lease_seconds, now)).fetchone()
+        if row is None:
+            return None
+        keys = ("shard_id", "scope_order", "city", "property_type", "first_page", "last_page", "attempts")
+        shard = dict(zip(keys, row))
+        shard["city"] = json.loads(shard["city"])
+        return shard
+
+    def extend(self, shard_id: int, owner: str) -> bool:
+        """
+        Renews the lease of a shard, returns False when `owner` lost it.
+        """
+        cursor = self.connection.execute(
+            "UPDATE shards SET lease_expires = ? WHERE shard_id = ? AND owner = ? AND status = 'leased'",
+            (time.time() + self.lease_seconds, shard_id, owner))
+        return cursor.rowcount == 1
+
+    def complete(self, shard_id: int, owner: str, output: str, rows: int) -> bool:
+        """
+        Marks a shard done with its output file, returns False when `owner` lost the lease.
+        """
+        cursor = self.connection.execute(
+            "UPDATE shards SET status = 'done', output = ?, rows = ?, lease_expires = NULL, error = NULL "
+            "WHERE shard_id = ? AND owner = ? AND status = 'leased'", (output, rows, shard_id, owner))
+        return cursor.rowcount == 1
+
+    def fail(self, shard_id: int, owner: str, error: str):
+        """
+        Gives a shard back to the queue after an error, or marks it failed after `max_attempts` claims.
+        """
+        self.connection.execute(
+            "UPDATE shards SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "owner = NULL, lease_expires = NULL, error = ? WHERE shard_id = ? AND owner = ? AND status = 'leased'",
+            (self.max_attempts, error, shard_id, owner))
+
+    def counts(self) -> dict:
+        """
+        Returns the number of shards by status.
+        """
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM shards GROUP BY status"))
+
+    def outputs(self) -> list:
+        """
+        Returns the output files of the done shards, in the order of the scope and of the pages.
+        """
+        return [row[0] for row in self.connection.execute(
+            "SELECT output FROM shards WHERE status = 'done' ORDER BY scope_order, first_page")]
+
+    def close(self):
+        self.connection.close()
+
+
+def crawl_shard(shard: dict, queue: WorkQueue, owner: str, url: str = scraper.URL, output_dir: str = SHARD_DIR, pages_per_shard: int = PAGES_PER_SHARD) -> int:
+    """
+    Crawls the pages of a shard and writes its listings to a CSV file of `output_dir`.
+
+    The pages are read by `scraper.iter_pages` between the bounds of the shard. The
+    first response gives the number of results: the shards of the remaining pages of
+    the city and property type are queued then. When the service does not give an
+    exact total, the next shard is queued when this one reaches its last page. The lease
+    is renewed after every page, and the file only appears under its final name once
+    the shard is complete. Hits of a listing already seen in the shard are dropped
+    before the transform. Pages failing after every retry give the shard back to the
+    queue once the others are read.
+
+    Parameters
+    ----------
+    shard : dict
+        Shard returned by `WorkQueue.claim`.
+    queue : WorkQueue
+        Queue the shard was claimed from.
+    owner : str
+        Name of the worker holding the lease.
+    url : str
+        The search endpoint to query.
+    output_dir : str
+        Directory of the shard outputs.
+    pages_per_shard : int
+        Result pages of the shards queued from this one.
+
+    Returns
+    -------
+    int
+        Listings written.
+
+    Raises
+    ------
+    LeaseLost
+        If the lease expired and another worker may have claimed the shard.
+    """
+    city, property_type = shard["city"], shard["property_type"]
+    progress = {"page": shard["first_page"] - 1, "page_count": None}
+
+    def on_page(page: int, page_count: int | None):
+        if page_count is not None and progress["page_count"] is None:
+            for first_page in range(shard["last_page"] + 1, page_count + 1, pages_per_shard):
+                queue.add(city, property_type, first_page, first_page + pages_per_shard - 1, shard["scope_order"])
+        progress.update(page=page, page_count=page_count)
+        if not queue.extend(shard["shard_id"], owner):
+            raise LeaseLost(f"Lease of shard {shard['shard_id']} lost at page {page}")
+
+    def pages():
+        failed = []
+        yield from scraper.iter_pages(city, [property_type], url=url, dead_letters=failed,
+                                      first_page=shard["first_page"], last_page=shard["last_page"], on_page=on_page)
+        if failed:
+            #the shard goes back to the queue (see `run_worker`)
+            raise RetryableError(f"Page {failed[0]['page']} of shard {shard['shard_id']} failed")
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(output_dir, f"shard-{shard['shard_id']}.csv"))
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        rows = scraper.data_load_stream(scraper.iter_transform(scraper.dedup_pages(pages(), SeenSet())), path=temporary)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    # the pagination ended before the last page, or the following shards were queued from the total
+    if progress["page"] == shard["last_page"] and progress["page_count"] is None:
+        last_page = shard["last_page"]
+        queue.add(city, property_type, last_page + 1, last_page + pages_per_shard, shard["scope_order"])
+    os.replace(temporary, path)
+    if not queue.complete(shard["shard_id"], owner, path, rows):
+        raise LeaseLost(f"Lease of shard {shard['shard_id']} lost before completion")
+    return rows
+
+
+def run_worker(queue_path: str = QUEUE_FILE, url: str = scraper.URL, output_dir: str = SHARD_DIR, pages_per_shard: int = PAGES_PER_SHARD,
+               lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS, owner: str | None = None,
+               rate: float = 0, burst: int = 1, cache_dir: str | None = None, poll_seconds: float = POLL_SECONDS) -> dict:
+    """
+    Claims and crawls shards until the queue has no pending or leased shard left.
+
+    While other workers hold leases the worker waits, so it can take over the shards
+    of a worker that dies.
+
+    Parameters
+    ----------
+    queue_path : str
+        SQLite file of the queue.
+    url : str
+        The search endpoint to query.
+    output_dir : str
+        Directory of the shard outputs, shared by the workers.
+    pages_per_shard : int
+        Result pages of the shards queued by this worker.
+    lease_seconds : float
+        Duration of a lease.
+    max_attempts : int
+        Claims of a shard before it is marked failed.
+    owner : str, optional
+        Name of the worker, host:pid by default.
+    rate : float
+        Maximum requests per second of this worker, 0 for no limit.
+    burst : int
+        Requests allowed back to back before the rate applies.
+    cache_dir : str, optional
+        Response cache of this worker (see `response_cache`).
+    poll_seconds : float
+        Wait between claims while other workers hold leases.
+
+    Returns
+    -------
+    dict
+        Shards done, shards given back and listings written by the worker.
+    """
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+    configure_session(rate, burst)
+    cache = configure_response_cache(cache_dir) if cache_dir else None
+    queue = WorkQueue(queue_path, lease_seconds, max_attempts)
+    stats = {"owner": owner, "shards": 0, "released": 0, "rows": 0}
+    try:
+        while True:
+            shard = queue.claim(owner)
+            if shard is None:
+                counts = queue.counts()
+                if not counts.get("pending") and not counts.get("leased"):
+                    break
+                time.sleep(poll_seconds)
+                continue
+            print(f"{owner}: {shard['city']['city']} {shard['property_type']} pages {shard['first_page']}-{shard['last_page']}")
+            try:
+                rows = crawl_shard(shard, queue, owner, url, output_dir, pages_per_shard)
+            except LeaseLost as e:
+                print(e)
+                stats["released"] += 1
+                continue
+            except RetryableError as e:
+                print(e)
+                queue.fail(shard["shard_id"], owner, str(e))
+                stats["released"] += 1
+                continue
+            stats["shards"] += 1
+            stats["rows"] += rows
+    finally:
+        queue.close()
+        if cache:
+            cache.close()
+    print(f"{owner}: {stats}")
+    return stats
+
+
+def run_workers(workers: int, queue_path: str = QUEUE_FILE, **kwargs) -> list:
+    """
+    Runs `run_worker` in `workers` processes and waits for them.
+
+    Returns
+    -------
+    list of int
+        Exit codes of the processes.
+    """
+    processes = [multiprocessing.Process(target=run_worker, args=(queue_path,), kwargs=kwargs) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
+
+
+def merge_outputs(queue: WorkQueue, path: str, partial: bool = False, dedup: Deduplicator | None = None) -> dict:
+    """
+    Concatenates the CSV files of the done shards into `path`, in the order of the
+    scope, which is the order of the sequential crawl.
+
+    Each shard is deduplicated on its own (see `crawl_shard`), so the listings
+    found in several shards are dropped here, on the parsed `id` column, keeping the
+    first. Rows without an id are all kept.
+
+    Parameters
+    ----------
+    queue : WorkQueue
+        Queue of the crawl.
+    path : str
+        Merged CSV file.
+    partial : bool
+        Merge even though some shards are not done.
+    dedup : Deduplicator, optional
+        Listing ids seen so far, an exact `SeenSet` by default.
+
+    Returns
+    -------
+    dict
+        Shard files merged, rows written and the deduplication report.
+
+    Raises
+    ------
+    RuntimeError
+        If shards are still pending or leased and `partial` is False.
+    """
+    counts = queue.counts()
+    if not partial and (counts.get("pending") or counts.get("leased")):
+        raise RuntimeError(f"The crawl is not finished: {counts}")
+    outputs = queue.outputs()
+    dedup = dedup if dedup is not None else SeenSet()
+    rows = 0
+    duplicates = 0
+    with open(path, "w", newline="") as merged:
+        #the shards are written by pandas `to_csv`, which quotes the same way
+        writer = csv.writer(merged, lineterminator="\n")
+        for position, output in enumerate(outputs):
+            with open(output, newline="") as f:
+                reader = csv.reader(f)
+                header = next(reader)
+                if position == 0:
+                    writer.writerow(header)
+                id_index = header.index("id")
+                for row in reader:
+                    if not row[id_index] or dedup.add(row[id_index]):
+                        writer.writerow(row)
+                        rows += 1
+                    else:
+                        duplicates += 1
+    return {"shards": len(outputs), "rows": rows, "duplicates": duplicates}
+
+
+if __name__ == '__main__':
+
+    import argparse
+    from datetime import date
+    parser = argparse.ArgumentParser(description="Sharded crawl of FincaRaiz with a durable work queue shared by several workers")
+    parser.add_argument("--queue", default=QUEUE_FILE, help="SQLite file of the work queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+    plan = commands.add_parser("plan", help="Queue the first shard of every city and property type of the scope")
+    plan.add_argument("--scope", default=scraper.SCOPE_FILE, help="JSON config file with the cities and property types")
+    plan.add_argument("--pages-per-shard", type=int, help="Result pages per shard, the scope file or 20 by default")
+    work = commands.add_parser("work", help="Claim and crawl shards until the queue is empty")
+    work.add_argument("--workers", type=int, default=1, help="Worker processes on this node")
+    work.add_argument("--output-dir", default=SHARD_DIR, help="Directory of the shard outputs, shared by the workers")
+    work.add_argument("--url", default=scraper.URL, help="Search endpoint")
+    work.add_argument("--pages-per-shard", type=int, default=PAGES_PER_SHARD, help="Result pages of the shards queued by the workers")
+    work.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS, help="Seconds without progress after which a shard goes to another worker")
+    work.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS, help="Claims of a shard before it is marked failed")
+    work.add_argument("--rate", type=float, default=0, help="Maximum requests per second of each worker, 0 for no limit")
+    work.add_argument("--burst", type=int, default=1, help="Requests allowed back to back before the rate applies")
+    work.add_argument("--cache", metavar="DIR", help="Keep the raw responses in a compressed cache in DIR")
+    commands.add_parser("status", help="Print the number of shards by status")
+    merge = commands.add_parser("merge", help="Concatenate the shard outputs into one CSV file")
+    merge.add_argument("--output", default=f"COLOMBIA_REAL_STATE_{date.today()}.csv", help="Merged CSV file")
+    merge.add_argument("--partial", action="store_true", help="Merge the done shards even though the crawl is not finished")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        scope = scraper.load_scope(args.scope)
+        queue = WorkQueue(args.queue)
+        added = queue.plan(scope["cities"], scope["property_types"], args.pages_per_shard or scope["pages_per_shard"] or PAGES_PER_SHARD)
+        print(f'{added} shards queued for {len(scope["cities"])} cities and {len(scope["property_types"])} property types')
+    elif args.command == "work":
+        options = {"url": args.url, "output_dir": args.output_dir, "pages_per_shard": args.pages_per_shard, "lease_seconds": args.lease_seconds,
+                   "max_attempts": args.max_attempts, "rate": args.rate, "burst": args.burst, "cache_dir": args.cache}
+        if args.workers > 1:
+            print(f'Exit codes: {run_workers(args.workers, args.queue, **options)}')
+        else:
+            run_worker(args.queue, **options)
+    elif args.command == "status":
+        queue = WorkQueue(args.queue)
+        print(json.dumps(queue.counts()))
+    else:
+        queue = WorkQueue(args.queue)
+        merged = merge_outputs(queue, args.output, args.partial)
+        print(f'{merged["shards"]} shard files merged into {args.output}: {merged["rows"]} listings, {merged["duplicates"]} duplicates dropped')
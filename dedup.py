@@ -0,0 +1,141 @@
+import hashlib
+import math
+
+BLOOM_ERROR_RATE = 0.001 #false positive rate of the Bloom filter at its capacity
+
+
+def hit_key(hit: dict) -> str:
+    """
+    Returns the listing id of a search hit, the key of the `id` column.
+    """
+    return str(hit["_source"]["listing"]["id"])
+
+
+class Deduplicator:
+    """
+    Drops the hits of listings already seen in the crawl, before they are transformed.
+
+    Subclasses decide how the keys are remembered (`SeenSet`, `BloomFilter`).
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.duplicates = 0
+
+    def add(self, key: str) -> bool:
+        """
+        Records a key, returns False when it was already seen.
+        """
+        raise NotImplementedError
+
+    def filter(self, hits: list) -> list:
+        """
+        Returns the hits whose listing was not seen before, in order.
+        """
+        unique = [hit for hit in hits if self.add(hit_key(hit))]
+        self.hits += len(hits)
+        self.duplicates += len(hits) - len(unique)
+        return unique
+
+    def report(self) -> dict:
+        """
+        Returns the hits checked, the duplicates dropped and the share of duplicates.
+        """
+        return {
+            "hits": self.hits,
+            "duplicates": self.duplicates,
+            "duplicate_rate": round(self.duplicates / self.hits, 4) if self.hits else 0.0,
+        }
+
+
+class SeenSet(Deduplicator):
+    """
+    Exact deduplication with a set of the keys.
+
+    The set holds the id strings, so no two listings are ever confused. The ids are
+    kept alive by the set, which costs the string and its share of the hash table per
+    listing: 90 to 115 bytes for ids of 10 characters, depending on how full the table
+    is (see `benchmarks/bench_dedup.py`), one more byte per extra character.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.seen = set()
+
+    def add(self, key: str) -> bool:
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
+
+    def __len__(self) -> int:
+        return len(self.seen)
+
+
+class BloomFilter(Deduplicator):
+    """
+    Deduplication with a Bloom filter, for crawls too large to keep every key.
+
+    The filter takes a fixed `capacity * 1.44 * log2(1 / error_rate)` bits, about
+    1.8 bytes per listing at a 0.1% error rate. A new listing is dropped as a
+    duplicate with probability `error_rate` once `capacity` listings were seen,
+    more beyond that.
+
+    Parameters
+    ----------
+    capacity : int
+        Listings expected in the crawl.
+    error_rate : float
+        False positive rate at `capacity` listings.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        super().__init__()
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> list:
+        # double hashing: the positions are h1 + i * h2 for two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: str) -> bool:
+        new = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                new = True
+        self.count += new
+        return new
+
+    def report(self) -> dict:
+        report = super().report()
+        report["bloom_bytes"] = len(self.bits)
+        return report
+
+
+_deduplicator = None
+
+
+def configure_dedup(bloom_capacity: int | None = None, error_rate: float = BLOOM_ERROR_RATE) -> Deduplicator:
+    """
+    Replaces the shared deduplicator: a Bloom filter sized for `bloom_capacity`
+    listings when given, a `SeenSet` otherwise.
+    """
+    global _deduplicator
+    _deduplicator = BloomFilter(bloom_capacity, error_rate) if bloom_capacity else SeenSet()
+    return _deduplicator
+
+
+def get_dedup() -> Deduplicator:
+    """
+    Returns the shared deduplicator, a `SeenSet` unless configured otherwise.
+    """
+    global _deduplicator
+    if _deduplicator is None:
+        _deduplicator = SeenSet()
+    return _deduplicator
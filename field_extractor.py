@@ -0,0 +1,213 @@
+import re
+
+# Output field -> path (or list of alternative paths) inside `_source.listing`.
+# Path syntax: `a.b` for keys, `[7]` for list positions and `[field=rooms]` for the
+# first list element whose `field` equals `rooms`. An alternative is only tried when
+# the previous paths don't resolve. Rooms are None when no entry of the technical
+# sheet is keyed `rooms`: the entry at a fixed position may be another field.
+LISTING_SPEC = {
+    'id': 'id',
+    'price': 'price.amount',
+    'area': 'm2',
+    'rooms': 'technicalSheet[field=rooms].value',
+    'bathrooms': 'bathrooms',
+    'garage': 'garage',
+    'property_type': 'property_type.name',
+    'stratum': 'stratum',
+    'latitude': 'locations.location_point.coordinates[1]',
+    'longitude': 'locations.location_point.coordinates[0]',
+    'city': 'locations.city[0].name',
+}
+LISTING_ROOT = '_source.listing'
+
+_STEP = re.compile(r"\.?([^.\[\]]+)|\[(\d+)\]|\[([^=\]]+)=([^\]]*)\]")
+_MISSING = (KeyError, IndexError, TypeError)
+
+
+def _find(items, key: str, value: str):
+    for item in items:
+        if isinstance(item, dict) and str(item.get(key)) == value:
+            return item
+    return None
+
+
+def parse_path(path: str) -> list:
+    """
+    Splits a path expression into steps.
+
+    Parameters
+    ----------
+    path : str
+        Path such as `locations.city[0].name` or `technicalSheet[field=rooms].value`.
+
+    Returns
+    -------
+    list of tuple
+        ('key', name), ('index', position) or ('match', key, value) steps.
+    """
+    steps = []
+    position = 0
+    while position < len(path):
+        match = _STEP.match(path, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Invalid path {path!r} at position {position}")
+        key, index, match_key, match_value = match.groups()
+        if key is not None:
+            steps.append(('key', key))
+        elif index is not None:
+            steps.append(('index', int(index)))
+        else:
+            steps.append(('match', match_key, match_value))
+        position = match.end()
+    return steps
+
+
+def _expression(base: str, path: str) -> str:
+    expression = base
+    for step in parse_path(path):
+        if step[0] == 'key':
+            expression = f"{expression}[{step[1]!r}]"
+        elif step[0] == 'index':
+            expression = f"{expression}[{step[1]}]"
+        else:
+            expression = f"_find({expression}, {step[1]!r}, {step[2]!r})"
+    return expression
+
+
+def _fast_body(spec: dict, root: str, indent: str) -> list:
+    # Every field read with plain subscripts in a single try, the first path of each.
+    # Prefixes shared by several fields are read once, and a `[key=value]` lookup first
+    # checks the position where it matched last time (`_hints`). Any missing step falls
+    # back to `_body`, which resolves each field on its own.
+    paths = [parse_path(paths if isinstance(paths, str) else paths[0]) for paths in spec.values()]
+    counts = {}
+    for steps in paths:
+        for length in range(1, len(steps)):
+            counts[tuple(steps[:length])] = counts.get(tuple(steps[:length]), 0) + 1
+    lines = [f"{indent}try:", f"{indent}    root = {_expression('hit', root) if root else 'hit'}"]
+    names = {}
+    matches = 0  # `[key=value]` steps, each with its own hint
+    shared = 0
+    for number, steps in enumerate(paths):
+        expression = 'root'
+        for length, step in enumerate(steps, 1):
+            prefix = tuple(steps[:length])
+            if prefix in names:
+                expression = names[prefix]
+                continue
+            if step[0] == 'key':
+                expression = f"{expression}[{step[1]!r}]"
+            elif step[0] == 'index':
+                expression = f"{expression}[{step[1]}]"
+            else:
+                items, item, hint = f"s{matches}", f"m{matches}", f"_hints[{matches}]"
+                lines += [
+                    f"{indent}    {items} = {expression}",
+                    f"{indent}    {item} = {items}[{hint}] if {hint} < len({items}) else None",
+                    # keys that aren't strings miss the hint and are compared as text by `_find`
+                    f"{indent}    if {item}.__class__ is not dict or {item}.get({step[1]!r}) != {step[2]!r}:",
+                    f"{indent}        {item} = _find({items}, {step[1]!r}, {step[2]!r})",
+                    f"{indent}        if {item} is not None:",
+                    f"{indent}            {hint} = {items}.index({item})",
+                ]
+                expression = names[prefix] = item
+                matches += 1
+                continue
+            # only the longest prefix shared by the same fields is kept
+            if length < len(steps) and counts[prefix] > counts.get(tuple(steps[:length + 1]), 1):
+                names[prefix] = f"p{shared}"
+                shared += 1
+                lines.append(f"{indent}    {names[prefix]} = {expression}")
+                expression = names[prefix]
+        lines.append(f"{indent}    v{number} = {expression}")
+    lines.append(f"{indent}except _MISSING:")
+    return lines + _body(spec, root, indent + "    ")
+
+
+def _body(spec: dict, root: str, indent: str) -> list:
+    lines = [
+        f"{indent}try:",
+        f"{indent}    root = {_expression('hit', root) if root else 'hit'}",
+        f"{indent}except _MISSING:",
+        f"{indent}    root = None",
+    ]
+    for number, paths in enumerate(spec.values()):
+        lines.append(f"{indent}v{number} = None")
+        # every alternative is tried in the except clause of the previous one
+        inner = indent
+        for path in [paths] if isinstance(paths, str) else paths:
+            lines += [
+                f"{inner}try:",
+                f"{inner}    v{number} = {_expression('root', path)}",
+                f"{inner}except _MISSING:",
+            ]
+            inner += "    "
+        lines.append(f"{inner}pass")
+    return lines
+
+
+class FieldExtractor:
+    """
+    Extractor compiled once from a field mapping spec.
+
+    The spec is turned into Python source with the path lookups inlined. A hit is
+    first read with plain subscripts in a single exception handler, reading the
+    prefixes shared by several fields once; a `[key=value]` lookup checks the position
+    where it matched the previous hit before scanning the list. When a step is
+    missing, every field is resolved on its own, so missing keys, positions or lookups
+    give None instead of raising.
+
+    Even though rooms are looked up by key, `values` extracts a record 1.25x faster
+    than the hand-written lookups it replaced and `__call__` is on par. `data_transform`
+    as a whole runs at 0.95x to 0.98x of the hand-written version, and `columns` at
+    about 1.15x (see `benchmarks/bench_transform.py`).
+
+    Parameters
+    ----------
+    spec : dict
+        Output field -> path, or list of alternative paths tried in order until one resolves.
+        A path resolves when its keys, positions and lookups exist, even if the value is None.
+    root : str
+        Path applied to every hit before the field paths.
+
+    Attributes
+    ----------
+    values : callable
+        hit -> tuple of the fields, in the order of the spec.
+    columns : callable
+        Iterable of hits -> dict of output field -> list of values, in the order of the spec.
+    """
+
+    def __init__(self, spec: dict = LISTING_SPEC, root: str = LISTING_ROOT):
+        self.spec = spec
+        self.root = root
+        fields = list(spec)
+        first_paths = [paths if isinstance(paths, str) else paths[0] for paths in spec.values()]
+        hints = [0] * sum(step[0] == 'match' for path in first_paths for step in parse_path(path))
+        namespace = {'_find': _find, '_MISSING': _MISSING, '_hints': hints}
+
+        record = "{" + ", ".join(f"{field!r}: v{number}" for number, field in enumerate(fields)) + "}"
+        values = "(" + "".join(f"v{number}, " for number in range(len(fields))) + ")"
+        source = ["def extract(hit):", *_fast_body(spec, root, "    "), f"    return {record}"]
+        source += ["", "def extract_values(hit):", *_fast_body(spec, root, "    "), f"    return {values}"]
+        source += [
+            "",
+            "def extract_columns(hits):",
+            *(f"    c{number} = []" for number in range(len(fields))),
+            "    for hit in hits:",
+            *_fast_body(spec, root, "        "),
+            *(f"        c{number}.append(v{number})" for number in range(len(fields))),
+            "    return {" + ", ".join(f"{field!r}: c{number}" for number, field in enumerate(fields)) + "}",
+        ]
+        self.source = "\n".join(source)
+        exec(compile(self.source, "<field_extractor>", "exec"), namespace)
+        self._extract = namespace['extract']
+        # the compiled functions themselves, a wrapper method would cost a call per hit
+        self.values = namespace['extract_values']
+        self.columns = namespace['extract_columns']
+
+    def __call__(self, hit: dict) -> dict:
+        """
+        Extracts one record from a hit.
+        """
+        return self._extract(hit)
@@ -0,0 +1,236 @@
+import math
+import re
+import sqlite3
+
+GEOHASH_PRECISION = 7 #characters of the geohash cell key, about 150 m x 150 m
+EARTH_RADIUS_KM = 6371.0088
+SPATIAL_INDEX_TABLE = "living_space_geo"
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?")
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def coordinate(value, limit: float) -> float | None:
+    """
+    Converts a raw coordinate to a float, None when it is missing, not a number or outside [-limit, limit].
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if -limit <= value <= limit else None
+
+
+def parse_location(value) -> tuple:
+    """
+    Latitude and longitude of a location point as written by the scraper before the
+    coordinates had their own columns: the text of a GeoJSON point,
+    `{'type': 'point', 'coordinates': [longitude, latitude]}`. Each is None when it
+    can't be read or is out of range.
+    """
+    if not isinstance(value, str):
+        return None, None
+    start = value.find("coordinates")
+    numbers = _NUMBER.findall(value[start:] if start >= 0 else value)
+    if len(numbers) < 2:
+        return None, None
+    return coordinate(numbers[1], 90), coordinate(numbers[0], 180)
+
+
+def _spread(value: int) -> int:
+    # inserts a zero bit after every bit of a 32 bit integer
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    return (value | (value << 1)) & 0x5555555555555555
+
+
+def geohash(latitude: float | None, longitude: float | None, precision: int = GEOHASH_PRECISION) -> str | None:
+    """
+    Geohash of a point: listings in the same cell share the key, and the keys of
+    neighbouring cells usually share a prefix.
+
+    Parameters
+    ----------
+    latitude, longitude : float or None
+        Point in degrees.
+    precision : int
+        Length of the geohash, at most 12.
+
+    Returns
+    -------
+    str or None
+        The geohash, None when a coordinate is missing.
+    """
+    if latitude is None or longitude is None:
+        return None
+    bits = 5 * precision
+    longitude_bits = (bits + 1) // 2
+    latitude_bits = bits // 2
+    # the cell of each axis is the integer part of the scaled coordinate, the last cell includes the upper bound
+    longitude_cell = min(int((longitude + 180.0) / 360.0 * (1 << longitude_bits)), (1 << longitude_bits) - 1)
+    latitude_cell = min(int((latitude + 90.0) / 180.0 * (1 << latitude_bits)), (1 << latitude_bits) - 1)
+    # bits alternate starting with longitude, so the last bit is longitude when the count is odd
+    if bits % 2:
+        code = _spread(longitude_cell) | (_spread(latitude_cell) << 1)
+    else:
+        code = (_spread(longitude_cell) << 1) | _spread(latitude_cell)
+    return "".join(_BASE32[(code >> shift) & 31] for shift in range(bits - 5, -1, -5))
+
+
+def haversine_km(latitude: float, longitude: float, other_latitude: float, other_longitude: float) -> float:
+    """
+    Great-circle distance in kilometers between two points given in degrees.
+    """
+    latitude, longitude, other_latitude, other_longitude = map(math.radians, (latitude, longitude, other_latitude, other_longitude))
+    a = (math.sin((other_latitude - latitude) / 2) ** 2
+         + math.cos(latitude) * math.cos(other_latitude) * math.sin((other_longitude - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bounding_box(latitude: float, longitude: float, radius_km: float) -> tuple:
+    """
+    Smallest latitude/longitude box containing the circle of `radius_km` around a point.
+
+    Returns
+    -------
+    tuple of float
+        (min_latitude, max_latitude, min_longitude, max_longitude).
+    """
+    latitude_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_latitude, max_latitude = latitude - latitude_delta, latitude + latitude_delta
+    if min_latitude <= -90 or max_latitude >= 90:
+        return max(min_latitude, -90.0), min(max_latitude, 90.0), -180.0, 180.0
+    longitude_delta = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)))))
+    return min_latitude, max_latitude, longitude - longitude_delta, longitude + longitude_delta
+
+
+def spatial_index_ddl(sqlite: bool, if_not_exists: bool = False) -> str:
+    """
+    CREATE statement of the spatial index of the listings.
+
+    SQLite gets an R*Tree virtual table with a degenerate box per listing, and the
+    listing id and exact coordinates as auxiliary columns so queries need no join. MySQL gets a table of points with a SPATIAL index,
+    in planar degrees: the index only selects candidates, distances are computed
+    afterwards.
+    """
+    create = ("CREATE VIRTUAL TABLE" if sqlite else "CREATE TABLE") + (" IF NOT EXISTS" if if_not_exists else "")
+    if sqlite:
+        return (f"{create} {SPATIAL_INDEX_TABLE} USING rtree(key, min_latitude, max_latitude, min_longitude, max_longitude, "
+                f"+id TEXT, +latitude REAL, +longitude REAL)")
+    return (f"{create} {SPATIAL_INDEX_TABLE} (id VARCHAR(64) NOT NULL, point POINT NOT NULL SRID 0, "
+            f"PRIMARY KEY (id), SPATIAL INDEX (point)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4")
+
+
+def rebuild_spatial_index(cursor, living_space: str, sqlite: bool) -> int:
+    """
+    Fills the spatial index with every listing of `living_space` that has coordinates,
+    in the transaction of the caller, and returns the number of listings indexed.
+    """
+    cursor.execute(f"DELETE FROM {SPATIAL_INDEX_TABLE}")
+    if sqlite:
+        cursor.execute(
+            f"INSERT INTO {SPATIAL_INDEX_TABLE} (min_latitude, max_latitude, min_longitude, max_longitude, id, latitude, longitude) "
+            f"SELECT latitude, latitude, longitude, longitude, id, latitude, longitude FROM {living_space} "
+            f"WHERE latitude IS NOT NULL AND longitude IS NOT NULL")
+    else:
+        cursor.execute(
+            f"INSERT INTO {SPATIAL_INDEX_TABLE} (id, point) SELECT id, POINT(longitude, latitude) FROM {living_space} "
+            f"WHERE latitude IS NOT NULL AND longitude IS NOT NULL")
+    return cursor.rowcount
+
+
+def update_spatial_index(cursor, sqlite: bool, removed: list, added: list) -> int:
+    """
+    Updates the spatial index for some listings, in the transaction of the caller, and
+    returns the number of listings indexed.
+
+    Parameters
+    ----------
+    cursor : cursor
+        Cursor of a sqlite3 or mysql.connector connection.
+    sqlite : bool
+        The database is SQLite, MySQL otherwise.
+    removed : list of tuple
+        (id, latitude, longitude) of the entries to remove, with the coordinates they
+        were indexed at: the R*Tree is searched by box, its listing id is not indexed.
+    added : list of tuple
+        (id, latitude, longitude) of the listings to index.
+    """
+    if sqlite:
+        cursor.executemany(
+            f"DELETE FROM {SPATIAL_INDEX_TABLE} WHERE min_latitude <= ? AND max_latitude >= ? "
+            f"AND min_longitude <= ? AND max_longitude >= ? AND id = ?",
+            [(latitude, latitude, longitude, longitude, listing_id) for listing_id, latitude, longitude in removed])
+        cursor.executemany(
+            f"INSERT INTO {SPATIAL_INDEX_TABLE} (min_latitude, max_latitude, min_longitude, max_longitude, id, latitude, longitude) "
+            f"VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(latitude, latitude, longitude, longitude, listing_id, latitude, longitude) for listing_id, latitude, longitude in added])
+    else:
+        cursor.executemany(f"DELETE FROM {SPATIAL_INDEX_TABLE} WHERE id = %s", [(listing_id,) for listing_id, _, _ in removed])
+        cursor.executemany(
+            f"INSERT INTO {SPATIAL_INDEX_TABLE} (id, point) VALUES (%s, POINT(%s, %s))",
+            [(listing_id, longitude, latitude) for listing_id, latitude, longitude in added])
+    return len(added)
+
+
+def listings_in_box(db_connection, min_latitude: float, max_latitude: float, min_longitude: float, max_longitude: float) -> list:
+    """
+    Listings inside a latitude/longitude box, found through the spatial index.
+
+    Parameters
+    ----------
+    db_connection : sqlite3.Connection or mysql.connector connection
+        Connection to a database loaded by `load_to_db` with `bulk` or `incremental`.
+    min_latitude, max_latitude, min_longitude, max_longitude : float
+        Bounds of the box in degrees, included.
+
+    Returns
+    -------
+    list of tuple
+        (id, latitude, longitude) of every listing in the box.
+    """
+    cursor = db_connection.cursor()
+    if isinstance(db_connection, sqlite3.Connection):
+        # the R*Tree boxes are 32 bit floats rounded outwards, the exact bounds are checked on the auxiliary columns
+        cursor.execute(
+            f"SELECT id, latitude, longitude FROM {SPATIAL_INDEX_TABLE} "
+            f"WHERE min_latitude <= ? AND max_latitude >= ? AND min_longitude <= ? AND max_longitude >= ? "
+            f"AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?",
+            (max_latitude, min_latitude, max_longitude, min_longitude, min_latitude, max_latitude, min_longitude, max_longitude))
+    else:
+        box = (f"POLYGON(({min_longitude} {min_latitude}, {max_longitude} {min_latitude}, {max_longitude} {max_latitude}, "
+               f"{min_longitude} {max_latitude}, {min_longitude} {min_latitude}))")
+        cursor.execute(
+            f"SELECT id, ST_Y(point), ST_X(point) FROM {SPATIAL_INDEX_TABLE} WHERE MBRContains(ST_GeomFromText(%s), point)", (box,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def listings_within(db_connection, latitude: float, longitude: float, radius_km: float) -> list:
+    """
+    Listings within `radius_km` of a point, nearest first.
+
+    The spatial index selects the listings of the bounding box of the circle, and
+    the great-circle distance keeps the ones inside it.
+
+    Parameters
+    ----------
+    db_connection : sqlite3.Connection or mysql.connector connection
+        Connection to a database loaded by `load_to_db` with `bulk` or `incremental`.
+    latitude, longitude : float
+        Center in degrees.
+    radius_km : float
+        Radius in kilometers.
+
+    Returns
+    -------
+    list of tuple
+        (id, distance in km) of the listings in the circle.
+    """
+    candidates = listings_in_box(db_connection, *bounding_box(latitude, longitude, radius_km))
+    distances = [(listing_id, haversine_km(latitude, longitude, listing_latitude, listing_longitude))
+                 for listing_id, listing_latitude, listing_longitude in candidates]
+    return sorted([row for row in distances if row[1] <= radius_km], key=lambda row: row[1])
@@ -0,0 +1,187 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+REQUEST_TIMEOUT = (5, 30) #seconds to connect and between bytes of the response, a stalled request fails with requests.Timeout
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter shared by every thread using a session.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second (sustained requests per second). 0 disables the limiter.
+    burst : int
+        Maximum number of tokens stored, i.e. requests allowed back to back.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.wait_time = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes one token, sleeping until one is available.
+
+        Returns
+        -------
+        float
+            Seconds spent waiting for the token.
+        """
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.wait_time += waited
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class SessionStats:
+    """
+    Connection and limiter counters of a `PooledSession`.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.pools_created = 0
+        self.new_connections = 0
+        self._lock = threading.Lock()
+
+    def incr(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @property
+    def pool_hits(self) -> int:
+        """Requests served by an already existing host pool."""
+        return self.requests - self.pools_created
+
+    @property
+    def reused_connections(self) -> int:
+        """Requests sent over a kept-alive connection instead of a new one."""
+        return self.requests - self.new_connections
+
+
+def _counting_pool(pool_class: type, stats: SessionStats) -> type:
+    class CountingPool(pool_class):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            stats.incr("pools_created")
+
+        def _new_conn(self):
+            stats.incr("new_connections")
+            return super()._new_conn()
+
+    return CountingPool
+
+
+class CountingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connection pools report to a `SessionStats`.
+    """
+
+    def __init__(self, stats: SessionStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.stats),
+            "https": _counting_pool(HTTPSConnectionPool, self.stats),
+        }
+
+
+class PooledSession:
+    """
+    Keep-alive HTTP session with connection pooling, gzip negotiation and rate limiting.
+
+    Parameters
+    ----------
+    rate : float
+        Maximum sustained requests per second, 0 for no limit.
+    burst : int
+        Requests allowed back to back before the rate applies.
+    pool_size : int
+        Connections kept alive per host, should be at least the number of concurrent requests.
+    timeout : tuple of float
+        (connect, read) timeout in seconds of the requests that don't set their own.
+    """
+
+    def __init__(self, rate: float = 0, burst: int = 1, pool_size: int = 10, timeout: tuple = REQUEST_TIMEOUT):
+        self.timeout = timeout
+        self.stats = SessionStats()
+        self.limiter = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+        adapter = CountingAdapter(self.stats, pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        self.limiter.acquire()
+        self.stats.incr("requests")
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, **kwargs)
+
+    def report(self) -> dict:
+        """
+        Returns the session counters.
+
+        Returns
+        -------
+        dict
+            requests, pool_hits, new_connections, reused_connections and limiter_wait (seconds).
+        """
+        return {
+            "requests": self.stats.requests,
+            "pool_hits": self.stats.pool_hits,
+            "new_connections": self.stats.new_connections,
+            "reused_connections": self.stats.reused_connections,
+            "limiter_wait": round(self.limiter.wait_time, 3),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure_session(rate: float = 0, burst: int = 1, pool_size: int = 10, timeout: tuple = REQUEST_TIMEOUT) -> PooledSession:
+    """
+    Replaces the shared session used by `get_data` with a new one.
+    """
+    global _session
+    if _session is not None:
+        _session.close()
+    _session = PooledSession(rate, burst, pool_size, timeout)
+    return _session
+
+
+def get_session() -> PooledSession:
+    """
+    Returns the shared session, creating it with default settings on first use.
+    """
+    with _session_lock:
+        if _session is None:
+            configure_session()
+    return _session
@@ -0,0 +1,53 @@
+import json
+
+# Fastest JSON library available: orjson, then msgspec, then the standard library.
+# `loads` accepts bytes or str and `dumps` returns compact bytes.
+try:
+    import orjson
+
+    BACKEND = "orjson"
+    loads = orjson.loads
+    dumps = orjson.dumps
+except ImportError:
+    try:
+        import msgspec
+
+        BACKEND = "msgspec"
+        loads = msgspec.json.decode
+        dumps = msgspec.json.encode
+    except ImportError:
+        BACKEND = "json"
+        loads = json.loads
+
+        def dumps(obj) -> bytes:
+            return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+_PAGE_PLACEHOLDER = -918273645
+
+
+class PayloadTemplate:
+    """
+    Request payload serialized once, with only the page number patched in per request.
+
+    Parameters
+    ----------
+    payload : dict
+        Payload built for any page, whose page number fields are given by `page_paths`.
+    page_paths : list of tuple
+        Key paths of the page number fields inside the payload.
+    """
+
+    def __init__(self, payload: dict, page_paths: list):
+        for path in page_paths:
+            target = payload
+            for key in path[:-1]:
+                target = target[key]
+            target[path[-1]] = _PAGE_PLACEHOLDER
+        self.parts = dumps(payload).split(str(_PAGE_PLACEHOLDER).encode())
+
+    def render(self, page: int) -> bytes:
+        """
+        Returns the serialized payload for `page`.
+        """
+        return str(page).encode().join(self.parts)
@@ -0,0 +1,97 @@
+import sqlite3
+import threading
+
+REGISTRY_FILE = "dimension_keys.db"
+
+
+class KeyRegistry:
+    """
+    Persisted surrogate keys of the dimension values (cities, property types), shared by the loaders.
+
+    A value keeps the key it got the first time it was seen, whatever the loader or
+    the day, so ids can be joined across runs and exports. Keys are read once per
+    dimension into an in-memory cache. The values not registered yet are given
+    consecutive keys after the largest stored one, in sorted order, within a
+    `BEGIN IMMEDIATE` transaction, so loaders registering values at the same time
+    from other processes never hand out the same key twice.
+
+    Parameters
+    ----------
+    path : str
+        SQLite file holding the keys.
+    """
+
+    def __init__(self, path: str = REGISTRY_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS dimension_keys (
+                dimension TEXT, value TEXT, key INTEGER,
+                PRIMARY KEY (dimension, value), UNIQUE (dimension, key))
+        """)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _load(self, dimension: str) -> dict:
+        if dimension not in self._cache:
+            self._cache[dimension] = dict(self.connection.execute(
+                "SELECT value, key FROM dimension_keys WHERE dimension = ?", (dimension,)))
+        return self._cache[dimension]
+
+    def keys(self, dimension: str, values) -> dict:
+        """
+        Returns the value -> key map of `values`, registering the values not seen before.
+
+        Parameters
+        ----------
+        dimension : str
+            Name of the dimension, e.g. "city".
+        values : iterable of str
+            Values to look up. None values are ignored.
+
+        Returns
+        -------
+        dict
+            Key of every distinct value.
+        """
+        with self._lock:
+            known = self._load(dimension)
+            wanted = {value for value in values if value is not None}
+            missing = sorted(wanted - known.keys())
+            if missing:
+                # another process may have registered some of them, or other values, since the cache was read
+                self.connection.execute("BEGIN IMMEDIATE")
+                try:
+                    known.update(self.connection.execute(
+                        "SELECT value, key FROM dimension_keys WHERE dimension = ?", (dimension,)))
+                    missing = sorted(wanted - known.keys())
+                    start = self.connection.execute(
+                        "SELECT COALESCE(MAX(key), 0) + 1 FROM dimension_keys WHERE dimension = ?", (dimension,)).fetchone()[0]
+                    new_keys = {value: start + offset for offset, value in enumerate(missing)}
+                    self.connection.executemany(
+                        "INSERT INTO dimension_keys VALUES (?, ?, ?)",
+                        [(dimension, value, key) for value, key in new_keys.items()])
+                    self.connection.execute("COMMIT")
+                except BaseException:
+                    self.connection.execute("ROLLBACK")
+                    raise
+                known.update(new_keys)
+            return {value: known[value] for value in wanted}
+
+    def close(self):
+        self.connection.close()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(path: str = REGISTRY_FILE) -> KeyRegistry:
+    """
+    Returns the registry of the process, opening `path` on first use.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None or _registry.path != path:
+            _registry = KeyRegistry(path)
+        return _registry
@@ -1,13 +1,49 @@
 import pandas as pd
-import numpy as np
-import sqlite3
-import mysql.connector
-from sqlalchemy import create_engine
-import json
+from bulk_loader import connect_to_db, load_to_db
+from parquet_sink import partition_filters
+from key_registry import KeyRegistry, get_registry
+from transform_engine import apply_rules, cast_to_plan, column_types, is_legacy_csv, read_legacy_csv
 
 TABLE_NAMES = ['living_space', 'cities', 'properties']
 DB_NAME = "col_real_estate"
 
+def read_csv(path: str) -> pd.DataFrame:
+    """
+    Read a scraper CSV file with the types of `transform_engine.column_types`. Files
+    with the old `location` column are converted (see `transform_engine.read_legacy_csv`).
+    """
+    if is_legacy_csv(path):
+        return read_legacy_csv(path)
+    return pd.read_csv(path, dtype=column_types("pandas", read=True))
+
+
+def load_parquet(path: str, scrape_dates: list | None = None, cities: list | None = None, property_types: list | None = None, since: str | None = None, columns: list | None = None) -> pd.DataFrame:
+    """
+    Read the Parquet dataset written by the scraper, pushing filters and columns down to the reader.
+
+    Parameters
+    ----------
+    path : str
+        Root directory of the dataset.
+    scrape_dates : list of str, optional
+        Scrape dates to read.
+    cities : list of str, optional
+        Cities to read.
+    property_types : list of str, optional
+        Property types to read.
+    since : str, optional
+        First scrape date to read (YYYY-MM-DD).
+    columns : list of str, optional
+        Columns to read, all by default.
+
+    Returns
+    -------
+    pd.DataFrame
+        The listings of the selected partitions.
+    """
+    return pd.read_parquet(path, columns=columns, filters=partition_filters(scrape_dates, cities, property_types, since))
+
+
 def impute_values(df: pd.DataFrame) -> pd.DataFrame:
     """
     Impute missing values and clean up the data in a DataFrame.
@@ -20,28 +56,26 @@ def impute_values(df: pd.DataFrame) -> pd.DataFrame:
     Returns
     -------
     pd.DataFrame
-        DataFrame with imputed values for `rooms` and `stratum`, and duplicate rows removed.
+        The listing columns cleaned with the shared `transform_engine.CLEANING_RULES`: rows with
+        a duplicate id and rows without area removed, and imputed `rooms` and `stratum`.
+        Columns use the dtypes of `transform_engine.DTYPE_PLAN`.
     """
-    df.drop_duplicates(inplace=True)
-    df.dropna(subset='area', inplace=True)
+    return cast_to_plan(apply_rules(df, "pandas"), "pandas")
 
-    df['rooms'] = df.apply(lambda x: 1 if (not(x['rooms']>0) and x['property_type']=='Apartaestudio') else x['rooms'], axis=1)
-    df['rooms'] = df['rooms'].fillna(0)
 
-    df['stratum'] = df.apply(lambda x: 1 if x['stratum']<1 else x['stratum'], axis=1)
-    df['stratum'] = df.apply(lambda x: 6 if x['stratum']>6 else x['stratum'], axis=1)
-            
-    return df
-
-
-def create_tables(df: pd.DataFrame) -> list[pd.DataFrame]:
+def create_tables(df: pd.DataFrame, registry: KeyRegistry | None = None) -> list[pd.DataFrame]:
     """
     Create tables from a DataFrame with real estate data for database insertion.
 
+    City and property type ids come from the persisted key registry, so they are
+    the same across runs and loaders.
+
     Parameters
     ----------
     df : pd.DataFrame
         Input DataFrame containing property data.
+    registry : KeyRegistry, optional
+        Registry of the dimension keys, the shared one (`get_registry`) by default.
 
     Returns
     -------
@@ -49,99 +83,49 @@ def create_tables(df: pd.DataFrame) -> list[pd.DataFrame]:
         List of DataFrames containing tables for the database:
         main properties table, cities, and property types.
     """
+    registry = registry or get_registry()
+    city_keys = registry.keys('city', df['city'].dropna().unique().tolist())
+    property_type_keys = registry.keys('property_type', df['property_type'].dropna().unique().tolist())
+
     #Create cities table
     cities = pd.DataFrame({
-        'city_id' : np.arange(1,len(df['city'].unique())+1).tolist(),
-        'city_name' : df['city'].unique()
-    })
+        'city_id' : list(city_keys.values()),
+        'city_name' : list(city_keys.keys())
+    }).sort_values('city_id', ignore_index=True)
 
     #Create property type table
     property_type = pd.DataFrame({
-        'property_type_id' : np.arange(1,len(df['property_type'].unique())+1),
-        'property_type' : df['property_type'].unique()
-    })
+        'property_type_id' : list(property_type_keys.values()),
+        'property_type' : list(property_type_keys.keys())
+    }).sort_values('property_type_id', ignore_index=True)
 
-    # Merge cities and property type into main DataFrame
-    df = df.merge(cities, left_on='city',right_on='city_name', how='left').drop(columns=['city_name','city'])
-    df = df.merge(property_type, on='property_type', how='left')[['id','price','area','rooms','bathrooms','garage','property_type_id','stratum','location','city_id']]
+    # Map cities and property type to their ids in the main DataFrame
+    df = df.assign(
+        city_id=df['city'].map(city_keys).astype('Int64'),
+        property_type_id=df['property_type'].map(property_type_keys).astype('Int64'),
+    )[['id','price','area','rooms','bathrooms','garage','property_type_id','stratum','latitude','longitude','geohash','city_id']]
 
     tables_list = [df, cities, property_type]
     
     return tables_list
 
 
-def connect_to_db(db_type: str) -> (sqlite3.Connection | mysql.connector.connection_cext.CMySQLConnection | None):
-    """
-    Connect to a specified database type (SQLite or MySQL).
-
-    Parameters
-    ----------
-    db_type : str
-        Type of the database ("sqlite3" or "mysql").
-
-    Returns
-    -------
-    sqlite3.Connection or mysql.connector.connection_cext.CMySQLConnection or None
-        Database connection object or None if the type is unknown.
-    """
-    if db_type == "sqlite3":
-        # Connect to SQLite database
-        db_connection = sqlite3.connect(f"{DB_NAME}.db")
-
-    elif db_type == "mysql":
-        with open('mysql_credentials.json','r') as file:
-            data = json.load(file)
-        # Connect to mysql database
-        db_connection = mysql.connector.connect(
-            host = data["host"],
-            user = data["user"],
-            password = data["password"]
-        )
-
-        db_connection.cursor().execute(f"DROP DATABASE IF EXISTS {DB_NAME}")
-        db_connection.cursor().execute(f"CREATE DATABASE IF NOT EXISTS {DB_NAME}")
-
-    else:
-        print("Unknown connection")
-    
-    return db_connection
-
-
-def load_to_db(tables_list: list[pd.DataFrame], db_connection: (sqlite3.Connection | mysql.connector.connection_cext.CMySQLConnection), table_names: list[str]) -> None:
-    """
-    Load DataFrames into a database.
-
-    Parameters
-    ----------
-    tables_list : list of pd.DataFrame
-        List of DataFrames representing the tables to load.
-    db_connection : sqlite3.Connection or mysql.connector.connection_cext.CMySQLConnection
-        Database connection object.
-    table_names : list of str
-        List of table names to be created in the database.
-
-    Returns
-    -------
-    None
-    """
-    if isinstance(db_connection, sqlite3.Connection):
-
-        [tables_list[count].to_sql(table_names[count], db_connection, if_exists='replace', index=False) for count in range(len(tables_list))]
-        db_connection.close()
-
-    elif isinstance(db_connection, mysql.connector.connection_cext.CMySQLConnection):
-
-        engine = create_engine(f"mysql+pymysql://{db_connection._user}:{db_connection._password}@{db_connection._host}/{DB_NAME}")
-        [tables_list[count].to_sql(table_names[count], engine, if_exists="replace", index=False) for count in range(len(tables_list))]
-        db_connection.close()
-
-
 if __name__ == '__main__':
-    # Load data from CSV
-    df = pd.read_csv('/home/amduram/amduram/data_mentoring/web_scraping_real_estate/COLOMBIA_REAL_STATE_2024-11-25.csv')
+    import argparse
+    parser = argparse.ArgumentParser(description="Load the scraped listings into the database with pandas")
+    parser.add_argument("path", nargs="?", default="/home/amduram/amduram/data_mentoring/web_scraping_real_estate/COLOMBIA_REAL_STATE_2024-11-25.csv", help="CSV file or Parquet dataset directory")
+    parser.add_argument("--incremental", action="store_true", help="Upsert into the existing database instead of recreating it")
+    parser.add_argument("--bulk", action="store_true", help="Recreate the tables with keys, spatial index and market statistics (bulk_loader.bulk_load)")
+    args = parser.parse_args()
+
+    # Load data from the Parquet dataset, or from CSV
+    if args.path.endswith(".csv"):
+        df = read_csv(args.path)
+    else:
+        df = load_parquet(args.path)
 
     # Process and load data
     df = impute_values(df)
     tables_list = create_tables(df)
-    db_connection = connect_to_db("mysql")
-    load_to_db(tables_list, db_connection, TABLE_NAMES)
\ No newline at end of file
+    db_connection = connect_to_db("mysql", incremental=args.incremental)
+    print(load_to_db(tables_list, db_connection, TABLE_NAMES, incremental=args.incremental, bulk=args.bulk))
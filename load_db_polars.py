@@ -1,160 +1,208 @@
 import polars as pl
-import sqlite3
-import mysql.connector
-from sqlalchemy import create_engine
-import json
+from bulk_loader import connect_to_db, load_to_db
+from key_registry import KeyRegistry, get_registry
+from transform_engine import apply_rules, column_types, is_legacy_csv, read_legacy_csv
 
 TABLE_NAMES = ['living_space', 'cities', 'properties']
 DB_NAME = "col_real_estate"
+PARTITION_SCHEMA = {'scrape_date': pl.String, 'city': pl.String, 'property_type': pl.String}
 
-def impute_values(df: pl.DataFrame) -> pl.DataFrame:
-
-    df = df.unique()
-    df = df.drop_nulls("area")
-
-    df = df.with_columns(
-        pl.when(pl.col('rooms').is_null() & (pl.col('property_type') == 'Apartaestudio'))
-        .then(1)
-        .otherwise(pl.col('rooms'))
-        .alias('rooms')
-        )
-    
-    df = df.with_columns(
-        pl.when(pl.col('rooms').is_null())
-        .then(0)
-        .otherwise(pl.col('rooms'))
-        .alias('rooms')
-        )
-    
-    df = df.with_columns(
-        pl.when(pl.col("stratum") < 1)
-        .then(1)
-        .otherwise(pl.col("stratum"))
-        .alias("stratum")
-        )
-    
-    df = df.with_columns(
-        pl.when(pl.col("stratum") > 6)
-        .then(6)
-        .otherwise(pl.col("stratum"))
-        .alias("stratum")
-        )
-    
-    return df
+def scan_data(path: str, scrape_dates: list | None = None, cities: list | None = None, property_types: list | None = None, since: str | None = None, columns: list | None = None) -> pl.LazyFrame:
+    """
+    Lazily scan the scraper output: a CSV file, or the Parquet dataset with filters and columns pushed down to the scan.
+    CSV files with the old `location` column are converted first (see `transform_engine.read_legacy_csv`).
 
+    Parameters
+    ----------
+    path : str
+        CSV file or root directory of the Parquet dataset.
+    scrape_dates : list of str, optional
+        Scrape dates to read (Parquet only).
+    cities : list of str, optional
+        Cities to read.
+    property_types : list of str, optional
+        Property types to read.
+    since : str, optional
+        First scrape date to read, YYYY-MM-DD (Parquet only).
+    columns : list of str, optional
+        Columns to read, all by default.
 
-def create_tables(df: pl.DataFrame) -> list[pl.DataFrame]:
+    Returns
+    -------
+    pl.LazyFrame
+        Query plan reading the listings.
     """
-    Create tables from a DataFrame with real estate data for database insertion.
+    if path.endswith(".csv") and is_legacy_csv(path):
+        lf = pl.from_pandas(read_legacy_csv(path)).lazy().cast(column_types("polars", read=True))
+    elif path.endswith(".csv"):
+        lf = pl.scan_csv(path, schema_overrides=column_types("polars", read=True))
+    else:
+        lf = pl.scan_parquet(f"{path}/**/*.parquet", hive_partitioning=True, hive_schema=PARTITION_SCHEMA)
+        if scrape_dates:
+            lf = lf.filter(pl.col('scrape_date').is_in([str(value) for value in scrape_dates]))
+        if since:
+            lf = lf.filter(pl.col('scrape_date') >= str(since))
+    if cities:
+        lf = lf.filter(pl.col('city').is_in(list(cities)))
+    if property_types:
+        lf = lf.filter(pl.col('property_type').is_in(list(property_types)))
+    if columns:
+        lf = lf.select(columns)
+    return lf
+
+
+def load_parquet(path: str, scrape_dates: list | None = None, cities: list | None = None, property_types: list | None = None, since: str | None = None, columns: list | None = None) -> pl.DataFrame:
+    """
+    Read the Parquet dataset written by the scraper, pushing filters and columns down to the scan.
 
     Parameters
     ----------
-    df : pd.DataFrame
-        Input DataFrame containing property data.
+    path : str
+        Root directory of the dataset.
+    scrape_dates : list of str, optional
+        Scrape dates to read.
+    cities : list of str, optional
+        Cities to read.
+    property_types : list of str, optional
+        Property types to read.
+    since : str, optional
+        First scrape date to read (YYYY-MM-DD).
+    columns : list of str, optional
+        Columns to read, all by default.
 
     Returns
     -------
-    list of pd.DataFrame
-        List of DataFrames containing tables for the database:
-        main properties table, cities, and property types.
+    pl.DataFrame
+        The listings of the selected partitions.
     """
-    #Create cities table
-    cities = pl.DataFrame({
-        "city_name": (
-            df.get_column("city"))
-            .unique()
-            .sort()
-            }).with_row_index("city_id", 1)
+    return scan_data(path, scrape_dates, cities, property_types, since, columns).collect()
 
-    #Create property type table
-    property_type = pl.DataFrame({
-        "property_type": (
-            df.get_column("property_type"))
-            .unique()
-            .sort()
-            }).with_row_index("property_type_id", 1)
 
-    # Merge cities and property type into main DataFrame
-    df = df.join(cities, left_on='city', right_on='city_name', how='left')
-    df = df.join(property_type, on='property_type', how='left').select(['id', 'price', 'area', 'rooms', 'bathrooms', 'garage', 'property_type_id', 'stratum', 'location', 'city_id'])
+def impute_values(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+    """
+    Impute missing values and clean up the data, eagerly or as part of a lazy plan.
 
-    tables_list = [df, cities, property_type]
-    
-    return tables_list
+    Parameters
+    ----------
+    df : pl.DataFrame or pl.LazyFrame
+        Input data containing property data.
 
+    Returns
+    -------
+    pl.DataFrame or pl.LazyFrame
+        The listing columns cleaned with the shared `transform_engine.CLEANING_RULES`:
+        rows with a duplicate id and rows without area removed, and imputed `rooms` and `stratum`.
+        Columns use the types of `transform_engine.DTYPE_PLAN`.
+    """
+    # the rules setting columns and the cast are one with_columns, eager input runs as a lazy plan too
+    if isinstance(df, pl.LazyFrame):
+        return apply_rules(df, "polars", cast=True)
+    return apply_rules(df.lazy(), "polars", cast=True).collect()
 
-def connect_to_db(db_type: str) -> (sqlite3.Connection | mysql.connector.connection_cext.CMySQLConnection | None):
+
+def create_tables(df: pl.DataFrame | pl.LazyFrame, registry: KeyRegistry | None = None, streaming: bool = True) -> list[pl.DataFrame | pl.LazyFrame]:
     """
-    Connect to a specified database type (SQLite or MySQL).
+    Create tables from a DataFrame with real estate data for database insertion.
+
+    City and property type ids come from the persisted key registry, so they are
+    the same across runs and loaders. Their keys are looked up from the distinct
+    cities and property types, so lazy input is collected here, once: the plan of the
+    scan and cleaning runs a single time, and the tables are built from its result.
 
     Parameters
     ----------
-    db_type : str
-        Type of the database ("sqlite3" or "mysql").
+    df : pl.DataFrame or pl.LazyFrame
+        Input data containing property data.
+    registry : KeyRegistry, optional
+        Registry of the dimension keys, the shared one (`get_registry`) by default.
+    streaming : bool
+        Collect lazy input with the streaming engine, which processes it in batches.
 
     Returns
     -------
-    sqlite3.Connection or mysql.connector.connection_cext.CMySQLConnection or None
-        Database connection object or None if the type is unknown.
+    list of pl.DataFrame or pl.LazyFrame
+        List of tables for the database: main properties table, cities, and property types.
+        They are LazyFrames when the input is lazy, whose plans only map the ids (see `collect_tables`).
     """
-    if db_type == "sqlite3":
-        # Connect to SQLite database
-        db_connection = sqlite3.connect(f"{DB_NAME}.db")
-
-    elif db_type == "mysql":
-        with open('mysql_credentials.json','r') as file:
-            data = json.load(file)
-        # Connect to mysql database
-        db_connection = mysql.connector.connect(
-            host = data["host"],
-            user = data["user"],
-            password = data["password"]
-        )
-
-        db_connection.cursor().execute(f"DROP DATABASE IF EXISTS {DB_NAME}")
-        db_connection.cursor().execute(f"CREATE DATABASE IF NOT EXISTS {DB_NAME}")
+    registry = registry or get_registry()
+    lazy = isinstance(df, pl.LazyFrame)
+    if lazy:
+        df = df.collect(engine="streaming" if streaming else "auto")
+    values = df.select(pl.col("city").unique().implode(), pl.col("property_type").unique().implode())
+    city_keys = registry.keys("city", values["city"][0].to_list())
+    property_type_keys = registry.keys("property_type", values["property_type"][0].to_list())
 
-    else:
-        print("Unknown connection")
-    
-    return db_connection
+    #Create cities table
+    cities = pl.DataFrame(
+        {"city_id": list(city_keys.values()), "city_name": list(city_keys.keys())},
+        schema={"city_id": pl.Int64, "city_name": pl.String}).sort("city_id")
+
+    #Create property type table
+    property_type = pl.DataFrame(
+        {"property_type_id": list(property_type_keys.values()), "property_type": list(property_type_keys.keys())},
+        schema={"property_type_id": pl.Int64, "property_type": pl.String}).sort("property_type_id")
 
+    # Map cities and property type to their ids in the main DataFrame
+    df = df.lazy() if lazy else df
+    df = df.with_columns(
+        pl.col("city").replace_strict(city_keys, default=None, return_dtype=pl.Int64).alias("city_id"),
+        pl.col("property_type").replace_strict(property_type_keys, default=None, return_dtype=pl.Int64).alias("property_type_id"),
+    ).select(['id', 'price', 'area', 'rooms', 'bathrooms', 'garage', 'property_type_id', 'stratum', 'latitude', 'longitude', 'geohash', 'city_id'])
+
+    if lazy:
+        cities, property_type = cities.lazy(), property_type.lazy()
+    tables_list = [df, cities, property_type]
+
+    return tables_list
 
-def load_to_db(tables_list: list[pl.DataFrame], db_connection: (sqlite3.Connection | mysql.connector.connection_cext.CMySQLConnection), table_names: list[str]) -> None:
+
+def collect_tables(tables_list: list[pl.LazyFrame], streaming: bool = True, explain: bool = False) -> list[pl.DataFrame]:
     """
-    Load DataFrames into a database.
+    Execute the lazy plans of the tables returned by `create_tables` together.
 
     Parameters
     ----------
-    tables_list : list of pd.DataFrame
-        List of DataFrames representing the tables to load.
-    db_connection : sqlite3.Connection or mysql.connector.connection_cext.CMySQLConnection
-        Database connection object.
-    table_names : list of str
-        List of table names to be created in the database.
+    tables_list : list of pl.LazyFrame
+        Lazy tables returned by `create_tables`.
+    streaming : bool
+        Use the streaming engine, which processes the input in batches and handles files larger than RAM.
+    explain : bool
+        Print the optimized plan of each table before running it.
 
     Returns
     -------
-    None
+    list of pl.DataFrame
+        The collected tables.
     """
-    if isinstance(db_connection, sqlite3.Connection):
-
-        [tables_list[count].write_database(table_names[count], f"sqlite:///./{DB_NAME}.db", if_table_exists='replace') for count in range(len(tables_list))]
-        db_connection.close()
-
-    elif isinstance(db_connection, mysql.connector.connection_cext.CMySQLConnection):
-
-        engine = create_engine(f"mysql+pymysql://{db_connection._user}:{db_connection._password}@{db_connection._host}/{DB_NAME}")
-        [tables_list[count].write_database(table_names[count], engine, if_table_exists="replace") for count in range(len(tables_list))]
-        db_connection.close()
+    if explain:
+        for lf in tables_list:
+            print(lf.explain(optimized=True))
+    return pl.collect_all(tables_list, engine="streaming" if streaming else "auto")
 
 
 if __name__ == '__main__':
-    # Load data from CSV
-    df = pl.read_csv("/home/amduram/amduram/data_mentoring/web_scraping_real_estate/COLOMBIA_REAL_STATE_2024-11-25.csv")
-
-    # Process and load data
-    df = impute_values(df)
-    tables_list = create_tables(df)
-    db_connection = connect_to_db("mysql")
-    load_to_db(tables_list, db_connection, TABLE_NAMES)
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Load the scraped listings into the database with polars")
+    parser.add_argument("path", nargs="?", default="/home/amduram/amduram/data_mentoring/web_scraping_real_estate/COLOMBIA_REAL_STATE_2024-11-25.csv", help="CSV file or Parquet dataset directory")
+    parser.add_argument("--lazy", action="store_true", help="Build a single lazy plan from the scan to the final tables")
+    parser.add_argument("--explain", action="store_true", help="Print the optimized plan (lazy mode)")
+    parser.add_argument("--no-streaming", action="store_true", help="Collect the lazy plan with the in-memory engine")
+    parser.add_argument("--incremental", action="store_true", help="Upsert into the existing database instead of recreating it")
+    parser.add_argument("--bulk", action="store_true", help="Recreate the tables with keys, spatial index and market statistics (bulk_loader.bulk_load)")
+    args = parser.parse_args()
+
+    if args.lazy:
+        # Scan and process in one plan, collected once by create_tables
+        df = impute_values(scan_data(args.path))
+        if args.explain:
+            print(df.explain(optimized=True))
+        tables_list = collect_tables(create_tables(df, streaming=not args.no_streaming), streaming=not args.no_streaming)
+    else:
+        # Load data from the Parquet dataset, or from CSV
+        df = scan_data(args.path).collect()
+
+        # Process and load data
+        df = impute_values(df)
+        tables_list = create_tables(df)
+    db_connection = connect_to_db("mysql", incremental=args.incremental)
+    print(load_to_db(tables_list, db_connection, TABLE_NAMES, incremental=args.incremental, bulk=args.bulk))
\ No newline at end of file
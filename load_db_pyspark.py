@@ -1,132 +1,201 @@
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import when, asc
+from pyspark.sql import SparkSession, DataFrame
+from pyspark.sql.functions import col, broadcast, lit
+from pyspark.sql.types import StructType, StructField, FloatType
 import sqlite3
 import mysql.connector
-from sqlalchemy import create_engine
-import json
+from key_registry import KeyRegistry, get_registry
+from bulk_loader import PRICE_CHANGES_TABLE, connect_to_db, index_ddl, iter_rows, read_credentials, table_ddl
+from transform_engine import apply_rules, cast_to_plan, column_types, is_legacy_csv, read_legacy_csv
+from metrics import get_metrics
+from datetime import date
+from geo import SPATIAL_INDEX_TABLE, rebuild_spatial_index
+from market_stats import MARKET_STATS_TABLE, refresh_market_stats
 
 TABLE_NAMES = ['living_space', 'cities', 'properties']
 DB_NAME = "col_real_estate"
+JDBC_PACKAGES = "org.xerial:sqlite-jdbc:3.46.1.0,com.mysql:mysql-connector-j:9.1.0"
 
-def impute_values(df: DataFrame) -> DataFrame:
+# Schema of the scraper CSV, so the file is parsed once with the right types instead of headerless strings
+LISTING_SCHEMA = StructType([StructField(column, kind) for column, kind in column_types("spark", read=True).items()])
 
-    # Drop duplicate rows
-    df = df.dropDuplicates()
-
-    # Filter rows where area is not null
-    df = df.filter(df.area.isNotNull())
-
-    # Impute missing 'rooms' for 'Apartaestudio'
-    df = df.withColumn(
-        "rooms",
-        when(
-            (df.rooms.isNull()) & (df.property_type == "Apartaestudio"), 1)
-        .otherwise(df.rooms)
-    )
-    
-    # Replace remaining null values in 'rooms' with 0
-    df = df.withColumn(
-        "rooms",
-        when(
-            df.rooms.isNull(), 0)
-        .otherwise(df.rooms)
-    )
-    
-    # Impute 'stratum' values above 6 to 6
-    df = df.withColumn(
-        "stratum",
-        when(
-            df.stratum > 6, 6)
-        .otherwise(df.stratum)
-    )
-    
-    # Impute 'stratum' values below 1 to 1
-    df = df.withColumn(
-        "stratum",
-        when(
-            df.stratum < 1, 1)
-        .otherwise(df.stratum)
-    )
-    
-    return df
 
+def get_spark(master: str = "local[*]", app_name: str = "PySpark_tl_colombia_real_estate") -> SparkSession:
+    """
+    Create or get the Spark session, with the JDBC drivers used by `load_to_db`.
 
-def create_tables(df: DataFrame) -> list[DataFrame]:
-  
-    # Create cities table
-    cities = pl.DataFrame({
-        "city_name": (
-            df.get_column("city"))
-            .unique()
-            .sort()
-            }).with_row_index("city_id", 1)
+    Parameters
+    ----------
+    master : str
+        Spark master URL, `local[*]` runs on every core of this machine.
+    app_name : str
+        Name of the application.
 
-    # Create property type table
-    property_type = pl.DataFrame({
-        "property_type": (
-            df.get_column("property_type"))
-            .unique()
-            .sort()
-            }).with_row_index("property_type_id", 1)
+    Returns
+    -------
+    SparkSession
+        The Spark session.
+    """
+    return (SparkSession.builder
+            .master(master)
+            .appName(app_name)
+            .config("spark.jars.packages", JDBC_PACKAGES)
+            .getOrCreate())
 
-    # Merge cities and property type into main DataFrame
-    df = df.join(cities, left_on='city', right_on='city_name', how='left')
-    df = df.join(property_type, on='property_type', how='left').select(['id', 'price', 'area', 'rooms', 'bathrooms', 'garage', 'property_type_id', 'stratum', 'location', 'city_id'])
 
-    tables_list = [df, cities, property_type]
-    
-    return tables_list
+def read_csv(spark: SparkSession, path: str) -> DataFrame:
+    """
+    Read a scraper CSV file with an explicit schema. A file with the old `location`
+    column is converted on the driver first (see `transform_engine.read_legacy_csv`).
 
+    Parameters
+    ----------
+    spark : SparkSession
+        Active Spark session.
+    path : str
+        CSV file (or directory of CSV files) written by the scraper.
 
-def connect_to_db(db_type: str) -> (sqlite3.Connection | mysql.connector.connection_cext.CMySQLConnection | None):
+    Returns
+    -------
+    DataFrame
+        The listings.
+    """
+    if path.endswith(".csv") and is_legacy_csv(path):
+        return spark.createDataFrame(list(iter_rows(read_legacy_csv(path))), LISTING_SCHEMA)
+    return spark.read.csv(path, schema=LISTING_SCHEMA, header=True, escape='"', multiLine=False)
+
+def load_parquet(spark: SparkSession, path: str, scrape_dates: list | None = None, cities: list | None = None, property_types: list | None = None, since: str | None = None, columns: list | None = None) -> DataFrame:
     """
-    Connect to a specified database type (SQLite or MySQL).
+    Read the Parquet dataset written by the scraper. Filters on the partition columns
+    prune directories and the column selection is pushed down to the Parquet reader.
 
     Parameters
     ----------
-    db_type : str
-        Type of the database ("sqlite3" or "mysql").
+    spark : SparkSession
+        Active Spark session.
+    path : str
+        Root directory of the dataset.
+    scrape_dates : list of str, optional
+        Scrape dates to read.
+    cities : list of str, optional
+        Cities to read.
+    property_types : list of str, optional
+        Property types to read.
+    since : str, optional
+        First scrape date to read (YYYY-MM-DD).
+    columns : list of str, optional
+        Columns to read, all by default.
 
     Returns
     -------
-    sqlite3.Connection or mysql.connector.connection_cext.CMySQLConnection or None
-        Database connection object or None if the type is unknown.
+    DataFrame
+        The listings of the selected partitions.
     """
-    if db_type == "sqlite3":
-        # Connect to SQLite database
-        db_connection = sqlite3.connect(f"{DB_NAME}.db")
-
-    elif db_type == "mysql":
-        with open('mysql_credentials.json','r') as file:
-            data = json.load(file)
-        # Connect to mysql database
-        db_connection = mysql.connector.connect(
-            host = data["host"],
-            user = data["user"],
-            password = data["password"]
-        )
-
-        db_connection.cursor().execute(f"DROP DATABASE IF EXISTS {DB_NAME}")
-        db_connection.cursor().execute(f"CREATE DATABASE IF NOT EXISTS {DB_NAME}")
+    df = spark.read.option("basePath", path).parquet(path)
+    if scrape_dates:
+        df = df.filter(col("scrape_date").cast("string").isin([str(value) for value in scrape_dates]))
+    if since:
+        df = df.filter(col("scrape_date").cast("string") >= str(since))
+    if cities:
+        df = df.filter(col("city").isin(list(cities)))
+    if property_types:
+        df = df.filter(col("property_type").isin(list(property_types)))
+    if columns:
+        df = df.select(*columns)
+    return df
 
-    else:
-        print("Unknown connection")
-    
-    return db_connection
+
+def impute_values(df: DataFrame) -> DataFrame:
+    """
+    Impute missing values and clean up the data.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Input DataFrame containing property data.
+
+    Returns
+    -------
+    DataFrame
+        The listing columns cleaned with the shared `transform_engine.CLEANING_RULES`:
+        rows with a duplicate id and rows without area removed, and imputed `rooms` and `stratum`.
+        Columns use the types of `transform_engine.DTYPE_PLAN`.
+    """
+    return cast_to_plan(apply_rules(df, "spark"), "spark")
 
 
-def load_to_db(tables_list: list[pl.DataFrame], db_connection: (sqlite3.Connection | mysql.connector.connection_cext.CMySQLConnection), table_names: list[str]) -> None:
+def create_tables(df: DataFrame, registry: KeyRegistry | None = None) -> list[DataFrame]:
     """
-    Load DataFrames into a database.
+    Create tables from a DataFrame with real estate data for database insertion.
+
+    City and property type ids come from the persisted key registry, so they are
+    the same across runs and loaders. Only the distinct values are collected to the
+    driver to look up their keys. The dimensions are small and broadcast to every
+    executor for the joins, which avoids shuffling the listings.
 
     Parameters
     ----------
-    tables_list : list of pd.DataFrame
+    df : DataFrame
+        Input DataFrame containing property data.
+    registry : KeyRegistry, optional
+        Registry of the dimension keys, the shared one (`get_registry`) by default.
+
+    Returns
+    -------
+    list of DataFrame
+        List of DataFrames containing tables for the database:
+        main properties table, cities, and property types.
+    """
+    registry = registry or get_registry()
+    spark = df.sparkSession
+    city_keys = registry.keys("city", [row.city for row in df.select("city").distinct().collect()])
+    property_type_keys = registry.keys("property_type", [row.property_type for row in df.select("property_type").distinct().collect()])
+
+    # Create cities table
+    cities = spark.createDataFrame(
+        sorted((key, value) for value, key in city_keys.items()),
+        "city_id long, city_name string").cache()
+
+    # Create property type table
+    property_type = spark.createDataFrame(
+        sorted((key, value) for value, key in property_type_keys.items()),
+        "property_type_id long, property_type string").cache()
+
+    # Merge cities and property type into main DataFrame
+    df = df.join(broadcast(cities), df.city == cities.city_name, how='left')
+    df = df.join(broadcast(property_type), on='property_type', how='left').select(['id', 'price', 'area', 'rooms', 'bathrooms', 'garage', 'property_type_id', 'stratum', 'latitude', 'longitude', 'geohash', 'city_id'])
+
+    tables_list = [df, cities, property_type]
+
+    return tables_list
+
+
+def load_to_db(tables_list: list[DataFrame], db_connection: (sqlite3.Connection | mysql.connector.connection_cext.CMySQLConnection), table_names: list[str], batch_size: int = 10000, num_partitions: int = 8, credentials: dict | None = None) -> None:
+    """
+    Load DataFrames into a database with JDBC writes from the executors, then build
+    the secondary and spatial indexes of the main table (see `geo`) and today's market
+    statistics (see `market_stats`) through a driver connection.
+
+    The tables are recreated with the schema of `bulk_loader.table_ddl`, keys and
+    first and last seen dates included, before the JDBC writes append to them. Every
+    listing is first and last seen today and the price history is emptied, like a
+    bulk load of the other loaders, so later incremental loads merge into the tables.
+
+    Parameters
+    ----------
+    tables_list : list of DataFrame
         List of DataFrames representing the tables to load.
     db_connection : sqlite3.Connection or mysql.connector.connection_cext.CMySQLConnection
-        Database connection object.
+        Database connection object, used to create the tables and pick the JDBC target.
+        The JDBC writers open the file of a SQLite connection, which can't be in memory.
     table_names : list of str
         List of table names to be created in the database.
+    batch_size : int
+        Rows sent per JDBC batch insert.
+    num_partitions : int
+        Parallel connections writing the main table (MySQL). SQLite allows a single writer,
+        so it is always written from one partition.
+    credentials : dict, optional
+        MySQL host, user and password, read with `bulk_loader.read_credentials` by default.
 
     Returns
     -------
@@ -134,23 +203,96 @@ def load_to_db(tables_list: list[pl.DataFrame], db_connection: (sqlite3.Connecti
     """
     if isinstance(db_connection, sqlite3.Connection):
 
-        [tables_list[count].write_database(table_names[count], f"sqlite:///./{DB_NAME}.db", if_table_exists='replace') for count in range(len(tables_list))]
-        db_connection.close()
+        # the JDBC writers and the index connection open the file of the given connection
+        path = {name: file for _, name, file in db_connection.execute("PRAGMA database_list")}["main"]
+        if not path:
+            raise ValueError("The SQLite connection must be to a file, the JDBC writers can't reach an in-memory database")
+        options = {"url": f"jdbc:sqlite:{path}", "driver": "org.sqlite.JDBC"}
+        num_partitions = 1
+        sqlite = True
 
     elif isinstance(db_connection, mysql.connector.connection_cext.CMySQLConnection):
 
-        engine = create_engine(f"mysql+pymysql://{db_connection._user}:{db_connection._password}@{db_connection._host}/{DB_NAME}")
-        [tables_list[count].write_database(table_names[count], engine, if_table_exists="replace") for count in range(len(tables_list))]
-        db_connection.close()
+        credentials = credentials or read_credentials()
+        options = {
+            "url": f"jdbc:mysql://{credentials['host']}/{DB_NAME}?rewriteBatchedStatements=true",
+            "driver": "com.mysql.cj.jdbc.Driver",
+            "user": credentials["user"],
+            "password": credentials["password"],
+        }
+        sqlite = False
+        db_connection.database = DB_NAME
+
+    else:
+        return
+
+    cursor = db_connection.cursor()
+    for table in [SPATIAL_INDEX_TABLE, PRICE_CHANGES_TABLE, *table_names]:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    # the secondary indexes are built once the listings are written
+    for statement in table_ddl(table_names, sqlite, indexes=False):
+        cursor.execute(statement)
+    db_connection.commit()
+    db_connection.close()
+
+    load_date = str(date.today())
+    metrics = get_metrics()
+    # dimensions first so the foreign keys of the main table resolve
+    for count in [1, 2, 0]:
+        # the main table is split across writers, dimensions are tiny and written from one
+        partitions = num_partitions if count == 0 else 1
+        table = tables_list[count]
+        if count == 0:
+            table = table.withColumn("first_seen", lit(load_date)).withColumn("last_seen", lit(load_date))
+        # float32 columns are written as the double of their shortest decimal (173.73, not 173.72999572753906)
+        for field in table.schema.fields:
+            if isinstance(field.dataType, FloatType):
+                table = table.withColumn(field.name, col(field.name).cast("string").cast("double"))
+        with metrics.stage("load_to_db", mode="jdbc", table=table_names[count]):
+            (table.repartition(partitions)
+                .write.format("jdbc")
+                .options(**options)
+                .option("dbtable", table_names[count])
+                .option("batchsize", batch_size)
+                .option("numPartitions", partitions)
+                .mode("append")
+                .save())
+
+    index_connection = sqlite3.connect(path) if sqlite else mysql.connector.connect(database=DB_NAME, **credentials)
+    try:
+        cursor = index_connection.cursor()
+        with metrics.stage("load_to_db", mode="jdbc", table=SPATIAL_INDEX_TABLE):
+            for statement in index_ddl(table_names[0], sqlite):
+                cursor.execute(statement)
+            rebuild_spatial_index(cursor, table_names[0], sqlite)
+            index_connection.commit()
+
+        with metrics.stage("load_to_db", mode="jdbc", table=MARKET_STATS_TABLE):
+            refresh_market_stats(cursor, table_names[0], sqlite, load_date)
+            index_connection.commit()
+    finally:
+        index_connection.close()
 
 
 if __name__ == '__main__':
-    # Load data from CSV
-    spark = SparkSession.builder.appName("PySpark_tl_colombia_real_estate").getOrCreate()
-    df = spark.read.csv("/home/amduram/amduram/data_mentoring/web_scraping_real_estate/COLOMBIA_REAL_STATE_2024-11-25.csv")
+    import argparse
+    parser = argparse.ArgumentParser(description="Load the scraped listings into the database with Spark")
+    parser.add_argument("path", nargs="?", default="/home/amduram/amduram/data_mentoring/web_scraping_real_estate/COLOMBIA_REAL_STATE_2024-11-25.csv", help="CSV file or Parquet dataset directory")
+    parser.add_argument("--master", default="local[*]", help="Spark master URL")
+    parser.add_argument("--db", choices=["mysql", "sqlite3"], default="mysql")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Rows per JDBC batch insert")
+    parser.add_argument("--num-partitions", type=int, default=8, help="Parallel JDBC writers for the main table")
+    args = parser.parse_args()
+
+    # Load data from CSV or from the Parquet dataset
+    spark = get_spark(args.master)
+    if args.path.endswith(".csv"):
+        df = read_csv(spark, args.path)
+    else:
+        df = load_parquet(spark, args.path)
 
     # Process and load data
     df = impute_values(df)
     tables_list = create_tables(df)
-    db_connection = connect_to_db("mysql")
-    load_to_db(tables_list, db_connection, TABLE_NAMES)
\ No newline at end of file
+    db_connection = connect_to_db(args.db)
+    load_to_db(tables_list, db_connection, TABLE_NAMES, args.batch_size, args.num_partitions)
\ No newline at end of file
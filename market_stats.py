@@ -0,0 +1,187 @@
+import sqlite3
+from itertools import groupby
+
+MARKET_STATS_TABLE = "market_stats"
+MISSING_STRATUM = 0 #stratum of the partition of the listings without one
+MARKET_INDEX = "last_seen, city_id, property_type_id, stratum, price, area" #index of the main table read by the refresh
+
+# Column definitions as (name, SQLite type, MySQL type), after the partition key
+PARTITION_COLUMNS = [
+    ("scrape_date", "TEXT", "DATE"),
+    ("city_id", "INTEGER", "INT"),
+    ("property_type_id", "INTEGER", "INT"),
+    ("stratum", "INTEGER", "INT"),
+]
+STATS_COLUMNS = [
+    ("listings", "INTEGER", "INT"),
+    ("mean_price", "REAL", "DOUBLE"),
+    ("median_price", "REAL", "DOUBLE"),
+    ("mean_price_m2", "REAL", "DOUBLE"),
+    ("price_m2_p25", "REAL", "DOUBLE"),
+    ("price_m2_p50", "REAL", "DOUBLE"),
+    ("price_m2_p75", "REAL", "DOUBLE"),
+    ("area_p25", "REAL", "DOUBLE"),
+    ("area_p50", "REAL", "DOUBLE"),
+    ("area_p75", "REAL", "DOUBLE"),
+]
+
+
+def market_stats_ddl(sqlite: bool) -> list[str]:
+    """
+    CREATE statements of the market statistics table, kept when it already exists.
+
+    The statistics are keyed by (scrape date, city, property type, stratum), with a
+    second index by (city, property type, stratum, scrape date) for the price history
+    of a market. The refresh reads the main table through its `MARKET_INDEX`, which
+    covers the listings of a scrape date and their price and area, so it never reads
+    the table itself (see `bulk_loader.index_ddl`).
+    """
+    type_index = 1 if sqlite else 2
+    columns = ", ".join(f"{column[0]} {column[type_index]}" for column in PARTITION_COLUMNS + STATS_COLUMNS)
+    key = "scrape_date, city_id, property_type_id, stratum"
+    history = "city_id, property_type_id, stratum, scrape_date"
+    if sqlite:
+        return [
+            f"CREATE TABLE IF NOT EXISTS {MARKET_STATS_TABLE} ({columns}, PRIMARY KEY ({key})) WITHOUT ROWID",
+            f"CREATE INDEX IF NOT EXISTS {MARKET_STATS_TABLE}_history ON {MARKET_STATS_TABLE} ({history})",
+        ]
+    return [f"CREATE TABLE IF NOT EXISTS {MARKET_STATS_TABLE} ({columns}, PRIMARY KEY ({key}), INDEX ({history})) "
+            f"ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"]
+
+
+def percentile(values: list, q: float) -> float | None:
+    """
+    Percentile `q` (0 to 1) of sorted values, interpolated linearly between the closest
+    ranks like numpy and PERCENTILE_CONT, None when there are no values.
+    """
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def partition_stats(rows: list) -> tuple:
+    """
+    Statistics of the (price, area) of the listings of a partition, in the order of `STATS_COLUMNS`.
+    """
+    prices = sorted(price for price, _ in rows if price is not None)
+    areas = sorted(area for _, area in rows if area is not None)
+    prices_m2 = sorted(price / area for price, area in rows if price is not None and area)
+    return (
+        len(rows),
+        sum(prices) / len(prices) if prices else None,
+        percentile(prices, 0.5),
+        sum(prices_m2) / len(prices_m2) if prices_m2 else None,
+        percentile(prices_m2, 0.25),
+        percentile(prices_m2, 0.5),
+        percentile(prices_m2, 0.75),
+        percentile(areas, 0.25),
+        percentile(areas, 0.5),
+        percentile(areas, 0.75),
+    )
+
+
+def refresh_market_stats(cursor, living_space: str, sqlite: bool, scrape_date: str, partitions: set | None = None) -> int:
+    """
+    Recomputes the market statistics of a scrape date, in the transaction of the caller.
+
+    The listings of a scrape date are the ones last seen on that date. Only the given
+    partitions are recomputed; the statistics of other dates are kept, so the table
+    holds the history of the markets even though the main table only holds the
+    latest version of every listing. Listings without city or property type belong to
+    no partition and are left out, like partitions with a None city or property type.
+
+    When the main table is fed by an incremental crawl (`--incremental`), only the new
+    or changed listings are seen on the day of the load: unchanged listings keep an
+    older `last_seen`, so the statistics of a date describe the listings that were
+    listed or changed that day rather than the whole market.
+
+    Parameters
+    ----------
+    cursor : cursor
+        Cursor of a sqlite3 or mysql.connector connection.
+    living_space : str
+        Name of the main table.
+    sqlite : bool
+        The database is SQLite, MySQL otherwise.
+    scrape_date : str
+        Date of the statistics (YYYY-MM-DD).
+    partitions : set of tuple, optional
+        (city_id, property_type_id, stratum) to recompute, with `MISSING_STRATUM` for
+        the listings without stratum. Every partition of the date by default.
+
+    Returns
+    -------
+    int
+        Partitions written.
+    """
+    placeholder = "?" if sqlite else "%s"
+    # the key of the statistics can't hold a NULL city or property type
+    conditions = ["city_id IS NOT NULL", "property_type_id IS NOT NULL", f"last_seen = {placeholder}"]
+    parameters = [scrape_date]
+    if partitions is not None:
+        partitions = {partition for partition in partitions if partition[0] is not None and partition[1] is not None}
+        if not partitions:
+            return 0
+        cities = sorted({partition[0] for partition in partitions})
+        conditions.append(f"city_id IN ({', '.join(placeholder for _ in cities)})")
+        parameters.extend(cities)
+        cursor.executemany(
+            f"DELETE FROM {MARKET_STATS_TABLE} WHERE scrape_date = {placeholder} AND city_id = {placeholder} "
+            f"AND property_type_id = {placeholder} AND stratum = {placeholder}",
+            [(scrape_date, *partition) for partition in sorted(partitions)])
+    else:
+        cursor.execute(f"DELETE FROM {MARKET_STATS_TABLE} WHERE scrape_date = {placeholder}", (scrape_date,))
+
+    where = f" WHERE {' AND '.join(conditions)}"
+    # NULL strata sort first and no listing has stratum 0, so every partition is contiguous
+    cursor.execute(
+        f"SELECT city_id, property_type_id, stratum, price, area FROM {living_space}{where} "
+        f"ORDER BY city_id, property_type_id, stratum", parameters)
+    stats = []
+    for partition, rows in groupby(cursor.fetchall(), key=lambda row: (row[0], row[1], MISSING_STRATUM if row[2] is None else row[2])):
+        if partitions is None or partition in partitions:
+            stats.append((scrape_date, *partition, *partition_stats([row[3:] for row in rows])))
+    if stats:
+        columns = [column[0] for column in PARTITION_COLUMNS + STATS_COLUMNS]
+        cursor.executemany(
+            f"INSERT INTO {MARKET_STATS_TABLE} ({', '.join(columns)}) VALUES ({', '.join(placeholder for _ in columns)})", stats)
+    return len(stats)
+
+
+def market_summary(db_connection, table_names: list[str], scrape_date: str | None = None) -> list:
+    """
+    Market statistics of a scrape date with the city and property type names, the
+    query behind the price per m² dashboards.
+
+    Parameters
+    ----------
+    db_connection : sqlite3.Connection or mysql.connector connection
+        Connection to a database loaded by `load_to_db` with `bulk` or `incremental`.
+    table_names : list of str
+        Names of the main, cities and property types tables.
+    scrape_date : str, optional
+        Date of the statistics (YYYY-MM-DD), the latest by default.
+
+    Returns
+    -------
+    list of tuple
+        (city, property type, stratum, listings, mean price, median price, mean price
+        per m², median price per m²), by city, property type and stratum.
+    """
+    _, cities, properties = table_names
+    placeholder = "?" if isinstance(db_connection, sqlite3.Connection) else "%s"
+    cursor = db_connection.cursor()
+    if scrape_date is None:
+        cursor.execute(f"SELECT MAX(scrape_date) FROM {MARKET_STATS_TABLE}")
+        scrape_date = cursor.fetchone()[0]
+    cursor.execute(
+        f"SELECT c.city_name, p.property_type, s.stratum, s.listings, s.mean_price, s.median_price, s.mean_price_m2, s.price_m2_p50 "
+        f"FROM {MARKET_STATS_TABLE} s JOIN {cities} c ON c.city_id = s.city_id "
+        f"JOIN {properties} p ON p.property_type_id = s.property_type_id "
+        f"WHERE s.scrape_date = {placeholder} ORDER BY c.city_name, p.property_type, s.stratum", (str(scrape_date),))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
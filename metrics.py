@@ -0,0 +1,256 @@
+import json
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _max_rss_bytes() -> int | None:
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket bounds, as exported to Prometheus.
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        total = 0
+        counts = []
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+class Metrics:
+    """
+    Counters, histograms and stage timings of a run.
+
+    Every metric is identified by a name and keyword labels (e.g. city and property
+    type). `stage` records the calls, time and memory of a pipeline step: the peak
+    resident memory of the process after the step, and with `trace_memory` the peak
+    of the Python allocations during the step (tracemalloc, which slows allocations down).
+
+    Parameters
+    ----------
+    trace_memory : bool
+        Measure the peak Python memory of each stage with tracemalloc.
+    """
+
+    enabled = True
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.counters = {}
+        self.histograms = {}
+        self.stages = {}
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Adds `value` to a counter.
+        """
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels):
+        """
+        Records a value in a histogram.
+        """
+        key = _key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def record(self, name: str, seconds: float, **labels):
+        """
+        Adds a call of `seconds` to a stage timed by the caller (no memory measure).
+        """
+        key = _key(name, labels)
+        with self.lock:
+            record = self.stages.setdefault(key, {"calls": 0, "seconds": 0.0, "peak_memory_bytes": None, "max_rss_bytes": None})
+            record["calls"] += 1
+            record["seconds"] += seconds
+
+    @contextmanager
+    def stage(self, name: str, **labels):
+        """
+        Context manager timing a pipeline step.
+        """
+        peaks = getattr(self._local, "peaks", None)
+        if peaks is None:
+            peaks = self._local.peaks = []
+        if self.trace_memory:
+            if peaks:
+                # keep the peak of the enclosing stage before restarting the measure
+                peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.trace_memory:
+                peak = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if peaks:
+                    peaks[-1] = max(peaks[-1], peak)
+            key = _key(name, labels)
+            max_rss = _max_rss_bytes()
+            self.record(name, seconds, **labels)
+            with self.lock:
+                record = self.stages[key]
+                if peak is not None:
+                    record["peak_memory_bytes"] = max(record["peak_memory_bytes"] or 0, peak)
+                if max_rss is not None:
+                    record["max_rss_bytes"] = max(record["max_rss_bytes"] or 0, max_rss)
+
+    def summary(self) -> dict:
+        """
+        Returns every metric as a JSON serializable dictionary.
+
+        The counters sharing the (non empty) labels of a stage are also given per second of that
+        stage (e.g. pages and hits per second of the extraction of a city and property type).
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+            stages = {key: dict(value) for key, value in self.stages.items()}
+        result = {"counters": [], "histograms": [], "stages": []}
+        for (name, labels), value in sorted(counters.items()):
+            result["counters"].append({"name": name, "labels": dict(labels), "value": value})
+        for (name, labels), histogram in sorted(histograms.items()):
+            result["histograms"].append({
+                "name": name, "labels": dict(labels), "count": histogram.count, "sum": round(histogram.sum, 6),
+                "buckets": dict(zip([*map(str, histogram.buckets), "+Inf"], histogram.cumulative())),
+            })
+        for (name, labels), record in sorted(stages.items()):
+            record["seconds"] = round(record["seconds"], 6)
+            rates = {f"{counter}_per_s": round(value / record["seconds"], 3)
+                     for (counter, counter_labels), value in counters.items()
+                     if labels and counter_labels == labels and record["seconds"] > 0}
+            result["stages"].append({"name": name, "labels": dict(labels), **record, **rates})
+        return result
+
+    def to_prometheus(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+            stages = sorted(self.stages.items())
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            lines += [f"{name}{_label_text(labels)} {value}" for (other, labels), value in counters if other == name]
+        for name in sorted({name for (name, _), _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (other, labels), histogram in histograms:
+                if other != name:
+                    continue
+                for bound, count in zip([*map(str, histogram.buckets), "+Inf"], histogram.cumulative()):
+                    lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {count}")
+                lines.append(f"{name}_sum{_label_text(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_label_text(labels)} {histogram.count}")
+        for field, kind in (("seconds", "counter"), ("calls", "counter"), ("peak_memory_bytes", "gauge"), ("max_rss_bytes", "gauge")):
+            samples = [(labels + (("stage", name),), record[field]) for (name, labels), record in stages if record[field] is not None]
+            if samples:
+                lines.append(f"# TYPE stage_{field} {kind}")
+                lines += [f"stage_{field}{_label_text(labels)} {value}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """
+        Writes the metrics to `path`: Prometheus text for a `.prom` or `.txt` file, the JSON summary otherwise.
+        """
+        with open(path, "w") as file:
+            if path.endswith((".prom", ".txt")):
+                file.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), file, indent=2)
+
+
+class NullMetrics:
+    """
+    Disabled metrics: same interface as `Metrics`, every call does nothing.
+    """
+
+    enabled = False
+    _stage = nullcontext()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        pass
+
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels):
+        pass
+
+    def record(self, name: str, seconds: float, **labels):
+        pass
+
+    def stage(self, name: str, **labels):
+        return self._stage
+
+    def summary(self) -> dict:
+        return {}
+
+    def to_prometheus(self) -> str:
+        return ""
+
+    def write(self, path: str):
+        pass
+
+
+_metrics = NullMetrics()
+
+
+def configure_metrics(enabled: bool = True, trace_memory: bool = False) -> Metrics | NullMetrics:
+    """
+    Replaces the metrics shared by the pipeline: recording ones when `enabled`, the no-op ones otherwise.
+    """
+    global _metrics
+    _metrics = Metrics(trace_memory) if enabled else NullMetrics()
+    return _metrics
+
+
+def get_metrics() -> Metrics | NullMetrics:
+    return _metrics
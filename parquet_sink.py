@@ -0,0 +1,152 @@
+import os
+import shutil
+from datetime import date
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARQUET_ROOT = "COLOMBIA_REAL_STATE"
+PARTITION_COLUMNS = ['scrape_date', 'city', 'property_type']
+
+# Types of the non partition columns. Partition values are stored in the directory names.
+PARQUET_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('price', pa.float64()),
+    ('area', pa.float64()),
+    ('rooms', pa.int64()),
+    ('bathrooms', pa.int64()),
+    ('garage', pa.int64()),
+    ('stratum', pa.int64()),
+    ('latitude', pa.float64()),
+    ('longitude', pa.float64()),
+    ('geohash', pa.string()),
+    ('scrape_date', pa.string()),
+    ('city', pa.string()),
+    ('property_type', pa.string()),
+])
+INTEGER_COLUMNS = ['rooms', 'bathrooms', 'garage', 'stratum']
+FLOAT_COLUMNS = ['price', 'area', 'latitude', 'longitude']
+
+
+def to_arrow(df: pd.DataFrame, scrape_date: str) -> pa.Table:
+    """
+    Converts the cleaned DataFrame into an Arrow table with `PARQUET_SCHEMA`.
+
+    Numeric values that can't be parsed become nulls.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The DataFrame containing the cleaned real estate data.
+    scrape_date : str
+        Date of the scrape, stored as partition column.
+
+    Returns
+    -------
+    pa.Table
+        The typed table.
+    """
+    columns = {
+        'id': df['id'].map(lambda value: None if value is None else str(value)),
+        'geohash': df['geohash'],
+        'scrape_date': [scrape_date] * len(df),
+        'city': df['city'],
+        'property_type': df['property_type'],
+    }
+    for column in FLOAT_COLUMNS:
+        columns[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+    for column in INTEGER_COLUMNS:
+        columns[column] = pd.to_numeric(df[column], errors='coerce').round().astype('Int64')
+    return pa.table({field.name: pa.array(columns[field.name], type=field.type, from_pandas=True) for field in PARQUET_SCHEMA}, schema=PARQUET_SCHEMA)
+
+
+class ParquetSink:
+    """
+    Writes cleaned listings as Parquet, partitioned by scrape date, city and property type.
+
+    The first batch written removes the partitions of the same scrape date, so
+    re-running a scrape replaces that day instead of duplicating it, while a run
+    that fails before writing anything leaves the day as it was. Every call to
+    `write` adds new files, which lets the streaming load write batch after batch.
+
+    Parameters
+    ----------
+    root : str
+        Root directory of the dataset.
+    scrape_date : str, optional
+        Date of the scrape, today by default.
+    compression : str
+        Parquet codec: "zstd", "snappy", "gzip", "brotli", "lz4" or "none".
+    compression_level : int, optional
+        Level of the codec, its default if not given.
+    """
+
+    def __init__(self, root: str = PARQUET_ROOT, scrape_date: str | None = None, compression: str = "zstd", compression_level: int | None = None):
+        self.root = root
+        self.scrape_date = str(scrape_date or date.today())
+        self.compression = compression
+        self.compression_level = compression_level
+        self.partition = os.path.join(root, f"scrape_date={self.scrape_date}")
+        self.batches = 0
+        self.replaced = False
+
+    def resume(self, batches: int):
+        """
+        Continues the scrape date written by an interrupted run instead of replacing it:
+        the files of its first `batches` batches are kept and the later ones removed.
+        """
+        for directory, _, files in os.walk(self.partition):
+            for name in files:
+                if name.startswith("part-") and int(name.split("-")[1]) >= batches:
+                    os.remove(os.path.join(directory, name))
+        self.batches = batches
+        self.replaced = True
+
+    def write(self, df: pd.DataFrame) -> int:
+        """
+        Writes a batch of cleaned listings.
+
+        Returns
+        -------
+        int
+            Number of rows written.
+        """
+        if len(df) == 0:
+            return 0
+        if not self.replaced:
+            shutil.rmtree(self.partition, ignore_errors=True)
+            self.replaced = True
+        pq.write_to_dataset(
+            to_arrow(df, self.scrape_date),
+            self.root,
+            partition_cols=PARTITION_COLUMNS,
+            basename_template=f"part-{self.batches}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            compression=self.compression,
+            compression_level=self.compression_level,
+        )
+        self.batches += 1
+        return len(df)
+
+
+def write_parquet(df: pd.DataFrame, root: str = PARQUET_ROOT, scrape_date: str | None = None, compression: str = "zstd", compression_level: int | None = None) -> int:
+    """
+    Writes the cleaned DataFrame as a partitioned Parquet dataset (see `ParquetSink`).
+    """
+    return ParquetSink(root, scrape_date, compression, compression_level).write(df)
+
+
+def partition_filters(scrape_dates: list | None = None, cities: list | None = None, property_types: list | None = None, since: str | None = None) -> list | None:
+    """
+    Builds pyarrow filters on the partition columns, None when there is nothing to filter.
+    """
+    filters = []
+    if scrape_dates:
+        filters.append(('scrape_date', 'in', [str(value) for value in scrape_dates]))
+    if since:
+        filters.append(('scrape_date', '>=', str(since)))
+    if cities:
+        filters.append(('city', 'in', list(cities)))
+    if property_types:
+        filters.append(('property_type', 'in', list(property_types)))
+    return filters or None
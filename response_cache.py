@@ -0,0 +1,221 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import time
+import zlib
+from datetime import date, timedelta
+
+# zstandard when installed, zlib otherwise. Blobs are recognized by their magic
+# number when read, so a cache written with one codec stays readable with the other.
+try:
+    import zstandard
+
+    CODEC = "zstd"
+    _compressor = zstandard.ZstdCompressor(level=10)
+    _decompressor = zstandard.ZstdDecompressor()
+except ImportError:
+    zstandard = None
+    CODEC = "zlib"
+
+CACHE_DIR = "response_cache"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def compress(content: bytes) -> bytes:
+    if zstandard is not None:
+        return _compressor.compress(content)
+    return zlib.compress(content, 6)
+
+
+def decompress(blob) -> bytes:
+    if blob[:4] == _ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError("Cached response is zstd compressed, install zstandard to read it")
+        return _decompressor.decompress(blob)
+    return zlib.decompress(blob)
+
+
+class ResponseCache:
+    """
+    On-disk cache of the raw search responses, content addressed and compressed.
+
+    Every response body is stored once under its SHA-256 digest in `objects/`, so
+    identical pages of different days share a file. A SQLite index maps
+    (city, property type, page, scrape date) to the digest, in request order, so a
+    scrape date can be replayed exactly as it was crawled. Blobs are read through
+    memory maps.
+
+    Parameters
+    ----------
+    root : str
+        Directory of the cache.
+    ttl_days : int, optional
+        Scrape dates older than this are removed by `evict`.
+    max_bytes : int, optional
+        Size of the blobs above which `evict` removes the oldest scrape dates.
+    """
+
+    def __init__(self, root: str = CACHE_DIR, ttl_days: int | None = 30, max_bytes: int | None = None):
+        self.root = root
+        self.ttl_days = ttl_days
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                scrape_date TEXT, city_id TEXT, city TEXT, property_type INTEGER, page INTEGER,
+                digest TEXT, sequence INTEGER, stored_at REAL,
+                PRIMARY KEY (scrape_date, city_id, property_type, page));
+            CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, size INTEGER, raw_size INTEGER);
+            CREATE INDEX IF NOT EXISTS responses_digest ON responses (digest);
+        """)
+        self.connection.commit()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest[2:])
+
+    def put(self, city_information: dict, property_type: int, page: int, content: bytes, scrape_date: str | None = None) -> str:
+        """
+        Stores a raw response body.
+
+        Returns
+        -------
+        str
+            SHA-256 digest of the body.
+        """
+        scrape_date = str(scrape_date or date.today())
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            blob = compress(content)
+            # written aside then renamed, so a crash never leaves a truncated blob
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as file:
+                file.write(blob)
+            os.replace(temporary, path)
+            self.connection.execute("INSERT OR IGNORE INTO objects VALUES (?, ?, ?)", (digest, len(blob), len(content)))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, "
+            "(SELECT COALESCE(MAX(sequence), 0) + 1 FROM responses WHERE scrape_date = ?), ?)",
+            (scrape_date, city_information["id"], city_information["city"], property_type, page, digest, scrape_date, time.time()))
+        self.connection.commit()
+        return digest
+
+    def read(self, digest: str) -> bytes:
+        """
+        Returns the body stored under `digest`.
+        """
+        with open(self._path(digest), "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as blob:
+                return decompress(blob)
+
+    def get(self, city_information: dict, property_type: int, page: int, scrape_date: str | None = None) -> bytes | None:
+        """
+        Returns the cached body of a page, None when it is not cached.
+        """
+        row = self.connection.execute(
+            "SELECT digest FROM responses WHERE scrape_date = ? AND city_id = ? AND property_type = ? AND page = ?",
+            (str(scrape_date or date.today()), city_information["id"], property_type, page)).fetchone()
+        return self.read(row[0]) if row else None
+
+    def scrape_dates(self) -> list:
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT scrape_date FROM responses ORDER BY scrape_date")]
+
+    def iter_responses(self, scrape_date: str, cities: list | None = None):
+        """
+        Yields the cached bodies of a scrape date one at a time.
+
+        City and property type pairs come in the order the crawl started them, and the
+        pages of each pair in page order, whatever order concurrent or retried requests
+        were answered in.
+
+        Parameters
+        ----------
+        scrape_date : str
+            Scrape date to replay (YYYY-MM-DD).
+        cities : list of str, optional
+            City names to replay, all by default.
+
+        Yields
+        ------
+        tuple of (str, int, int, bytes)
+            City name, property type, page and body.
+        """
+        rows = self.connection.execute("""
+            SELECT city, property_type, page, digest FROM responses
+            JOIN (SELECT city_id, property_type, MIN(sequence) AS first FROM responses
+                  WHERE scrape_date = ? GROUP BY city_id, property_type) USING (city_id, property_type)
+            WHERE scrape_date = ? ORDER BY first, page""", (str(scrape_date),) * 2).fetchall()
+        for city, property_type, page, digest in rows:
+            if cities is None or city in cities:
+                yield city, property_type, page, self.read(digest)
+
+    def size(self) -> int:
+        """
+        Bytes of the stored blobs.
+        """
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def evict(self, today: date | None = None) -> dict:
+        """
+        Removes the scrape dates older than the TTL, then the oldest scrape dates until
+        the blobs fit in `max_bytes`, and deletes the blobs no longer referenced.
+
+        Returns
+        -------
+        dict
+            Number of scrape dates and blobs removed.
+        """
+        removed_dates = []
+        if self.ttl_days is not None:
+            limit = str((today or date.today()) - timedelta(days=self.ttl_days))
+            removed_dates += [day for day in self.scrape_dates() if day < limit]
+        self._delete_dates(removed_dates)
+        removed_blobs = self._delete_orphans()
+        if self.max_bytes is not None:
+            dates = self.scrape_dates()
+            while dates and self.size() > self.max_bytes:
+                oldest = dates.pop(0)
+                self._delete_dates([oldest])
+                removed_dates.append(oldest)
+                removed_blobs += self._delete_orphans()
+        return {"scrape_dates": len(removed_dates), "blobs": removed_blobs}
+
+    def _delete_dates(self, dates: list):
+        self.connection.executemany("DELETE FROM responses WHERE scrape_date = ?", [(day,) for day in dates])
+        self.connection.commit()
+
+    def _delete_orphans(self) -> int:
+        orphans = [row[0] for row in self.connection.execute(
+            "SELECT digest FROM objects WHERE digest NOT IN (SELECT digest FROM responses)")]
+        for digest in orphans:
+            try:
+                os.remove(self._path(digest))
+            except FileNotFoundError:
+                pass
+        self.connection.executemany("DELETE FROM objects WHERE digest = ?", [(digest,) for digest in orphans])
+        self.connection.commit()
+        return len(orphans)
+
+    def close(self):
+        self.connection.close()
+
+
+_cache = None
+
+
+def configure_response_cache(root: str | None = CACHE_DIR, ttl_days: int | None = 30, max_bytes: int | None = None) -> ResponseCache | None:
+    """
+    Sets the cache the crawl stores its responses in, None disables it.
+    """
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = ResponseCache(root, ttl_days, max_bytes) if root else None
+    return _cache
+
+
+def get_response_cache() -> ResponseCache | None:
+    return _cache
@@ -0,0 +1,197 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+
+class RetryableError(ValueError):
+    """
+    Transient request failure that may succeed if retried.
+
+    Parameters
+    ----------
+    message : str
+        Description of the failure.
+    retry_after : float or None
+        Seconds the server asked us to wait, from the `Retry-After` header.
+    """
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(RetryableError):
+    """
+    Raised without sending a request while the circuit of an endpoint is open.
+    `retry_after` is the time left before the circuit lets a probe through.
+    """
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Converts a `Retry-After` header (seconds or HTTP date) into seconds to wait.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to an endpoint after repeated failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls fail
+    immediately for `reset_timeout` seconds. The first call after that is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # half-open: let one call probe the endpoint
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def remaining(self) -> float:
+        """
+        Seconds before an open circuit lets a probe through, 0 when it is closed.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, Retry-After support and a circuit breaker per endpoint.
+
+    Parameters
+    ----------
+    max_attempts : int
+        Attempts per call, including the first one.
+    base_delay : float
+        Backoff of the first retry in seconds, doubled on every attempt.
+    max_delay : float
+        Upper bound of a single backoff.
+    failure_threshold : int
+        Consecutive failures that open the circuit of an endpoint.
+    reset_timeout : float
+        Seconds an open circuit waits before letting a probe request through.
+    """
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 30.0, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retries = 0
+        self.backoff_time = 0.0
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        with self._lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.breakers[endpoint]
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """
+        Seconds to wait before retry number `attempt` (starting at 1).
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, func, endpoint: str):
+        """
+        Calls `func` until it succeeds, raises a non retryable error or runs out of attempts.
+
+        Parameters
+        ----------
+        func : callable
+            Function without arguments sending the request.
+        endpoint : str
+            Key of the circuit breaker protecting the call.
+
+        Returns
+        -------
+        Any
+            The value returned by `func`.
+        """
+        breaker = self.breaker(endpoint)
+        for attempt in range(1, self.max_attempts + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {endpoint}", retry_after=breaker.remaining())
+            try:
+                result = func()
+            except RetryableError as e:
+                breaker.record_failure()
+                if attempt == self.max_attempts:
+                    raise
+                delay = self.backoff(attempt, e.retry_after)
+                with self._lock:
+                    self.retries += 1
+                    self.backoff_time += delay
+                time.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+    def report(self) -> dict:
+        return {
+            "retries": self.retries,
+            "backoff_time": round(self.backoff_time, 3),
+            "open_circuits": [endpoint for endpoint, breaker in self.breakers.items() if breaker.opened_at is not None],
+        }
+
+
+_policy = RetryPolicy()
+
+
+def configure_retry_policy(**kwargs) -> RetryPolicy:
+    """
+    Replaces the shared policy used by `get_data` with a new one built from `kwargs`.
+    """
+    global _policy
+    _policy = RetryPolicy(**kwargs)
+    return _policy
+
+
+def get_retry_policy() -> RetryPolicy:
+    return _policy
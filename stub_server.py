@@ -0,0 +1,159 @@
+import gzip
+import json
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PROPERTY_TYPE_NAMES = {1: "Casa", 2: "Apartamento", 14: "Apartaestudio"}
+
+
+def make_hit(listing_id: str, city_name: str, property_type: int, rng: random.Random) -> dict:
+    """
+    Builds a synthetic search hit with the same shape as the FincaRaiz API.
+
+    Parameters
+    ----------
+    listing_id : str
+        Identifier of the listing.
+    city_name : str
+        Name of the city the listing belongs to.
+    property_type : int
+        Property type id (1: casa, 2: apartamento, 14: apartaestudio).
+    rng : random.Random
+        Random generator used to fill the numeric fields.
+
+    Returns
+    -------
+    dict
+        A hit with the `_source.listing` structure consumed by `data_transform`.
+    """
+    rooms = rng.randint(1, 5)
+    technical_sheet = [{"field": f"field_{i}", "value": None} for i in range(7)]
+    technical_sheet.append({"field": "rooms", "value": rooms})
+    return {
+        "_id": listing_id,
+        "_source": {
+            "listing": {
+                "id": listing_id,
+                "price": {"amount": rng.randint(80, 2000) * 1_000_000},
+                "m2": round(rng.uniform(25, 400), 2),
+                "technicalSheet": technical_sheet,
+                "bathrooms": rng.randint(1, 4),
+                "garage": rng.randint(0, 3),
+                "property_type": {"id": property_type, "name": PROPERTY_TYPE_NAMES.get(property_type, str(property_type))},
+                "stratum": rng.randint(0, 7),
+                "locations": {
+                    "location_point": {"type": "point", "coordinates": [round(rng.uniform(-77, -74), 6), round(rng.uniform(3, 7), 6)]},
+                    "city": [{"name": city_name}],
+                },
+            }
+        },
+    }
+
+
+def make_page(city_name: str, property_type: int, page: int, rows: int, total_hits: int) -> list:
+    """
+    Returns the hits of one result page, deterministic for a given (city, property type, page).
+
+    Pages past the last one are empty, like the real search service.
+    """
+    start = (page - 1) * rows
+    end = min(start + rows, total_hits)
+    hits = []
+    for position in range(start, end):
+        rng = random.Random(f"{city_name}|{property_type}|{position}")
+        hits.append(make_hit(f"{city_name[:3].upper()}-{property_type}-{position}", city_name, property_type, rng))
+    return hits
+
+
+class SearchStubHandler(BaseHTTPRequestHandler):
+    """
+    Request handler answering POST searches with synthetic `hits.hits` pages.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # headers and body are sent separately: without this, keep-alive requests wait on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        request_json = json.loads(body)
+        params = request_json["variables"]["params"]
+        page = params["page"]
+        rows = request_json["variables"].get("rows", 21)
+        property_type = params["property_type_id"][0]
+        city_name = params["locations"][0]["name"]
+
+        if server.latency:
+            threading.Event().wait(server.latency)
+
+        with server.lock:
+            server.request_count += 1
+            fail = server.rng.random() < server.error_rate
+
+        if fail:
+            payload = b'{"message": "Gateway Timeout"}'
+            self.send_response(504)
+        else:
+            hits = make_page(city_name, property_type, page, rows, server.total_hits)
+            payload = json.dumps({"hits": {"total": {"value": server.total_hits}, "hits": hits}}).encode()
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            payload = gzip.compress(payload, compresslevel=1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SearchStubServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the search service, used to exercise the extraction code offline.
+
+    Parameters
+    ----------
+    total_hits : int
+        Number of listings returned for every (city, property type) query.
+    latency : float
+        Seconds each request waits before answering.
+    error_rate : float
+        Probability of answering a request with a 504.
+    port : int
+        Port to bind to, 0 picks a free one.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, total_hits: int = 100, latency: float = 0.0, error_rate: float = 0.0, port: int = 0, seed: int = 0):
+        super().__init__(("127.0.0.1", port), SearchStubHandler)
+        self.total_hits = total_hits
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/api/v1/properties/search"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    with SearchStubServer(total_hits=500, port=8000) as server:
+        print(f"Serving stub search service on {server.url}")
+        threading.Event().wait()
@@ -0,0 +1,10 @@
+"""
+Makes the modules of the repository and the shared synthetic listings of `benchmarks/` importable.
+"""
+import os
+import sys
+
+import mysql.connector  # noqa: F401  (imported before pandas, see benchmarks/bench_db_load.py)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
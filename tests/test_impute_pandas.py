@@ -0,0 +1,39 @@
+"""
+The vectorized `load_db_pandas.impute_values` matches the previous row-wise implementation.
+"""
+import pandas as pd
+import pytest
+
+import load_db_pandas
+from bench_impute_pandas import legacy_impute_values
+from transform_engine import cast_to_plan
+from synthetic import synthetic_listings
+
+
+def nan_only_groups() -> pd.DataFrame:
+    # the apartaestudios have no rooms and Cali has no stratum or area at all
+    df = synthetic_listings(1000, seed=4)
+    df.loc[df['property_type'] == 'Apartaestudio', 'rooms'] = None
+    df.loc[df['city'] == 'Cali', ['stratum', 'area']] = None
+    return df
+
+
+def single_row_groups() -> pd.DataFrame:
+    # one listing per city and property type, of which one apartaestudio without rooms,
+    # one with zero rooms and one with an out of range stratum
+    df = synthetic_listings(9, seed=5).iloc[:9].copy()
+    df['city'] = ['Bogotá', 'Cali', 'Medellín'] * 3
+    df['property_type'] = ['Casa'] * 3 + ['Apartamento'] * 3 + ['Apartaestudio'] * 3
+    df['area'] = 50.0
+    df.loc[6:8, 'rooms'] = [float('nan'), 0.0, 2.0]
+    df.loc[[0, 4], 'stratum'] = [-1.0, 9.0]
+    return df
+
+
+@pytest.mark.parametrize("make", [lambda: synthetic_listings(2000), nan_only_groups, single_row_groups],
+                         ids=["synthetic", "nan_only_groups", "single_row_groups"])
+def test_matches_row_wise(make):
+    df = make()
+    expected = legacy_impute_values(df.copy())
+    # the row-wise path predates the dtype plan, its result is cast the same way
+    pd.testing.assert_frame_equal(load_db_pandas.impute_values(df.copy()), cast_to_plan(expected, "pandas"), check_dtype=False)
@@ -0,0 +1,604 @@
+import csv
+import importlib
+import numbers
+import os
+from geo import geohash, parse_location
+from metrics import configure_metrics, get_metrics
+
+LISTING_COLUMNS = ['id', 'price', 'area', 'rooms', 'bathrooms', 'garage', 'property_type', 'stratum', 'latitude', 'longitude', 'geohash', 'city']
+# Storage type of each listing column once cleaned, shared by every loader (see `column_types`).
+# Small integers must fit in int8, coordinates stay float64 so the spatial index is exact.
+DTYPE_PLAN = {
+    'id': 'string', 'price': 'float64', 'area': 'float32', 'rooms': 'int8', 'bathrooms': 'int8',
+    'garage': 'int8', 'property_type': 'category', 'stratum': 'int8', 'latitude': 'float64',
+    'longitude': 'float64', 'geohash': 'string', 'city': 'category',
+}
+# Small integers are read as float32 and narrowed after cleaning, so "2.0" and missing values parse in every engine
+READ_TYPES = {'int8': 'float32'}
+INT8_RANGE = (-128, 127) #small integers outside it are set missing before narrowing
+LEGACY_LOCATION = 'location' #location point column of the scraper CSV files written before the coordinates had their own columns
+ENGINE_MODULES = {"pandas": "load_db_pandas", "polars": "load_db_polars", "spark": "load_db_pyspark"}
+
+# Engine selection: pandas up to PANDAS_MAX_ROWS, Spark from SPARK_MIN_ROWS on machines
+# with at least SPARK_MIN_CORES cores, polars otherwise
+PANDAS_MAX_ROWS = 200_000
+SPARK_MIN_ROWS = 50_000_000
+SPARK_MIN_CORES = 16
+# Average size of a listing in the scraper CSV, used to estimate the rows of a file
+CSV_BYTES_PER_ROW = 110
+PARQUET_BYTES_PER_ROW = 25
+
+
+def _spark_functions():
+    from pyspark.sql import functions
+    return functions
+
+
+# Conditions of `SetWhen`: name -> (pandas, polars, spark) builders taking the column and the operand
+# and returning a boolean mask where missing values count as False. The polars builder takes the
+# expression of the column, which may already hold the previous rules (see `Rule.polars_expressions`)
+CONDITIONS = {
+    "eq": (
+        lambda df, column, operand: (df[column] == operand).fillna(False),
+        lambda value, operand: (value == operand).fill_null(False),
+        lambda F, column, operand: F.coalesce(F.col(column) == operand, F.lit(False)),
+    ),
+    "not_gt": (
+        lambda df, column, operand: ~(df[column] > operand).fillna(False),
+        lambda value, operand: ~(value > operand).fill_null(False),
+        lambda F, column, operand: ~F.coalesce(F.col(column) > operand, F.lit(False)),
+    ),
+}
+
+
+class Rule:
+    """
+    Cleaning rule, with one implementation per engine.
+    """
+
+    def pandas(self, df):
+        raise NotImplementedError
+
+    def polars(self, df):
+        import polars as pl
+        expressions = self.polars_expressions(pl.col)
+        if expressions is None:
+            raise NotImplementedError
+        return df.with_columns(value.alias(column) for column, value in expressions.items())
+
+    def polars_expressions(self, current) -> dict | None:
+        """
+        Column -> polars expression of the columns the rule sets, None for rules that
+        remove rows. `current(column)` returns the expression of a column so far, so
+        `apply_rules` can chain the rules into a single `with_columns`.
+        """
+        return None
+
+    def spark(self, df):
+        raise NotImplementedError
+
+
+class Deduplicate(Rule):
+    """
+    Keeps `columns` and removes the rows whose `key` was already seen. Without a
+    key, whole rows are compared.
+
+    When the input has the `latest` column (the scrape date of a Parquet dataset),
+    the row of the latest date is kept, so a listing read over several days keeps its
+    current version. Otherwise pandas and polars keep the first row, and Spark, which
+    has no row order, the first one by the other columns.
+
+    The scraper already drops repeated listings during the extraction (see
+    `web_scraping_real_estate.dedup_pages`), so this only hashes the key columns.
+    """
+
+    def __init__(self, columns: list[str], key: list[str] | None = None, latest: str = 'scrape_date'):
+        self.columns = columns
+        self.key = key
+        self.latest = latest
+
+    def pandas(self, df):
+        if self.key is None or self.latest not in df.columns:
+            return df[self.columns].drop_duplicates(subset=self.key)
+        import numpy as np
+        # positions from the latest date to the oldest, ties keep the input order
+        dates = df[self.latest].astype("string").reset_index(drop=True)
+        positions = dates.sort_values(ascending=False, kind="stable", na_position="last").index.to_numpy()
+        newest = ~df[self.key].iloc[positions].duplicated().to_numpy()
+        keep = np.zeros(len(df), dtype=bool)
+        keep[positions[newest]] = True
+        return df.loc[keep, self.columns]
+
+    def polars(self, df):
+        if self.key is not None and self.latest in df.collect_schema().names():
+            df = df.sort(self.latest, descending=True, nulls_last=True, maintain_order=True)
+        return df.select(self.columns).unique(subset=self.key, keep="first")
+
+    def spark(self, df):
+        if self.key is None:
+            return df.select(*self.columns).dropDuplicates()
+        from pyspark.sql import Window
+        F = _spark_functions()
+        order = [F.col(self.latest).desc_nulls_last()] if self.latest in df.columns else []
+        order += [F.col(column).asc_nulls_last() for column in self.columns if column not in self.key]
+        window = Window.partitionBy(*self.key).orderBy(*order)
+        return df.withColumn("_row", F.row_number().over(window)).filter(F.col("_row") == 1).select(*self.columns)
+
+
+class DropMissing(Rule):
+    """
+    Removes the rows where `column` is missing.
+    """
+
+    def __init__(self, column: str):
+        self.column = column
+
+    def pandas(self, df):
+        return df.dropna(subset=[self.column])
+
+    def polars(self, df):
+        return df.drop_nulls(self.column)
+
+    def spark(self, df):
+        return df.filter(_spark_functions().col(self.column).isNotNull())
+
+
+class SetWhen(Rule):
+    """
+    Sets `column` to `value` on the rows matching every condition.
+
+    Parameters
+    ----------
+    column : str
+        Column to set.
+    value : object
+        New value.
+    conditions : list of tuple
+        (column, condition, operand) with a condition of `CONDITIONS`.
+    """
+
+    def __init__(self, column: str, value, conditions: list[tuple]):
+        self.column = column
+        self.value = value
+        self.conditions = conditions
+
+    def pandas(self, df):
+        mask = True
+        for column, condition, operand in self.conditions:
+            mask = mask & CONDITIONS[condition][0](df, column, operand)
+        return df.assign(**{self.column: df[self.column].mask(mask, self.value)})
+
+    def polars_expressions(self, current) -> dict:
+        import polars as pl
+        mask = pl.lit(True)
+        for column, condition, operand in self.conditions:
+            mask = mask & CONDITIONS[condition][1](current(column), operand)
+        return {self.column: pl.when(mask).then(self.value).otherwise(current(self.column))}
+
+    def spark(self, df):
+        F = _spark_functions()
+        mask = F.lit(True)
+        for column, condition, operand in self.conditions:
+            mask = mask & CONDITIONS[condition][2](F, column, operand)
+        return df.withColumn(self.column, F.when(mask, self.value).otherwise(F.col(self.column)))
+
+
+class FillMissing(Rule):
+    """
+    Replaces the missing values of `column` with `value`.
+    """
+
+    def __init__(self, column: str, value):
+        self.column = column
+        self.value = value
+
+    def pandas(self, df):
+        return df.assign(**{self.column: df[self.column].fillna(self.value)})
+
+    def polars_expressions(self, current) -> dict:
+        return {self.column: current(self.column).fill_null(self.value)}
+
+    def spark(self, df):
+        return df.fillna({self.column: self.value})
+
+
+class Clip(Rule):
+    """
+    Limits `column` to [lower, upper], missing values are kept.
+    """
+
+    def __init__(self, column: str, lower, upper):
+        self.column = column
+        self.lower = lower
+        self.upper = upper
+
+    def pandas(self, df):
+        return df.assign(**{self.column: df[self.column].clip(lower=self.lower, upper=self.upper)})
+
+    def polars_expressions(self, current) -> dict:
+        return {self.column: current(self.column).clip(self.lower, self.upper)}
+
+    def spark(self, df):
+        F = _spark_functions()
+        value = F.col(self.column)
+        return df.withColumn(self.column, F.when(value < self.lower, self.lower).when(value > self.upper, self.upper).otherwise(value))
+
+
+# Cleaning applied by every loader before building the tables
+CLEANING_RULES = [
+    Deduplicate(LISTING_COLUMNS, key=['id']),
+    DropMissing('area'),
+    # Apartaestudios without a positive number of rooms have one, other missing rooms are 0
+    SetWhen('rooms', 1, [('rooms', 'not_gt', 0), ('property_type', 'eq', 'Apartaestudio')]),
+    FillMissing('rooms', 0),
+    # Stratum ranges from 1 to 6, missing values are kept
+    Clip('stratum', 1, 6),
+]
+
+
+def engine_types(engine: str) -> dict:
+    """
+    Types of `engine` for the type names of `DTYPE_PLAN`. Spark has no categorical type, it keeps strings.
+    """
+    if engine == "pandas":
+        return {'string': 'str', 'float64': 'float64', 'float32': 'float32', 'int8': 'Int8', 'category': 'category'}
+    if engine == "polars":
+        import polars as pl
+        return {'string': pl.String, 'float64': pl.Float64, 'float32': pl.Float32, 'int8': pl.Int8, 'category': pl.Categorical}
+    from pyspark.sql import types
+    return {'string': types.StringType(), 'float64': types.DoubleType(), 'float32': types.FloatType(),
+            'int8': types.ByteType(), 'category': types.StringType()}
+
+
+def column_types(engine: str, read: bool = False) -> dict:
+    """
+    Column -> type of `engine` following `DTYPE_PLAN`, in the order of `LISTING_COLUMNS`.
+
+    Parameters
+    ----------
+    engine : str
+        "pandas", "polars" or "spark".
+    read : bool
+        Types used to read the scraper CSV (see `READ_TYPES`) instead of the final ones.
+    """
+    types = engine_types(engine)
+    return {column: types[READ_TYPES.get(kind, kind) if read else kind] for column, kind in DTYPE_PLAN.items()}
+
+
+def cast_to_plan(df, engine: str):
+    """
+    Casts the listing columns of a pandas, polars (eager or lazy) or Spark DataFrame to
+    `DTYPE_PLAN`. Small integers are rounded first, and set missing when they fall
+    outside `INT8_RANGE`: the cast would fail in pandas and polars and overflow
+    silently in Spark.
+    """
+    types = column_types(engine)
+    small_ints = [column for column, kind in DTYPE_PLAN.items() if kind == 'int8']
+    lower, upper = INT8_RANGE
+    if engine == "pandas":
+        rounded = {column: df[column].round() for column in small_ints if column in df.columns}
+        df = df.assign(**{column: values.where(values.between(lower, upper)) for column, values in rounded.items()})
+        return df.astype({column: kind for column, kind in types.items() if column in df.columns})
+    if engine == "polars":
+        import polars as pl
+        expressions = _polars_plan(pl.col, df.collect_schema().names())
+        return df.with_columns(value.alias(column) for column, value in expressions.items())
+    F = _spark_functions()
+
+    def small_int(column):
+        rounded = F.round(F.col(column))
+        return F.when(rounded.between(lower, upper), rounded)
+
+    return df.select(*(
+        (small_int(column) if column in small_ints else F.col(column)).cast(types[column]).alias(column)
+        if column in types else F.col(column) for column in df.columns))
+
+
+def _polars_plan(current, columns: list[str]) -> dict:
+    # column -> expression casting `current(column)` to `DTYPE_PLAN`, for the listing columns among `columns`
+    import polars as pl
+    lower, upper = INT8_RANGE
+    expressions = {}
+    for column, kind in column_types("polars").items():
+        if column not in columns:
+            continue
+        value = current(column)
+        if DTYPE_PLAN[column] == 'int8':
+            rounded = value.round()
+            value = pl.when(rounded.is_between(lower, upper)).then(rounded)
+        expressions[column] = value.cast(kind)
+    return expressions
+
+
+def _apply_polars(df, rules: list[Rule], cast: bool):
+    # Rules setting columns are chained into one expression per column, applied with a single
+    # `with_columns` before the next rule removing rows: the optimizer doesn't merge consecutive ones
+    import polars as pl
+    pending = {}
+
+    def current(column):
+        return pending.get(column, pl.col(column))
+
+    def flush(df):
+        return df.with_columns(value.alias(column) for column, value in pending.items()) if pending else df
+
+    for rule in rules:
+        expressions = rule.polars_expressions(current)
+        if expressions is None:
+            df = rule.polars(flush(df))
+            pending = {}
+        else:
+            pending.update(expressions)
+    if cast:
+        pending.update(_polars_plan(current, df.collect_schema().names()))
+    return flush(df)
+
+
+def is_legacy_csv(path: str) -> bool:
+    """
+    True when the scraper CSV at `path` has the `LEGACY_LOCATION` column instead of the coordinates.
+    """
+    with open(path, newline='', encoding='utf-8') as file:
+        header = next(csv.reader(file), [])
+    return LEGACY_LOCATION in header and 'latitude' not in header
+
+
+def read_legacy_csv(path: str):
+    """
+    Reads with pandas a scraper CSV written before the coordinates had their own
+    columns, with the location point split into latitude and longitude and the
+    geohash computed from them (see `geo`). Values that aren't numbers, such as the
+    room counts read from the wrong field, are set missing.
+
+    Returns
+    -------
+    pd.DataFrame
+        The `LISTING_COLUMNS` with the types used to read current CSV files (see `column_types`).
+    """
+    import pandas as pd
+    types = column_types("pandas", read=True)
+    df = pd.read_csv(path, dtype=str)
+    points = [parse_location(value) for value in df[LEGACY_LOCATION].tolist()]
+    df = df.assign(
+        latitude=[latitude for latitude, _ in points],
+        longitude=[longitude for _, longitude in points],
+        geohash=pd.Series([geohash(*point) for point in points], index=df.index, dtype=types['geohash']),
+    )
+    numeric = [column for column, kind in DTYPE_PLAN.items() if READ_TYPES.get(kind, kind).startswith('float')]
+    df = df.assign(**{column: pd.to_numeric(df[column], errors='coerce') for column in numeric})
+    return df[LISTING_COLUMNS].astype(types)
+
+
+def apply_rules(df, engine: str, rules: list[Rule] = CLEANING_RULES, cast: bool = False):
+    """
+    Applies the cleaning rules to a pandas, polars (eager or lazy) or Spark DataFrame.
+
+    With polars, the rules setting columns between two rules removing rows are
+    applied with a single `with_columns`, which also holds the cast when `cast` is set.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Listings in the format of `engine`.
+    engine : str
+        "pandas", "polars" or "spark".
+    rules : list of Rule
+        Rules applied in order.
+    cast : bool
+        Also casts the listing columns to `DTYPE_PLAN`, see `cast_to_plan`.
+
+    Returns
+    -------
+    DataFrame
+        The cleaned listings, in the format of `engine`.
+    """
+    if engine == "polars":
+        return _apply_polars(df, rules, cast)
+    for rule in rules:
+        df = getattr(rule, engine)(df)
+    return cast_to_plan(df, engine) if cast else df
+
+
+def available_engines() -> list[str]:
+    """
+    Returns the engines whose library is installed.
+    """
+    available = []
+    for engine, module in (("pandas", "pandas"), ("polars", "polars"), ("spark", "pyspark")):
+        try:
+            importlib.import_module(module)
+            available.append(engine)
+        except ImportError:
+            pass
+    return available
+
+
+def estimate_rows(path: str) -> int:
+    """
+    Estimates the number of listings of a scraper CSV file or Parquet dataset from its size on disk.
+    """
+    if os.path.isdir(path):
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+        return size // PARQUET_BYTES_PER_ROW
+    return os.path.getsize(path) // CSV_BYTES_PER_ROW
+
+
+def select_engine(rows: int, cores: int | None = None, available: list[str] | None = None) -> str:
+    """
+    Picks the engine for a job: pandas for small inputs, Spark for very large inputs
+    on machines with many cores, polars otherwise.
+
+    Parameters
+    ----------
+    rows : int
+        Number of listings, see `estimate_rows`.
+    cores : int, optional
+        Cores available, all the cores of this machine by default.
+    available : list of str, optional
+        Engines to choose from, the installed ones by default.
+
+    Returns
+    -------
+    str
+        "pandas", "polars" or "spark".
+    """
+    cores = cores or os.cpu_count() or 1
+    available = available or available_engines()
+    if rows >= SPARK_MIN_ROWS and cores >= SPARK_MIN_CORES and "spark" in available:
+        preferred = ["spark", "polars", "pandas"]
+    elif rows <= PANDAS_MAX_ROWS:
+        preferred = ["pandas", "polars", "spark"]
+    else:
+        preferred = ["polars", "pandas", "spark"]
+    return next(engine for engine in preferred if engine in available)
+
+
+class Executor:
+    """
+    Runs the loader pipeline (read, clean, build tables, load) with one engine.
+
+    The steps come from the loader module of the engine (`ENGINE_MODULES`), which
+    apply the shared `CLEANING_RULES`, so every engine produces the same tables.
+
+    Parameters
+    ----------
+    engine : str
+        "pandas", "polars", "spark" or "auto" to pick it from the input with `select_engine`.
+    spark : SparkSession, optional
+        Session used by the Spark engine, `get_spark()` by default.
+    """
+
+    def __init__(self, engine: str = "auto", spark=None):
+        self.engine = engine
+        self.spark = spark
+
+    @property
+    def module(self):
+        return importlib.import_module(ENGINE_MODULES[self.engine])
+
+    def read(self, path: str):
+        """
+        Reads a scraper CSV file or Parquet dataset, choosing the engine first in "auto" mode.
+        """
+        if self.engine == "auto":
+            self.engine = select_engine(estimate_rows(path))
+        from_csv = path.endswith(".csv")
+        with get_metrics().stage("read", engine=self.engine):
+            if self.engine == "pandas":
+                return self.module.read_csv(path) if from_csv else self.module.load_parquet(path)
+            if self.engine == "polars":
+                return self.module.scan_data(path).collect()
+            self.spark = self.spark or self.module.get_spark()
+            return self.module.read_csv(self.spark, path) if from_csv else self.module.load_parquet(self.spark, path)
+
+    def clean(self, df):
+        with get_metrics().stage("impute_values", engine=self.engine):
+            return self.module.impute_values(df)
+
+    def create_tables(self, df, registry=None) -> list:
+        with get_metrics().stage("create_tables", engine=self.engine):
+            return self.module.create_tables(df, registry)
+
+    def load(self, tables_list: list, db_type: str, incremental: bool = False, bulk: bool = False):
+        """
+        Loads the tables into the "sqlite3" or "mysql" database, with `bulk_loader.bulk_load`
+        when `bulk` is set. The Spark loader always writes the tables of `bulk_load` through
+        JDBC and has no incremental load.
+        """
+        if self.engine == "spark":
+            if incremental:
+                raise ValueError("The Spark engine can't load incrementally, use pandas or polars")
+            return self.module.load_to_db(tables_list, self.module.connect_to_db(db_type), self.module.TABLE_NAMES)
+        db_connection = self.module.connect_to_db(db_type, incremental=incremental)
+        return self.module.load_to_db(tables_list, db_connection, self.module.TABLE_NAMES, incremental=incremental, bulk=bulk)
+
+    def run(self, path: str, db_type: str | None = None, registry=None, incremental: bool = False, bulk: bool = False) -> list:
+        """
+        Reads, cleans and builds the tables of `path`, and loads them when `db_type` is given.
+
+        Returns
+        -------
+        list of DataFrame
+            Main table, cities and property types, in the format of the engine.
+        """
+        tables_list = self.create_tables(self.clean(self.read(path)), registry)
+        if db_type:
+            self.load(tables_list, db_type, incremental, bulk)
+        return tables_list
+
+
+def canonical_rows(table) -> list[tuple]:
+    """
+    Rows of a pandas, polars or Spark table in a comparable form: sorted, numbers as
+    floats and missing values as None.
+    """
+    import pandas as pd
+    if hasattr(table, "toPandas"):
+        table = table.toPandas()
+    elif hasattr(table, "to_pandas"):
+        table = table.to_pandas()
+
+    def value(item):
+        if pd.isna(item):
+            return None
+        if isinstance(item, numbers.Number) and not isinstance(item, bool):
+            return float(item)
+        return item
+
+    rows = [tuple(value(item) for item in row) for row in table.astype(object).itertuples(index=False, name=None)]
+    return sorted(rows, key=lambda row: tuple((item is None, str(item)) for item in row))
+
+
+def compare_tables(tables_by_engine: dict, table_names: list[str] | None = None) -> list[str]:
+    """
+    Compares the tables built by several engines.
+
+    Parameters
+    ----------
+    tables_by_engine : dict
+        Engine -> list of tables returned by `create_tables`.
+    table_names : list of str, optional
+        Names used in the messages.
+
+    Returns
+    -------
+    list of str
+        One message per table that differs from the first engine, empty when all agree.
+    """
+    engines = list(tables_by_engine)
+    reference = engines[0]
+    differences = []
+    for position, expected in enumerate(tables_by_engine[reference]):
+        name = table_names[position] if table_names else str(position)
+        expected_columns = list(expected.columns)
+        expected_rows = canonical_rows(expected)
+        for engine in engines[1:]:
+            table = tables_by_engine[engine][position]
+            if list(table.columns) != expected_columns:
+                differences.append(f"{name}: {engine} columns {list(table.columns)} != {reference} columns {expected_columns}")
+                continue
+            rows = canonical_rows(table)
+            if rows != expected_rows:
+                mismatches = len(set(rows) ^ set(expected_rows))
+                differences.append(f"{name}: {engine} has {len(rows)} rows, {reference} has {len(expected_rows)}, {mismatches} differ")
+    return differences
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Load the scraped listings into the database with the best engine for the input")
+    parser.add_argument("path", help="CSV file or Parquet dataset directory")
+    parser.add_argument("--engine", choices=["auto", *ENGINE_MODULES], default="auto")
+    parser.add_argument("--db", choices=["mysql", "sqlite3"], default="mysql")
+    parser.add_argument("--incremental", action="store_true", help="Upsert into the existing database instead of recreating it")
+    parser.add_argument("--bulk", action="store_true", help="Recreate the tables with keys, spatial index and market statistics (bulk_loader.bulk_load)")
+    parser.add_argument("--metrics", metavar="PATH", help="Record per-stage metrics and write them to PATH, Prometheus text for .prom files, JSON otherwise")
+    parser.add_argument("--trace-memory", action="store_true", help="Also measure the peak Python memory of each stage (slower)")
+    args = parser.parse_args()
+
+    metrics = configure_metrics(enabled=bool(args.metrics), trace_memory=args.trace_memory)
+    executor = Executor(args.engine)
+    executor.run(args.path, args.db, incremental=args.incremental, bulk=args.bulk)
+    print(f"Loaded {args.path} with {executor.engine}")
+    if args.metrics:
+        metrics.write(args.metrics)
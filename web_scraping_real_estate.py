@@ -1,14 +1,56 @@
 import requests
+import asyncio
 import json
 import pandas as pd
-from time import sleep
-from retrying import retry
-from typing import Tuple
+import os
+from time import sleep, perf_counter
+from typing import Callable, Tuple, Iterable, Iterator, NamedTuple
 from itertools import chain
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import date
+from http_session import configure_session, get_session
+from checkpoint import CrawlState
+from dedup import configure_dedup, get_dedup, Deduplicator
+from field_extractor import FieldExtractor
+from geo import coordinate, geohash
+from json_backend import PayloadTemplate, loads
+from metrics import configure_metrics, get_metrics
+from parquet_sink import ParquetSink
+from response_cache import configure_response_cache, get_response_cache, ResponseCache, CACHE_DIR
+from retry_policy import RETRYABLE_STATUS, CircuitOpenError, RetryableError, RetryPolicy, get_retry_policy, parse_retry_after
 
 URL = "https://search-service.fincaraiz.com.co/api/v1/properties/search"
 property_type_id = [1,2,14] #1: casa, 2: apartamento, 14: apartaestudio
+ROWS = 21 #listings per result page
+MAX_CONSECUTIVE_FAILURES = 3 #dead-lettered pages in a row before giving up on a property type
+MAX_CIRCUIT_WAITS = 1 #open circuit resets waited for on one page before dead-lettering it
+UNCHANGED_RUN = 42 #listings in a row already seen unchanged that end an incremental crawl (two pages)
+LISTING_EXTRACTOR = FieldExtractor() #compiled from field_extractor.LISTING_SPEC
+
+
+class Listing(NamedTuple):
+    """
+    Cleaned listing, as returned by `data_transform`.
+
+    A tuple with named fields: it holds no per-row dictionary and takes about a third
+    of the memory of the equivalent dict. Values are kept as received from the API.
+    """
+    id: str | None
+    price: int | float | None
+    area: float | None
+    rooms: int | None
+    bathrooms: int | None
+    garage: int | None
+    property_type: str | None
+    stratum: int | None
+    latitude: float | None
+    longitude: float | None
+    geohash: str | None
+    city: str | None
+
+
+CSV_COLUMNS = list(Listing._fields)
 
 city_information = [
     {
@@ -43,42 +85,273 @@ city_information = [
     }
 ]
 
+SCOPE_FILE = "crawl_scope.json"
+SCOPE_CITY_KEYS = ("id", "city", "coordinates", "slug", "estate_name", "estate_id", "estate_slug", "label")
+
+
+def load_scope(path: str = SCOPE_FILE) -> dict:
+    """
+    Reads the crawl scope from a JSON config file.
+
+    The file holds the cities in the format of the module level `city_information`
+    ("cities"), the property type ids ("property_types") and optionally the result
+    pages per shard of the crawl scheduler ("pages_per_shard"). A missing list falls
+    back to the module level one.
+
+    Parameters
+    ----------
+    path : str
+        Path of the config file.
+
+    Returns
+    -------
+    dict
+        "cities", "property_types" and "pages_per_shard" (None when not set).
+    """
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    cities = config.get("cities", city_information)
+    for city in cities:
+        missing = [key for key in SCOPE_CITY_KEYS if key not in city]
+        if missing:
+            raise ValueError(f"City {city.get('city', city.get('id'))!r} of {path} is missing {', '.join(missing)}")
+    property_types = [int(property_type) for property_type in config.get("property_types", property_type_id)]
+    if not cities or not property_types:
+        raise ValueError(f"{path} defines no city or no property type")
+    return {"cities": cities, "property_types": property_types, "pages_per_shard": config.get("pages_per_shard")}
+
 
-@retry(wait_random_min = 5000, wait_random_max = 10000, stop_max_attempt_number = 3)
-def get_data(url: str, request_json: dict)-> Tuple[int, str]:
+def send_request(url: str, request_json: dict | bytes)-> Tuple[int, bytes]:
     """
-    Sends a POST request to the given URL with a JSON payload.
+    Sends a single POST request to the given URL with a JSON payload through the shared pooled session.
 
     Parameters
     ----------
     url : str
         The URL to send the POST request to.
-    request_json : dict
-        The JSON payload to include in the POST request.
+    request_json : dict or bytes
+        The JSON payload to include in the POST request, or the payload already serialized.
 
     Returns
     -------
-    tuple of (int, str)
+    tuple of (int, bytes)
         - status_code: The HTTP status code of the response.
-        - response_text: The response text from the server.
+        - response_content: The undecoded response body from the server.
+
+    Raises
+    ------
+    RetryableError
+        On connection errors and 429/502/503/504 responses.
+    ValueError
+        On a 500 response, which the service returns when there is no more info.
     """
-    response = requests.post(url,json=request_json)
+    metrics = get_metrics()
+    start = perf_counter()
+    try:
+        if isinstance(request_json, bytes):
+            response = get_session().post(url,data=request_json,headers={"Content-Type": "application/json"})
+        else:
+            response = get_session().post(url,json=request_json)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        metrics.inc("requests_total", status="error")
+        raise RetryableError(str(e))
     status_code = response.status_code
-    response_text = response.text
+    response_content = response.content
+    if metrics.enabled:
+        metrics.observe("request_seconds", perf_counter() - start, status=status_code)
+        metrics.inc("requests_total", status=status_code)
+        metrics.inc("response_bytes_total", len(response_content))
 
-    if status_code == 504:
-        print("504")
-        raise ValueError('Status code is 504')
+    if status_code in RETRYABLE_STATUS:
+        print(status_code)
+        raise RetryableError(f'Status code is {status_code}', parse_retry_after(response.headers.get('Retry-After')))
     if status_code == 500:
         print("500")
         raise ValueError('No more info')
 
-    return status_code, response_text
+    return status_code, response_content
 
 
-def data_extract(city_information: list, property_type_id: list, debug: bool = False) -> list:
+def get_data(url: str, request_json: dict | bytes, retry_policy: RetryPolicy | None = None)-> Tuple[int, bytes]:
     """
-    Extracts data based on city information and property types.
+    Sends a POST request, retrying transient failures according to a retry policy.
+
+    Parameters
+    ----------
+    url : str
+        The URL to send the POST request to.
+    request_json : dict or bytes
+        The JSON payload to include in the POST request, or the payload already serialized.
+    retry_policy : RetryPolicy, optional
+        Policy deciding backoff and circuit breaking, the shared policy by default.
+
+    Returns
+    -------
+    tuple of (int, bytes)
+        - status_code: The HTTP status code of the response.
+        - response_content: The undecoded response body from the server.
+    """
+    policy = retry_policy or get_retry_policy()
+    attempts = 0
+
+    def attempt():
+        nonlocal attempts
+        attempts += 1
+        return send_request(url, request_json)
+
+    try:
+        return policy.call(attempt, endpoint=url)
+    finally:
+        if attempts > 1:
+            get_metrics().inc("retries_total", attempts - 1)
+
+
+def get_page(url: str, request_json: dict | bytes, waits: int = MAX_CIRCUIT_WAITS) -> Tuple[int, bytes]:
+    """
+    Sends a search request with `get_data`, waiting for an open circuit to let a probe
+    through instead of failing at once, up to `waits` times.
+
+    An open circuit fails every call immediately, so without the wait a short outage
+    would dead-letter every remaining page of the crawl within milliseconds.
+    """
+    for wait in range(waits + 1):
+        try:
+            return get_data(url, request_json)
+        except CircuitOpenError as e:
+            if wait == waits:
+                raise
+            print(f"{e}, waiting {e.retry_after:.1f}s")
+            sleep(e.retry_after)
+
+
+def iter_dead_letters(dead_letters: list, url: str = URL, state: CrawlState | None = None) -> Iterator[list]:
+    """
+    Yields the pages recovered by requesting again the pages that failed during a crawl.
+
+    A letter with `resume` marks the page where a property type was given up: its
+    pagination continues from there (see `iter_pages`).
+
+    Parameters
+    ----------
+    dead_letters : list
+        Failed pages as dictionaries with `city`, `property_type` and `page`.
+        Pages failing again are left in the list once the generator is exhausted,
+        the rest are removed.
+    url : str
+        The search endpoint to query.
+    state : CrawlState, optional
+        Incremental crawl state of the resumed property types.
+
+    Yields
+    ------
+    list
+        The hits of one recovered page.
+    """
+    remaining = []
+    for letter in dead_letters:
+        if letter.get("resume"):
+            print(f'Resuming property {letter["property_type"]} ({letter["city"]["city"]}) from page {letter["page"]}')
+            yield from iter_pages(letter["city"], [letter["property_type"]], url=url, dead_letters=remaining, state=state, first_page=letter["page"])
+            continue
+        request_json = request_payload(letter["city"], letter["property_type"], letter["page"])
+        try:
+            status_code, response_content = get_page(url, request_json)
+        except ValueError as e:
+            print(e, url, request_json)
+            remaining.append(letter)
+            continue
+        cache_response(letter["city"], letter["property_type"], letter["page"], response_content)
+        yield loads(response_content)["hits"]["hits"]
+    dead_letters[:] = remaining
+
+
+def retry_dead_letters(dead_letters: list, url: str = URL) -> list:
+    """
+    Requests again the pages that failed during a crawl (see `iter_dead_letters`).
+
+    Returns
+    -------
+    list
+        The pages (lists of hits) recovered.
+    """
+    return list(iter_dead_letters(dead_letters, url))
+
+
+def cache_response(city_information: dict, property_type: int, page: int, response_content: bytes):
+    """
+    Stores a raw response in the response cache, when one is configured (see `response_cache`).
+    """
+    cache = get_response_cache()
+    if cache is not None:
+        cache.put(city_information, property_type, page, response_content)
+
+
+def iter_replay(scrape_date: str, cache: ResponseCache | None = None, cities: list | None = None) -> Iterator[list]:
+    """
+    Yields the result pages of a past crawl from the response cache, without any request.
+
+    Pages are decoded one at a time and the pagination of `iter_pages` applies: the
+    pages of a city and property type end at the first empty or repeated page.
+
+    Parameters
+    ----------
+    scrape_date : str
+        Date of the crawl to replay (YYYY-MM-DD).
+    cache : ResponseCache, optional
+        Cache to read from, the configured one by default.
+    cities : list of str, optional
+        City names to replay, all by default.
+
+    Yields
+    ------
+    list
+        The hits of one result page.
+    """
+    cache = cache or get_response_cache()
+    metrics = get_metrics()
+    current = None
+    for city, property_type, page, response_content in cache.iter_responses(scrape_date, cities):
+        if (city, property_type) != current:
+            current = (city, property_type)
+            last_fingerprint = None
+            ended = False
+        if ended:
+            continue
+        response_body = loads(response_content)["hits"]["hits"]
+        fingerprint = page_fingerprint(response_body)
+        if not response_body or fingerprint == last_fingerprint:
+            ended = True
+            continue
+        last_fingerprint = fingerprint
+        metrics.inc("replayed_pages_total", city=city, property_type=property_type)
+        yield response_body
+
+
+def build_request_json(city_information: dict, property_type: int, page: int) -> dict:
+    """
+    Builds the search payload for a city, property type and page.
+
+    Parameters
+    ----------
+    city_information : dict
+        A dictionary containing information about the city.
+    property_type : int
+        The property type ID to search for.
+    page : int
+        The result page to request.
+
+    Returns
+    -------
+    dict
+        The JSON payload expected by the search service.
+    """
+    return {"variables":{"rows":ROWS,"params":{"page":page,"order":2,"operation_type_id":1,"property_type_id":[property_type],"locations":[{"country":[{"name":"Colombia","id":"858656c1-bbb1-4b0d-b569-f61bbdebc8f0","slug":"country-48-colombia"}],"name":city_information["city"],"location_point":{"coordinates":[city_information["coordinates"][0],city_information["coordinates"][1]],"type":"point"},"id":city_information["id"],"type":"CITY","slug":[city_information["slug"]],"estate":{"name":city_information["estate_name"],"id":city_information["estate_id"],"slug":city_information["estate_slug"]},"label":city_information["label"]}]},"page":page,"source":10},"query":""}
+
+
+def iter_pages(city_information: dict, property_type_id: list, debug: bool = False, url: str = URL, dead_letters: list | None = None, state: CrawlState | None = None, unchanged_run: int = UNCHANGED_RUN, first_page: int | None = None,
+               last_page: int | None = None, on_page: Callable[[int, int | None], None] | None = None) -> Iterator[list]:
+    """
+    Yields the result pages of a city, one property type after the other, as they are downloaded.
 
     Parameters
     ----------
@@ -88,46 +361,409 @@ def data_extract(city_information: list, property_type_id: list, debug: bool = F
         A list of property type IDs to be included in the request.
     debug : bool
         A boolean flag to enable or disable debug mode. If enabled, additional debug information will be printed.
+    url : str
+        The search endpoint to query.
+    dead_letters : list, optional
+        List collecting the pages that failed after every retry, and the page to resume
+        a property type given up after `MAX_CONSECUTIVE_FAILURES` of them. When given,
+        the caller retries them (see `iter_dead_letters`); otherwise they are retried
+        and yielded last.
+    state : CrawlState, optional
+        Incremental crawl state. When given, only new or changed listings are yielded,
+        the crawl resumes from the checkpoint of an interrupted run and pagination stops
+        after `unchanged_run` listings in a row that were already seen unchanged. A page
+        is checkpointed when the next one is requested and stored when the writer
+        commits the state (see `data_load_stream`).
+    unchanged_run : int
+        Length of the run of unchanged listings that ends an incremental crawl.
+    first_page : int, optional
+        Page to start from instead of the first one or the checkpoint.
+    last_page : int, optional
+        Last page to request, the pagination otherwise ends on the last page of the results.
+    on_page : callable, optional
+        Called with the page number and the number of pages (None when the service gives
+        no total) once a page is read, before it is yielded.
 
-    Returns
-    -------
+    Yields
+    ------
     list
-        A list containing the raw data extracted from the requests.
+        The hits of one result page.
     """
-    
-    raw_data = []
+    retry_at_end = dead_letters is None
+    if retry_at_end:
+        dead_letters = []
+    metrics = get_metrics()
 
     for property_type in property_type_id:
-        last_response_body = {}
-        page = 1
+        labels = {"city": city_information["city"], "property_type": property_type}
+        last_fingerprint = None
+        page_count = None
+        if first_page is not None:
+            page = first_page
+        else:
+            page = state.start_page(city_information["id"], property_type) if state else 1
+        failures = 0
+        unchanged = 0
+        completed = True
         print(f"Property: {property_type}")
-        while True:
+        while (page_count is None or page <= page_count) and (last_page is None or page <= last_page):
             #modify json for new request
-            request_json = {"variables":{"rows":21,"params":{"page":page,"order":2,"operation_type_id":1,"property_type_id":[property_type],"locations":[{"country":[{"name":"Colombia","id":"858656c1-bbb1-4b0d-b569-f61bbdebc8f0","slug":"country-48-colombia"}],"name":city_information["city"],"location_point":{"coordinates":[city_information["coordinates"][0],city_information["coordinates"][1]],"type":"point"},"id":city_information["id"],"type":"CITY","slug":[city_information["slug"]],"estate":{"name":city_information["estate_name"],"id":city_information["estate_id"],"slug":city_information["estate_slug"]},"label":city_information["label"]}]},"page":page,"source":10},"query":""}
+            request_json = request_payload(city_information, property_type, page)
             #new request
             try:
-                status_code, response_text = get_data(URL, request_json)
+                with metrics.stage("extract", **labels):
+                    status_code, response_content = get_page(url, request_json)
+            except RetryableError as e:
+                print(e, url, request_json)
+                metrics.inc("dead_letters_total", **labels)
+                dead_letters.append({"city": city_information, "property_type": property_type, "page": page})
+                failures += 1
+                page += 1
+                if failures >= MAX_CONSECUTIVE_FAILURES:
+                    #the retry at the end of the crawl continues the pagination from the next page
+                    print(f"Giving up property {property_type} at page {page}")
+                    dead_letters.append({"city": city_information, "property_type": property_type, "page": page, "resume": True})
+                    completed = False
+                    break
+                continue
             except ValueError as e:
-                print(e, URL, request_json)
+                print(e, url, request_json)
                 break
-            
-            response_body = json.loads(response_text)["hits"]["hits"]
-            #add data to empty element
-            if response_body == last_response_body:
+            failures = 0
+            cache_response(city_information, property_type, page, response_content)
+
+            response_json = loads(response_content)
+            response_body = response_json["hits"]["hits"]
+            #an empty or repeated page means there is no more info
+            fingerprint = page_fingerprint(response_body)
+            if not response_body or fingerprint == last_fingerprint:
                 break
-            raw_data.append(response_body)
-            page += 1
+            last_fingerprint = fingerprint
+            metrics.inc("pages_total", **labels)
+            metrics.inc("hits_total", len(response_body), **labels)
+            total = hits_total(response_json)
+            if total is not None:
+                page_count = -(-total // ROWS)
+            if on_page:
+                on_page(page, page_count)
 
-            last_response_body = response_body
+            if state:
+                changed, unchanged_flags = state.filter_changed(city_information["id"], property_type, response_body)
+                for flag in unchanged_flags:
+                    unchanged = unchanged + 1 if flag else 0
+                yield changed
+                #the rows of the page are with the writer, which commits the checkpoint once they are written
+                state.checkpoint(city_information["id"], property_type, page)
+                if unchanged >= unchanged_run:
+                    print(f"{unchanged} unchanged listings, stopping at page {page}")
+                    break
+            else:
+                yield response_body
+            page += 1
 
             if debug:
                 if page % 10 == 0:
                     print(f"Page: {page}")
-        raw_data2 = list(chain(*raw_data))
+
+        if state and completed:
+            state.checkpoint(city_information["id"], property_type, page, completed=True)
+
+    if retry_at_end and dead_letters:
+        yield from iter_dead_letters(dead_letters, url, state)
+
+
+def iter_crawl(city_information: list, property_type_id: list, debug: bool = False, url: str = URL, dead_letters: list | None = None, state: CrawlState | None = None) -> Iterator[list]:
+    """
+    Yields the result pages of every city, followed by the failed pages recovered at the end of the crawl.
+
+    Parameters
+    ----------
+    city_information : list
+        A list of city dictionaries, as in the module level `city_information`.
+    property_type_id : list
+        A list of property type IDs to be included in the request.
+    debug : bool
+        A boolean flag to enable or disable debug mode.
+    url : str
+        The search endpoint to query.
+    dead_letters : list, optional
+        List collecting the pages that failed after every retry, including the retry at the end.
+    state : CrawlState, optional
+        Incremental crawl state (see `iter_pages`).
+
+    Yields
+    ------
+    list
+        The hits of one result page.
+    """
+    if dead_letters is None:
+        dead_letters = []
+    for city in city_information:
+        print(f'Extracting {city["city"]} info')
+        yield from iter_pages(city, property_type_id, debug, url, dead_letters, state)
+    if dead_letters:
+        print(f'Retrying {len(dead_letters)} failed pages')
+        yield from iter_dead_letters(dead_letters, url, state)
+
+
+def hits_total(response_json: dict) -> int | None:
+    """
+    Returns the total number of hits of a search response, or None when it is not exact.
+
+    Parameters
+    ----------
+    response_json : dict
+        Decoded search response.
+
+    Returns
+    -------
+    int or None
+        The total hit count, None if the response does not carry it or only gives a lower bound.
+    """
+    total = response_json["hits"].get("total")
+    if isinstance(total, dict):
+        if total.get("relation", "eq") != "eq":
+            return None
+        total = total.get("value")
+    return total if isinstance(total, int) else None
+
+
+def page_fingerprint(response_body: list) -> tuple:
+    """
+    Returns the ids of the hits of a page, used to detect a repeated page without comparing the listings.
+    """
+    return tuple(hit["_id"] if "_id" in hit else hit["_source"]["listing"]["id"] for hit in response_body)
+
+
+_payload_templates = {}
+
+
+def request_payload(city_information: dict, property_type: int, page: int) -> bytes:
+    """
+    Returns the serialized search payload for a city, property type and page.
+
+    The payload of each city and property type is serialized once (see `build_request_json`)
+    and only the page number is patched in for every request.
+
+    Parameters
+    ----------
+    city_information : dict
+        A dictionary containing information about the city.
+    property_type : int
+        The property type ID to search for.
+    page : int
+        The result page to request.
+
+    Returns
+    -------
+    bytes
+        The JSON payload expected by the search service.
+    """
+    key = (city_information["id"], property_type)
+    template = _payload_templates.get(key)
+    if template is None:
+        template = PayloadTemplate(build_request_json(city_information, property_type, 1), [("variables", "page"), ("variables", "params", "page")])
+        _payload_templates[key] = template
+    return template.render(page)
+
+
+def data_extract(city_information: list, property_type_id: list, debug: bool = False, url: str = URL, dead_letters: list | None = None, state: CrawlState | None = None) -> list:
+    """
+    Extracts data based on city information and property types.
+
+    Parameters
+    ----------
+    city_information : dict
+        A dictionary containing information about the city, including its name, ID, estate name, estate ID, estate slug, and label.
+    property_type_id : list
+        A list of property type IDs to be included in the request.
+    debug : bool
+        A boolean flag to enable or disable debug mode. If enabled, additional debug information will be printed.
+    url : str
+        The search endpoint to query.
+    dead_letters : list, optional
+        List collecting the pages that failed after every retry. When given, the caller
+        retries them (see `iter_dead_letters`); otherwise they are retried before returning.
+    state : CrawlState, optional
+        Incremental crawl state. When given, only new or changed listings are returned (see `iter_pages`).
+
+    Returns
+    -------
+    list
+        A list containing the raw data extracted from the requests.
+    """
+    
+    raw_data = list(iter_pages(city_information, property_type_id, debug, url, dead_letters, state))
+    raw_data2 = list(chain(*raw_data))
     return raw_data2
 
 
-def data_transform(raw_data: dict) -> dict:
+async def extract_property_type_async(city_information: dict, property_type: int, semaphore: asyncio.Semaphore, window: int, url: str = URL, debug: bool = False, dead_letters: list | None = None, executor: ThreadPoolExecutor | None = None) -> list:
+    """
+    Extracts every page of one city and property type, requesting `window` pages at a time.
+
+    When the first page carries the total hit count every remaining page is scheduled
+    at once, otherwise pages are requested `window` at a time. Pages are evaluated in
+    order, so pagination stops at the same page as `data_extract`.
+
+    Parameters
+    ----------
+    city_information : dict
+        A dictionary containing information about the city.
+    property_type : int
+        The property type ID to extract.
+    semaphore : asyncio.Semaphore
+        Semaphore shared by every task, bounds the number of in-flight requests.
+    window : int
+        Number of pages requested at once for this property type.
+    url : str
+        The search endpoint to query.
+    debug : bool
+        A boolean flag to enable or disable debug mode.
+    dead_letters : list, optional
+        List collecting the pages that failed after every retry.
+    executor : ThreadPoolExecutor, optional
+        Threads running the blocking requests, the default executor of the loop
+        (at most `min(32, cpus + 4)` threads) when not given.
+
+    Returns
+    -------
+    list
+        The pages (lists of hits) of the property type, in page order.
+    """
+
+    async def fetch(page: int):
+        request_json = request_payload(city_information, property_type, page)
+        async with semaphore:
+            try:
+                status_code, response_content = await asyncio.get_running_loop().run_in_executor(executor, get_page, url, request_json)
+            except RetryableError as e:
+                print(e, url, request_json)
+                return e
+            except ValueError as e:
+                print(e, url, request_json)
+                return None
+        cache_response(city_information, property_type, page, response_content)
+        return loads(response_content)
+
+    def consume(response) -> bool:
+        # evaluates the next page in order, returns False once pagination is over
+        nonlocal page, failures, last_fingerprint
+        if isinstance(response, RetryableError):
+            metrics.inc("dead_letters_total", **labels)
+            dead_letters.append({"city": city_information, "property_type": property_type, "page": page})
+            failures += 1
+            page += 1
+            if failures >= MAX_CONSECUTIVE_FAILURES:
+                dead_letters.append({"city": city_information, "property_type": property_type, "page": page, "resume": True})
+                return False
+            return True
+        failures = 0
+        if response is None:
+            return False
+        response_body = response["hits"]["hits"]
+        fingerprint = page_fingerprint(response_body)
+        if not response_body or fingerprint == last_fingerprint:
+            return False
+        metrics.inc("pages_total", **labels)
+        metrics.inc("hits_total", len(response_body), **labels)
+        pages.append(response_body)
+        page += 1
+        last_fingerprint = fingerprint
+
+        if debug:
+            if page % 10 == 0:
+                print(f"Page: {page}")
+        return True
+
+    if dead_letters is None:
+        dead_letters = []
+    metrics = get_metrics()
+    labels = {"city": city_information["city"], "property_type": property_type}
+    pages = []
+    last_fingerprint = None
+    page = 1
+    failures = 0
+    print(f"Property: {property_type} ({city_information['city']})")
+
+    first = await fetch(1)
+    if not consume(first):
+        return pages
+    total = hits_total(first) if isinstance(first, dict) else None
+    if total is not None:
+        responses = await asyncio.gather(*(fetch(next_page) for next_page in range(2, -(-total // ROWS) + 1)))
+        for response in responses:
+            if not consume(response):
+                break
+        return pages
+
+    while True:
+        responses = await asyncio.gather(*(fetch(page + offset) for offset in range(window)))
+        for response in responses:
+            if not consume(response):
+                return pages
+
+
+async def data_extract_async(city_information: list, property_type_id: list, concurrency: int = 8, debug: bool = False, url: str = URL, dead_letters: list | None = None) -> list:
+    """
+    Extracts data for several cities and property types with concurrent requests.
+
+    Every (city, property type) pair is crawled at the same time and the number of
+    requests in flight is bounded by `concurrency`. The result is the same flattened
+    list of hits that calling `data_extract` for each city and chaining would return.
+
+    Parameters
+    ----------
+    city_information : list
+        A list of city dictionaries, as in the module level `city_information`.
+    property_type_id : list
+        A list of property type IDs to be included in the request.
+    concurrency : int
+        Maximum number of requests in flight at once.
+    debug : bool
+        A boolean flag to enable or disable debug mode.
+    url : str
+        The search endpoint to query.
+    dead_letters : list, optional
+        List collecting the pages that failed after every retry. When given, the caller
+        retries them; otherwise they are retried before returning.
+
+    Returns
+    -------
+    list
+        A list containing the raw hits of every city and property type.
+    """
+    retry_at_end = dead_letters is None
+    if retry_at_end:
+        dead_letters = []
+    semaphore = asyncio.Semaphore(concurrency)
+    window = max(1, concurrency // max(1, len(city_information) * len(property_type_id)))
+    # one thread per request in flight, the default executor of the loop is capped by the number of cpus
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="extract")
+
+    async def timed_extract(city: dict, property_type: int) -> list:
+        # wall time of each city and property type, they run concurrently
+        start = perf_counter()
+        try:
+            return await extract_property_type_async(city, property_type, semaphore, window, url, debug, dead_letters, executor)
+        finally:
+            get_metrics().record("extract", perf_counter() - start, city=city["city"], property_type=property_type)
+
+    tasks = [
+        timed_extract(city, property_type)
+        for city in city_information
+        for property_type in property_type_id
+    ]
+    try:
+        results = list(chain(*await asyncio.gather(*tasks)))
+    finally:
+        executor.shutdown(wait=False)
+    if retry_at_end and dead_letters:
+        results.extend(await asyncio.to_thread(retry_dead_letters, dead_letters, url))
+    return list(chain(*results))
+
+
+def data_transform(raw_data: dict) -> Listing:
     """
     Transforms raw property data by extracting and cleaning relevant fields.
 
@@ -136,56 +772,428 @@ def data_transform(raw_data: dict) -> dict:
     raw_data : dict
         The raw data containing property details as retrieved from the API.
 
+    Returns
+    -------
+    Listing
+        The cleaned and relevant property details such as id, price, area,
+        rooms, bathrooms, garage, property type, stratum, latitude and longitude
+        as floats, the geohash of the location, and city. Missing fields are None.
+    """
+
+    listing_id, price, area, rooms, bathrooms, garage, property_type, stratum, latitude, longitude, city = LISTING_EXTRACTOR.values(raw_data)
+    latitude = coordinate(latitude, 90)
+    longitude = coordinate(longitude, 180)
+    # what Listing._make does, without the Python-level __new__ of the named tuple
+    return tuple.__new__(Listing, (listing_id, price, area, rooms, bathrooms, garage, property_type, stratum, latitude, longitude, geohash(latitude, longitude), city))
+
+
+def data_transform_columns(raw_data: list) -> dict:
+    """
+    Transforms a batch of raw property data straight into columns.
+
+    Parameters
+    ----------
+    raw_data : list
+        Raw hits as retrieved from the API.
+
     Returns
     -------
     dict
-        A dictionary with the cleaned and relevant property details such as 
-        id, price, area, rooms, bathrooms, garage, property type, stratum, 
-        location, and city.
+        Column name -> list of values, with the same fields as `data_transform`.
+    """
+    columns = LISTING_EXTRACTOR.columns(raw_data)
+    columns['latitude'] = [coordinate(value, 90) for value in columns['latitude']]
+    columns['longitude'] = [coordinate(value, 180) for value in columns['longitude']]
+    columns['geohash'] = list(map(geohash, columns['latitude'], columns['longitude']))
+    return columns
+
+
+def columns_to_frame(columns: dict) -> pd.DataFrame:
+    """
+    Builds the output DataFrame from columns, equal to `to_frame` of the same rows.
+
+    Parameters
+    ----------
+    columns : dict
+        Column name -> list of values, as returned by `data_transform_columns`.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the `CSV_COLUMNS` columns, object dtype.
+    """
+    return pd.DataFrame({column: columns[column] for column in CSV_COLUMNS}, columns=CSV_COLUMNS, dtype=object)
+
+
+_shared_hits = None #raw hits inherited by forked workers of `data_transform_parallel`
+
+
+def _transform_range(bounds: tuple) -> dict:
+    start, end = bounds
+    return data_transform_columns(_shared_hits[start:end])
+
+
+def data_transform_parallel(raw_data: list, workers: int | None = None, chunk_size: int = 5000) -> pd.DataFrame:
+    """
+    Transforms raw hits in a process pool, chunk by chunk, into the output DataFrame.
+
+    Each worker turns a chunk of hits into columns (`data_transform_columns`), and the
+    column chunks are concatenated, so no dictionary per row is built. The result is
+    equal to `to_frame([data_transform(hit) for hit in raw_data])`.
+
+    Where processes can be forked, the workers inherit the hits and only receive the
+    bounds of their chunks, instead of a pickled copy of every hit.
+
+    Parameters
+    ----------
+    raw_data : list
+        Raw hits as retrieved from the API.
+    workers : int, optional
+        Worker processes, one per core by default. With 1 the chunks are transformed in this process.
+    chunk_size : int
+        Hits sent to a worker at once. Larger chunks pay less inter-process overhead,
+        smaller ones balance the load better.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the `CSV_COLUMNS` columns, object dtype.
+    """
+    global _shared_hits
+    bounds = [(start, min(start + chunk_size, len(raw_data))) for start in range(0, len(raw_data), chunk_size)]
+    columns = {column: [] for column in CSV_COLUMNS}
+    with get_metrics().stage("data_transform", workers=workers or "auto"):
+        if workers == 1:
+            results = (data_transform_columns(raw_data[start:end]) for start, end in bounds)
+            pool = None
+        elif "fork" in multiprocessing.get_all_start_methods():
+            _shared_hits = raw_data
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+            results = pool.map(_transform_range, bounds)
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            results = pool.map(data_transform_columns, (raw_data[start:end] for start, end in bounds))
+        try:
+            for chunk in results:
+                for column in CSV_COLUMNS:
+                    columns[column].extend(chunk[column])
+        finally:
+            if pool:
+                pool.shutdown()
+            _shared_hits = None
+        return columns_to_frame(columns)
+
+
+def dedup_pages(pages: Iterable[list], dedup: Deduplicator | None = None) -> Iterator[list]:
+    """
+    Drops the hits of listings already seen in the crawl, so duplicates are never transformed.
+
+    The same listing comes back on several pages when the result order shifts, and
+    across property type queries. The first hit of each listing id is kept.
+
+    Parameters
+    ----------
+    pages : iterable of list
+        Result pages, as yielded by `iter_pages`.
+    dedup : Deduplicator, optional
+        Listing ids seen so far, the shared deduplicator by default (see `dedup`).
+
+    Yields
+    ------
+    list
+        The hits of each page whose listing was not seen before.
+    """
+    dedup = dedup if dedup is not None else get_dedup()
+    metrics = get_metrics()
+    for page in pages:
+        unique = dedup.filter(page)
+        metrics.inc("duplicate_hits_total", len(page) - len(unique))
+        yield unique
+
+
+def iter_transform(pages: Iterable[list]) -> Iterator[Listing]:
     """
+    Transforms the hits of each page as the pages arrive.
 
-    cleaned_element = {}
-    cleaned_element['id'] = raw_data['_source']['listing']['id']
-    cleaned_element['price'] = raw_data['_source']['listing']['price']['amount']
-    cleaned_element['area'] = raw_data['_source']['listing']['m2']
-    cleaned_element['rooms'] = raw_data['_source']['listing']['technicalSheet'][7]['value']
-    cleaned_element['bathrooms'] = raw_data['_source']['listing']['bathrooms']
-    cleaned_element['garage'] = raw_data['_source']['listing']['garage']
-    cleaned_element['property_type'] = raw_data['_source']['listing']['property_type']['name']
-    cleaned_element['stratum'] = raw_data['_source']['listing']['stratum']
-    cleaned_element['location'] = raw_data['_source']['listing']['locations']['location_point']
-    cleaned_element['city'] = raw_data['_source']['listing']['locations']['city'][0]['name']
+    Parameters
+    ----------
+    pages : iterable of list
+        Result pages, as yielded by `iter_pages`.
+
+    Yields
+    ------
+    Listing
+        The cleaned element of each hit (see `data_transform`).
+    """
+    metrics = get_metrics()
+    for page in pages:
+        with metrics.stage("data_transform"):
+            elements = [data_transform(element) for element in page]
+        yield from elements
 
-    return cleaned_element
+
+def to_frame(data_cleaned: list) -> pd.DataFrame:
+    """
+    Builds the output DataFrame from cleaned elements.
+
+    Values are kept as object dtype so that each one is written as received, whatever
+    the other rows of the batch contain. This makes the CSV independent of how the rows
+    are split into batches.
+
+    Parameters
+    ----------
+    data_cleaned : list
+        Cleaned elements returned by `data_transform`.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the `CSV_COLUMNS` columns.
+    """
+    return pd.DataFrame(data_cleaned, columns=CSV_COLUMNS, dtype=object)
 
 
-def data_load(df: pd.DataFrame):
+def data_load(df: pd.DataFrame, path: str | None = None, sink: ParquetSink | None = None, state: CrawlState | None = None):
     """
-    Saves the cleaned DataFrame to a CSV file.
+    Saves the cleaned DataFrame to a CSV file, or to a Parquet dataset when a sink is given.
 
     Parameters
     ----------
     df : pd.DataFrame
         The DataFrame containing the cleaned real estate data.
+    path : str, optional
+        Output file, `COLOMBIA_REAL_STATE_{date}.csv` by default.
+    sink : ParquetSink, optional
+        Parquet dataset to write to instead of the CSV file.
+    state : CrawlState, optional
+        Incremental crawl state, committed once the rows are written. The output of
+        an interrupted crawl is appended to instead of replaced.
 
     Returns
     -------
     None
     """
-    df.to_csv(f"COLOMBIA_REAL_STATE_{date.today()}.csv", index = False)
+    with get_metrics().stage("data_load"):
+        if sink is not None:
+            resume_sink(sink, state)
+            sink.write(df)
+            if state:
+                state.commit(sink.partition, sink.batches)
+            return
+        path = path or f"COLOMBIA_REAL_STATE_{date.today()}.csv"
+        with open_output(path, state) as file:
+            df.to_csv(file, index = False, header = file.tell() == 0)
+            commit_output(file, path, state)
+
+
+def open_output(path: str, state: CrawlState | None = None):
+    """
+    Opens the CSV output for writing. The file of a crawl interrupted while writing
+    it is cut back to its size at the last commit of `state` and continued, any
+    other file is replaced.
+    """
+    position = state.output_position(path) if state else None
+    if position is None or not os.path.exists(path):
+        return open(path, "w", newline="")
+    file = open(path, "r+", newline="")
+    file.truncate(position)
+    file.seek(position)
+    print(f"Resuming {path} after {position} bytes")
+    return file
+
+
+def commit_output(file, path: str, state: CrawlState | None = None):
+    """
+    Flushes the CSV output to disk and commits the crawl state with its size.
+    """
+    if state is None:
+        return
+    file.flush()
+    os.fsync(file.fileno())
+    state.commit(path, file.tell())
+
+
+def resume_sink(sink: ParquetSink, state: CrawlState | None = None):
+    """
+    Keeps the batches a crawl interrupted while writing the sink committed (see `ParquetSink.resume`).
+    """
+    position = state.output_position(sink.partition) if state else None
+    if position is not None and not sink.replaced:
+        sink.resume(position)
+
+
+def iter_batches(rows: Iterable, batch_size: int, state: CrawlState | None = None) -> Iterator[list]:
+    """
+    Groups rows into lists of `batch_size` elements (the last one may be shorter).
+
+    With a crawl state, a batch also ends with the last row of every page
+    checkpointed, possibly empty, so the writer can commit the state with the output
+    holding exactly the rows of the pages checkpointed.
+    """
+    batch = []
+    checkpoints = state.checkpoints if state else 0
+    for row in rows:
+        if state and state.checkpoints != checkpoints:
+            #pulling this row checkpointed the pages of the rows before it
+            checkpoints = state.checkpoints
+            yield batch
+            batch = []
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch or (state and state.checkpoints != checkpoints):
+        yield batch
+
+
+def data_load_stream(rows: Iterable[Listing], path: str | None = None, batch_size: int = 5000, sink: ParquetSink | None = None, state: CrawlState | None = None) -> int:
+    """
+    Writes cleaned elements to a CSV file, or a Parquet dataset, in fixed-size batches.
+
+    Only one batch is held in memory at a time and the CSV file is byte-identical to
+    `data_load(to_frame(list(rows)))`.
+
+    Parameters
+    ----------
+    rows : iterable of Listing
+        Cleaned elements, as yielded by `iter_transform`.
+    path : str, optional
+        Output file, `COLOMBIA_REAL_STATE_{date}.csv` by default.
+    batch_size : int
+        Number of rows written at once.
+    sink : ParquetSink, optional
+        Parquet dataset to write to instead of the CSV file.
+    state : CrawlState, optional
+        Incremental crawl state, committed once the rows of the pages checkpointed are
+        on disk. The output of an interrupted crawl is continued instead of replaced.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    metrics = get_metrics()
+    written = 0
+    committed = state.checkpoints if state else 0
+    if sink is not None:
+        resume_sink(sink, state)
+        for batch in iter_batches(rows, batch_size, state):
+            with metrics.stage("data_load"):
+                written += sink.write(to_frame(batch))
+                if state and state.checkpoints != committed:
+                    state.commit(sink.partition, sink.batches)
+                    committed = state.checkpoints
+        return written
+
+    path = path or f"COLOMBIA_REAL_STATE_{date.today()}.csv"
+    with open_output(path, state) as file:
+        if file.tell() == 0:
+            to_frame([]).to_csv(file, index = False)
+        for batch in iter_batches(rows, batch_size, state):
+            with metrics.stage("data_load"):
+                if batch:
+                    to_frame(batch).to_csv(file, index = False, header = False)
+                if state and state.checkpoints != committed:
+                    commit_output(file, path, state)
+                    committed = state.checkpoints
+            written += len(batch)
+    return written
 
 if __name__ == '__main__':
-    
-    extracted_data = []
-    for city in city_information:
-        print(f'Extracting {city['city']} info')
-        extracted_data.append(data_extract(city, property_type_id))
 
-    extracted_data = list(chain(*extracted_data))
+    import argparse
+    parser = argparse.ArgumentParser(description="Extract real estate listings from FincaRaiz")
+    parser.add_argument("--concurrency", type=int, default=0, help="Requests in flight for the async extraction, 0 keeps the sequential crawl")
+    parser.add_argument("--rate", type=float, default=0, help="Maximum requests per second, 0 for no limit")
+    parser.add_argument("--burst", type=int, default=1, help="Requests allowed back to back before the rate applies")
+    parser.add_argument("--stream", action="store_true", help="Transform and write listings page by page instead of holding the whole crawl in memory")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows written at once in streaming mode")
+    parser.add_argument("--incremental", metavar="STATE_FILE", nargs="?", const="crawl_state.db", help="Only extract new or changed listings, keeping the crawl state in STATE_FILE")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", help="Output format, parquet writes a dataset partitioned by scrape date, city and property type")
+    parser.add_argument("--compression", default="zstd", help="Parquet compression codec")
+    parser.add_argument("--workers", type=int, default=0, help="Processes transforming the hits in parallel, 0 keeps the single-process transform")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Hits per chunk of the parallel transform")
+    parser.add_argument("--metrics", metavar="PATH", help="Record per-stage metrics and write them to PATH, Prometheus text for .prom files, JSON otherwise")
+    parser.add_argument("--trace-memory", action="store_true", help="Also measure the peak Python memory of each stage (slower)")
+    parser.add_argument("--cache", metavar="DIR", nargs="?", const=CACHE_DIR, help="Keep the raw responses in a compressed cache in DIR, to replay them later")
+    parser.add_argument("--cache-ttl-days", type=int, default=30, help="Scrape dates kept in the cache")
+    parser.add_argument("--cache-max-mb", type=float, help="Size of the cache above which the oldest scrape dates are evicted")
+    parser.add_argument("--replay", metavar="DATE", help="Transform and load the responses cached on DATE instead of crawling")
+    parser.add_argument("--dedup-bloom", metavar="LISTINGS", type=int, help="Deduplicate the hits with a Bloom filter sized for LISTINGS listings instead of a set of id hashes")
+    parser.add_argument("--scope", metavar="PATH", nargs="?", const=SCOPE_FILE, help="Read the cities and property types to crawl from a JSON config file")
+    args = parser.parse_args()
+
+    if args.scope:
+        scope = load_scope(args.scope)
+        city_information, property_type_id = scope["cities"], scope["property_types"]
+    metrics = configure_metrics(enabled=bool(args.metrics), trace_memory=args.trace_memory)
+    dedup = configure_dedup(args.dedup_bloom)
+    session = configure_session(args.rate, args.burst, pool_size=max(10, args.concurrency))
+    state = CrawlState(args.incremental) if args.incremental else None
+    if state and args.concurrency > 0:
+        parser.error("--incremental runs the sequential crawl, it can't be combined with --concurrency")
+    sink = ParquetSink(compression=args.compression, scrape_date=args.replay) if args.format == "parquet" else None
+    max_bytes = int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb else None
+    cache = configure_response_cache(args.cache or (CACHE_DIR if args.replay else None), args.cache_ttl_days, max_bytes)
+
+    if args.replay:
+        print(f'Replaying the responses cached on {args.replay}')
+        written = data_load_stream(iter_transform(dedup_pages(iter_replay(args.replay, cache))), path=f"COLOMBIA_REAL_STATE_{args.replay}.csv", batch_size=args.batch_size, sink=sink)
+        print(f'{written} listings written')
+        print(f'Dedup stats: {dedup.report()}')
+        if args.metrics:
+            metrics.write(args.metrics)
+        raise SystemExit
+
+    dead_letters = []
+    if args.stream:
+        print('Streaming extraction, cleansing and load')
+        written = data_load_stream(iter_transform(dedup_pages(iter_crawl(city_information, property_type_id, dead_letters=dead_letters, state=state))), batch_size=args.batch_size, sink=sink, state=state)
+        print(f'{written} listings written')
+        if dead_letters:
+            print(f'{len(dead_letters)} pages could not be extracted')
+        print(f'Dedup stats: {dedup.report()}')
+        print(f'Session stats: {session.report()}')
+        print(f'Retry stats: {get_retry_policy().report()}')
+        if cache:
+            print(f'Cache eviction: {cache.evict()}')
+        if args.metrics:
+            metrics.write(args.metrics)
+        raise SystemExit
+
+    if args.concurrency > 0:
+        print(f'Extracting {len(city_information)} cities with {args.concurrency} concurrent requests')
+        extracted_data = asyncio.run(data_extract_async(city_information, property_type_id, args.concurrency, dead_letters=dead_letters))
+    else:
+        extracted_data = []
+        for city in city_information:
+            print(f'Extracting {city["city"]} info')
+            extracted_data.append(data_extract(city, property_type_id, dead_letters=dead_letters, state=state))
+
+        extracted_data = list(chain(*extracted_data))
+
+    if dead_letters:
+        print(f'Retrying {len(dead_letters)} failed pages')
+        extracted_data.extend(chain(*iter_dead_letters(dead_letters, state=state)))
+        if dead_letters:
+            print(f'{len(dead_letters)} pages could not be extracted')
+    extracted_data = next(dedup_pages([extracted_data], dedup))
+    print(f'Dedup stats: {dedup.report()}')
     data_clean = []
     print('Data extracted. Initializing Data cleansing')
-    data_cleaned = [data_transform(element) for element in extracted_data]
-    data_clean = pd.DataFrame(data_cleaned)
+    if args.workers > 0:
+        data_clean = data_transform_parallel(extracted_data, args.workers, args.chunk_size)
+    else:
+        with metrics.stage("data_transform"):
+            data_cleaned = [data_transform(element) for element in extracted_data]
+            data_clean = to_frame(data_cleaned)
     print('Data cleaned')
+    print(f'Session stats: {session.report()}')
+    print(f'Retry stats: {get_retry_policy().report()}')
 
-    data_load(data_clean)
\ No newline at end of file
+    data_load(data_clean, sink=sink, state=state)
+    if cache:
+        print(f'Cache eviction: {cache.evict()}')
+    if args.metrics:
+        metrics.write(args.metrics)
+        print(f'Metrics written to {args.metrics}')